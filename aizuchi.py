@@ -62,17 +62,14 @@ DEFAULT_RESPONSES: List[str] = [
 
 
 def select_local_aizuchi(user_input: str) -> str:
-   # 感情キーワードの検出
-   detected_emotions = []
-   for emotion, keywords in EMOTION_KEYWORDS.items():
-       if any(keyword in user_input for keyword in keywords):
-           detected_emotions.append(emotion)
+   # 感情キーワードの検出（すべてのキーワードを1回の走査で探す）
+   from keyword_matcher import INTENT_MATCHER
+   emotion = INTENT_MATCHER.first(user_input, EMOTION_KEYWORDS)
 
 
    # 感情に応じた相槌を選択
-   if detected_emotions:
-       # 複数の感情が検出された場合は、最初に検出された感情を使用
-       emotion = detected_emotions[0]
+   if emotion:
+       # 複数の感情が検出された場合は、EMOTION_KEYWORDSで先にある感情を使用
        return random.choice(EMOTION_RESPONSES[emotion])
 
 
@@ -2,125 +2,154 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import time
-import subprocess
-import requests
-import json
 import sys
 import random
 import threading
+import queue
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from conversation_manager import ConversationManager
 from typing import Dict, List
-from aizuchi import select_local_aizuchi
-from openai import OpenAI
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnableWithMessageHistory
-from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory
-import numpy as np
-import sounddevice as sd
-import wave
-import tempfile
-import queue
-from speech_output import speak
-from speech_input import listen, get_is_user_speaking
-import openai
-from file_operations import save_conversation_record, save_conversation_summary
-import asyncio
+from speech_output import speak, speak_stream, split_sentences, is_speaking, echo_level, interrupt, PRIORITY_URGENT, PRIORITY_LOW
+from speech_input import listen, has_pending_speech, start_barge_in_monitor
+from file_operations import save_conversation_summary_async
+from rolling_summary import RollingSummarizer
+from topic_recommender import TopicRecommender
+from keyword_matcher import INTENT_MATCHER
+from history_store import HistoryStore
+from message_record import Message
 import aizuchi  # aizuchi.py をインポート
 
 # .envファイル読み込み
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# OpenAIクライアント
-client = OpenAI(api_key=OPENAI_API_KEY)
+# LangChainやOpenAIのクライアントは重いため、最初に必要になった時に作成する
+_lazy_objects = {}
+_lazy_lock = threading.RLock()
+
+
+def _create_message_history():
+    from langchain_community.chat_message_histories import ChatMessageHistory
+    return ChatMessageHistory()
+
+
+# セッションごとのLangChainの履歴（件数・トークン数・セッション数に上限あり）
+store = HistoryStore(_create_message_history)
+
+
+def _get_lazy(name, factory):
+    """nameのオブジェクトを初回だけfactoryで作成して返す"""
+    with _lazy_lock:
+        if name not in _lazy_objects:
+            _lazy_objects[name] = factory()
+        return _lazy_objects[name]
+
+
+def get_llm():
+    """LangChain設定"""
+    def create():
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            model="gpt-4",
+            temperature=0.7,
+            max_tokens=100,
+            api_key=OPENAI_API_KEY
+        )
+    return _get_lazy("llm", create)
 
-# LangChain設定
-llm = ChatOpenAI(
-    model="gpt-4",
-    temperature=0.7,
-    max_tokens=100,
-    api_key=OPENAI_API_KEY
-)
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", "あなたは高齢者と会話する優しい人です。やさしい日本語で短く返してください。"),
-    MessagesPlaceholder(variable_name="chat_history"),
-    ("human", "{input}")
-])
+def get_response_cache():
+    """LLM応答のキャッシュ（よくある質問をローカルで返す）"""
+    def create():
+        from response_cache import ResponseCache
+        return ResponseCache()
+    return _get_lazy("response_cache", create)
 
-chain = prompt | llm
-store = {}
 
-# 会話マネージャーのインスタンス
-conversation_manager = ConversationManager()
+def get_conversation_manager():
+    """会話マネージャーのインスタンス"""
+    def create():
+        from conversation_manager import ConversationManager
+        return ConversationManager()
+    return _get_lazy("conversation_manager", create)
+
+
+# 従来のモジュール属性名でも遅延作成したオブジェクトを参照できるようにする
+_LAZY_ATTRIBUTES = {
+    "llm": get_llm,
+    "response_cache": get_response_cache,
+    "conversation_manager": get_conversation_manager,
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 class ConversationHistory:
-    def __init__(self):
+    """セッションの全発話（終了時の要約に使う）
+
+    LLMに渡す履歴はstore（HistoryStore）の側で上限まで切り詰めるため、
+    ここでは発話を切り詰めない。
+    """
+
+    def __init__(self, summarizer=None):
         self.messages = []
+        self.summarizer = summarizer
     
     def add_message(self, role, content):
-        self.messages.append({"role": role, "content": content})
+        # 応答が付いたやり取りは途中要約に反映する
+        if self.summarizer and role == "assistant" and self.messages and self.messages[-1].role == "user":
+            self.summarizer.add_exchange(self.messages[-1].content, content)
+        self.messages.append(Message(role, content))
     
     def get_messages(self):
         return self.messages
 
-def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
-
-conversation = RunnableWithMessageHistory(
-    chain,
-    get_session_history,
-    input_messages_key="input",
-    history_messages_key="chat_history",
-)
+def get_session_history(session_id: str):
+    return store.get(session_id)
 
-# 音声認識の設定
-
-def audio_callback(indata, frames, time, status):
-    """音声入力のコールバック関数"""
-    if status:
-        print(status)
-    audio_queue.put(bytes(indata))
+# 音声認識の設定（録音と音声区間検出は audio_capture.py で行う）
 
 # 沈黙検知の設定
 SILENCE_THRESHOLD = 20  # 20秒
 last_activity_time = time.time()
 
-def get_is_user_speaking():
-    return is_user_speaking
+# 現在の会話セッションの途中要約
+session_summarizer = None
 
-def create_summary():
-    session_id = "default_session"
-    history = get_session_history(session_id)
-    if not history.messages:
+def create_summary(summarizer=None):
+    """現在の会話の途中要約を返す"""
+    summarizer = summarizer or session_summarizer
+    if summarizer is None or not summarizer.has_content():
         return "まだ十分な会話がありません。"
-    conversation_text = "\n".join([f"{msg.type}: {msg.content}" for msg in history.messages])
-    texts = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200).split_text(conversation_text)
-    docs = [Document(page_content=t) for t in texts]
-    summary = summarize_chain.run(docs)
-    return summary
+    summarizer.wait()
+    return summarizer.context_text()
 
-def create_family_message():
+def create_family_message(summarizer=None):
     """家族向けのメッセージを作成（60文字以内）"""
     try:
-        session_id = "default_session"
-        history = get_session_history(session_id)
-        
-        if not history.messages:
-            return "今日は会話がありませんでした。"
-        
-        # 会話履歴をテキストに変換
-        conversation_text = "\n".join([
-            f"{msg.type}: {msg.content}" for msg in history.messages
-        ])
+        summarizer = summarizer or session_summarizer
+        if summarizer is not None and summarizer.has_content():
+            # 途中要約を使うため、会話の長さに関係なく入力は一定の長さに収まる
+            summarizer.wait()
+            conversation_text = summarizer.context_text()
+        else:
+            session_id = "default_session"
+            history = get_session_history(session_id)
+            
+            if not history.messages:
+                return "今日は会話がありませんでした。"
+            
+            # 会話履歴をテキストに変換
+            conversation_text = "\n".join([
+                f"{msg.type}: {msg.content}" for msg in history.messages
+            ])
         
         # 家族向けメッセージのプロンプト
         family_prompt = f"""
@@ -133,36 +162,33 @@ def create_family_message():
         {conversation_text}
         """
         
-        response = llm.invoke(family_prompt)
+        response = get_llm().invoke(family_prompt)
         return response.content.strip()
     except Exception as e:
         print(f"家族向けメッセージの生成中にエラーが発生しました: {e}")
         return "メッセージの生成に失敗しました。"
 
-def load_topics():
+def get_topic_recommender():
+    """話題の推薦器（話題のストアと共有し、会話中に追加された話題もすぐに候補になる）"""
+    from topic_store import get_topic_store
     try:
-        with open(os.path.join(os.path.dirname(__file__), 'conversation_history', 'topics.json'), 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return get_topic_store().recommender
     except Exception as e:
         print(f"話題リストの読み込みに失敗: {e}")
-        return []
-
-TOPIC_STOCK = load_topics()
+        return TopicRecommender()
 
 
 def detect_intent_with_aizuchi(user_input: str):
-    # aizuchi.pyのキーワードを活用
-    detected = []
-    for emotion, keywords in aizuchi.EMOTION_KEYWORDS.items():
-        if any(keyword in user_input for keyword in keywords):
-            detected.append(emotion)
-    if detected:
-        return detected[0]  # 最初の意図を返す
+    # aizuchi.pyのキーワードと操作キーワードを1回の走査でまとめて探す
+    matched = INTENT_MATCHER.categories(user_input)
+    for emotion in aizuchi.EMOTION_KEYWORDS:
+        if emotion in matched:
+            return emotion  # 最初の意図を返す
     # 質問形
-    if user_input.endswith("？") or user_input.endswith("?") or "とは" in user_input or "教えて" in user_input:
+    if user_input.endswith("？") or user_input.endswith("?") or "question_marker" in matched:
         return "question"
     # 話題要求
-    if any(word in user_input for word in ["話題", "何か話", "面白い話", "提案", "おすすめ", "困った", "沈黙"]):
+    if "topic_request" in matched:
         return "request_topic"
     # 短い発話
     if len(user_input.strip()) <= 2:
@@ -170,79 +196,281 @@ def detect_intent_with_aizuchi(user_input: str):
     return "chat"
 
 
-def suggest_topic_from_stock():
-    if TOPIC_STOCK:
-        return random.choice(TOPIC_STOCK)
-    # デフォルト
-    return "最近気になることはありますか？"
+def suggest_topic_from_stock(recent_texts=()):
+    # 最近使っておらず、直近の会話と似ていない話題を選ぶ（なければデフォルト）
+    return get_topic_recommender().recommend(recent_texts)
+
+
+# おしゃべりの最初の話しかけ
+INITIAL_TOPICS = [
+    "今日はどのようにお過ごしですか？",
+    "楽しかったことはありました？",
+    "何のお話が良いですか？"
+]
+
+# LLMに渡すプロンプト
+QUESTION_PROMPT = "ユーザーからの質問に、やさしい日本語で50文字以内、2文以内で短く丁寧に答えてください。\n質問: {user_input}"
+CHAT_PROMPT = "高齢者と会話しています。やさしい日本語で、共感しながら50文字以内、2文以内で短く返してください。\nユーザー: {user_input}\n"
+FALLBACK_RESPONSE = "すみません、もう一度お願いします。"
+
+# ストリーミング応答の設定（0で無効）
+STREAMING_RESPONSES = os.getenv("STREAMING_RESPONSES", "1") != "0"
+SENTENCE_END = re.compile(r'[^。！？!?]*[。！？!?]+')
+
+
+def plan_response(user_input, history):
+    """意図を判定し、(ローカルの応答, LLMに渡すプロンプトのテンプレート) のどちらかを返す"""
+    messages = history.get_messages()
+    intent = detect_intent_with_aizuchi(user_input)
+    last_message = messages[-1] if messages else None
+    last_is_aizuchi = last_message and last_message.role == 'assistant' and \
+        any(word in last_message.content for word in ["はい", "ええ", "そうですね"] + aizuchi.DEFAULT_RESPONSES)
+
+    # 1. 話題要求
+    recent_texts = [m.content for m in messages[-get_topic_recommender().history_turns:]] + [user_input]
+    if intent == "request_topic":
+        return suggest_topic_from_stock(recent_texts), None
+
+    # 2. 質問
+    if intent == "question":
+        return None, QUESTION_PROMPT
+
+    # 3. 感情・興味
+    if intent in ["happy", "sad", "interest"]:
+        aizuchi_resp = aizuchi.select_local_aizuchi(user_input)
+        # 共感のみ、または共感＋一言
+        return f"{aizuchi_resp}", None
+
+    # 4. 短い発話
+    if intent == "short":
+        if last_is_aizuchi:
+            return suggest_topic_from_stock(recent_texts), None
+        return random.choice([r for r in ["はい", "ええ", "そうですね"] if r != (last_message.content if last_message else None)]), None
+
+    # 5. 通常の雑談
+    return None, CHAT_PROMPT
+
+
+def use_response_cache(template, user_input):
+    """キャッシュを使うかどうか（質問への応答のうち、今日・明日など日時で答えが変わらないものだけ）"""
+    from response_cache import is_time_relative
+    return template == QUESTION_PROMPT and not is_time_relative(user_input)
+
+
+def stream_sentences(llm_prompt, cancel_event=None):
+    """LLMの応答をストリーミングで受け取り、文がそろうごとに返すジェネレータ
+
+    cancel_eventがセットされたら、次のチャンクが届いた時点で受信をやめる。
+    """
+    stripper = PrefixStripper()
+    buffer = ""
+    chunks = get_llm().stream(llm_prompt)
+    for chunk in chunks:
+        if cancel_event is not None and cancel_event.is_set():
+            # 接続を閉じて、残りの応答は受け取らない
+            chunks.close()
+            return
+        buffer += stripper.feed(chunk.content)
+        end = 0
+        for m in SENTENCE_END.finditer(buffer):
+            sentence = m.group().strip()
+            if sentence:
+                yield sentence
+            end = m.end()
+        buffer = buffer[end:]
+    buffer = (buffer + stripper.flush()).strip()
+    if buffer:
+        yield buffer
+
+
+def llm_sentences(template, user_input, cancel_event=None):
+    """LLMの応答を文ごとに返す（キャッシュがあればそれを使い、失敗時は定型の応答を返す）"""
+    cacheable = use_response_cache(template, user_input)
+    cached = get_response_cache().get(template, user_input) if cacheable else None
+    if cached is not None:
+        yield from split_sentences(cached)
+        return
+    llm_prompt = template.format(user_input=user_input)
+    sentences = []
+    try:
+        if STREAMING_RESPONSES:
+            for sentence in stream_sentences(llm_prompt, cancel_event):
+                sentences.append(sentence)
+                yield sentence
+        else:
+            response = postprocess_response(get_llm().invoke(llm_prompt).content.strip())
+            if response:
+                sentences.append(response)
+                yield response
+    except Exception as e:
+        print(f"応答生成エラー: {e}")
+        # 途中で失敗した応答はキャッシュしない
+        if not sentences:
+            yield FALLBACK_RESPONSE
+        return
+    if cancel_event is not None and cancel_event.is_set():
+        # 中止された応答は途中までなのでキャッシュしない
+        return
+    if sentences:
+        if cacheable:
+            get_response_cache().put(template, user_input, "".join(sentences))
+    else:
+        yield FALLBACK_RESPONSE
+
+
+# 先行相槌の設定
+SPECULATIVE_AIZUCHI = os.getenv("SPECULATIVE_AIZUCHI", "1") != "0"
+AIZUCHI_DEADLINE = float(os.getenv("AIZUCHI_DEADLINE", "0.8"))  # この秒数内にLLMが応答すれば相槌は省く
+
+# LLM呼び出し用のスレッド
+llm_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm")
+
+
+def _queue_sentences(sentences, results, cancel_event=None):
+    """別スレッドで文を生成してキューに入れる（終わりはNone）"""
+    try:
+        for sentence in sentences:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            results.put(sentence)
+    finally:
+        results.put(None)
+
+
+def _next_sentence(results, cancel_event=None, timeout=None):
+    """キューから次の文を取り出す（中止されたらNone、timeout秒で届かなければqueue.Empty）"""
+    if cancel_event is None:
+        return results.get(timeout=timeout)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not cancel_event.is_set():
+        wait = 0.05 if deadline is None else min(0.05, deadline - time.monotonic())
+        if wait <= 0:
+            raise queue.Empty
+        try:
+            return results.get(timeout=wait)
+        except queue.Empty:
+            continue
+    return None
+
+
+def _drain(results, first, cancel_event=None):
+    """キューに入った文を順に返す"""
+    sentence = first
+    while sentence is not None:
+        yield sentence
+        sentence = _next_sentence(results, cancel_event)
+
 
+def respond(user_input, history, on_sentence=None, cancel_event=None):
+    """応答を生成して読み上げ、応答全体のテキストを返す
 
-def generate_response(user_input, history):
-    """ユーザーの入力に応じて応答を生成（意図判定・話題ストック・LLM活用）"""
+    LLMを使う応答は別スレッドで生成を始め、AIZUCHI_DEADLINE秒以内に最初の文が
+    届かなければ、その間にローカルの相槌を読み上げる。
+    on_sentenceには読み上げる文が決まるたびにそれまでの応答全体が渡される。
+    cancel_eventがセットされると、生成の待ちをやめ、それまでの応答を返す
+    （読み上げの中止は speech_output.interrupt() で行う）。
+    相槌の読み上げに割り込まれた時や、ユーザーが話し始めている時は、
+    応答を読み上げずに生成を止めてNoneを返す。
+    """
     try:
-        messages = history.get_messages()
-        session_id = "default_session"
-        intent = detect_intent_with_aizuchi(user_input)
-        last_message = messages[-1] if messages else None
-        last_is_aizuchi = last_message and last_message.get('role') == 'assistant' and \
-            any(word in last_message.get('content', '') for word in ["はい", "ええ", "そうですね"] + aizuchi.DEFAULT_RESPONSES)
-
-        # 1. 話題要求
-        if intent == "request_topic":
-            return suggest_topic_from_stock()
-
-        # 2. 質問
-        if intent == "question":
-            prompt = f"ユーザーからの質問に、やさしい日本語で50文字以内、2文以内で短く丁寧に答えてください。\n質問: {user_input}"
-            response = llm.invoke(prompt)
-            return response.content.strip()
-
-        # 3. 感情・興味
-        if intent in ["happy", "sad", "interest"]:
-            aizuchi_resp = aizuchi.select_local_aizuchi(user_input)
-            # 共感のみ、または共感＋一言
-            return f"{aizuchi_resp}"
-
-        # 4. 短い発話
-        if intent == "short":
-            if last_is_aizuchi:
-                return suggest_topic_from_stock()
-            return random.choice([r for r in ["はい", "ええ", "そうですね"] if r != (last_message.get('content') if last_message else None)])
-
-        # 5. 通常の雑談
-        prompt = f"高齢者と会話しています。やさしい日本語で、共感しながら50文字以内、2文以内で短く返してください。\nユーザー: {user_input}\n"
-        response = llm.invoke(prompt)
-        return response.content.strip()
+        local_response, template = plan_response(user_input, history)
     except Exception as e:
         print(f"応答生成エラー: {e}")
-        return "すみません、もう一度お願いします。"
+        local_response, template = FALLBACK_RESPONSE, None
+
+    if template is None:
+        if on_sentence:
+            on_sentence(local_response)
+        speak(local_response)
+        return local_response
+
+    # 読み上げが割り込まれた時も、LLMの応答の受信を止められるようにする
+    cancel_event = cancel_event or threading.Event()
+    results = queue.Queue()
+    llm_executor.submit(_queue_sentences, llm_sentences(template, user_input, cancel_event), results, cancel_event)
+    try:
+        first = _next_sentence(results, cancel_event, timeout=AIZUCHI_DEADLINE if SPECULATIVE_AIZUCHI else None)
+    except queue.Empty:
+        # 応答待ちの沈黙を相槌で埋める（割り込まれたら応答は読み上げない）
+        if not speak(aizuchi.select_local_aizuchi(user_input), PRIORITY_LOW):
+            cancel_event.set()
+            return None
+        first = _next_sentence(results, cancel_event)
+
+    # ユーザーが話し始めていたら、応答を重ねて読み上げずに聞き取りに戻る
+    if has_pending_speech():
+        cancel_event.set()
+        return None
+
+    sentences = []
+
+    def collect():
+        for sentence in _drain(results, first, cancel_event):
+            sentences.append(sentence)
+            if on_sentence:
+                on_sentence("".join(sentences))
+            yield sentence
+
+    # 読み上げが割り込まれると同じcancel_eventがセットされ、生成の待ちもすぐに終わる
+    if not speak_stream(collect(), cancel_event=cancel_event):
+        cancel_event.set()
+    return "".join(sentences) or None
+
+# 応答の先頭から取り除く話者名
+RESPONSE_PREFIXES = ["AI:", "アシスタント:", "Assistant:", "assistant:", "ＡＩ："]
+
+class PrefixStripper:
+    """応答の先頭のAI:やアシスタント:などを、逐次届くテキストから取り除く"""
 
-def save_conversation_background(history):
-    thread = threading.Thread(target=save_conversation_record, args=(history,))
-    thread.start()
+    def __init__(self):
+        self.pending = ""
+        self.done = False
+
+    def feed(self, text):
+        """届いたテキストを渡し、確定した部分を返す"""
+        if self.done:
+            return text
+        self.pending += text
+        while True:
+            head = self.pending.lstrip()
+            matched = next((p for p in RESPONSE_PREFIXES if head.startswith(p)), None)
+            if matched:
+                self.pending = head[len(matched):]
+                continue
+            # まだ話者名の途中かもしれない場合は保留する
+            if any(p.startswith(head) for p in RESPONSE_PREFIXES):
+                return ""
+            self.done = True
+            self.pending = ""
+            return head
+
+    def flush(self):
+        """保留中のテキストを返す"""
+        text = "" if self.done else self.pending.lstrip()
+        self.done = True
+        self.pending = ""
+        return text
 
 def postprocess_response(response: str) -> str:
     # 先頭のAI:やアシスタント:などを除去
-    for prefix in ["AI:", "アシスタント:", "Assistant:", "assistant:", "ＡＩ："]:
-        if response.startswith(prefix):
-            response = response[len(prefix):].strip()
-    return response
+    stripper = PrefixStripper()
+    return (stripper.feed(response) + stripper.flush()).strip()
 
 def start_voice_chat():
     """音声対話を開始"""
     print("音声対話を開始します。終了するには「終了」と言ってください。")
     
-    # 会話履歴の初期化
-    history = ConversationHistory()
+    # 会話履歴の初期化（やり取りごとに途中要約を更新する）
+    global session_summarizer
+    session_summarizer = RollingSummarizer()
+    history = ConversationHistory(summarizer=session_summarizer)
     start_time = time.time()
     
+    # 読み上げ中に話し始めたら、読み上げを止めて聞き取る
+    start_barge_in_monitor(is_speaking, echo_level, interrupt)
+    
     # 初期トピックの提案
-    initial_topics = [
-        "今日はどのようにお過ごしですか？",
-        "楽しかったことはありました？",
-        "何のお話が良いですか？"
-    ]
-    initial_topic = random.choice(initial_topics)
+    initial_topic = random.choice(INITIAL_TOPICS)
     speak(initial_topic)
     
     while True:
@@ -254,20 +482,20 @@ def start_voice_chat():
         
         if "終了" in user_input:
             end_time = time.time()
-            speak("会話を終了します。")
-            # 会話履歴の保存
+            speak("会話を終了します。", PRIORITY_URGENT)
+            # 会話履歴の要約と保存はバックグラウンドで行い、すぐに戻る
             try:
-                save_conversation_summary(history.get_messages(), start_time, end_time)
+                save_conversation_summary_async(history.get_messages(), start_time, end_time, summarizer=session_summarizer)
             except Exception as e:
                 print(f"会話履歴の保存に失敗しました: {e}")
+            print(f"応答キャッシュ: {get_response_cache().stats()}")
+            print(f"会話履歴のメモリ: {store.memory_report()}")
             break
             
         history.add_message("user", user_input)
-        response = generate_response(user_input, history)
+        response = respond(user_input, history)
         
-        if response:  # 応答がある場合のみ話す
-            response = postprocess_response(response)
-            speak(response)
+        if response:  # 応答がある場合のみ記録
             history.add_message("assistant", response)
 
 if __name__ == "__main__":
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+import sounddevice as sd
+
+# 録音の設定
+SAMPLE_RATE = 16000  # サンプリングレート
+FRAME_MS = 30  # 1フレームの長さ（ミリ秒）
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+MAX_QUEUED_FRAMES = 200  # 約6秒分を超えたら古いフレームから捨てる
+
+# 音声区間検出の設定
+SPEECH_RATIO = 3.0  # 騒音レベルの何倍で発話とみなすか
+MIN_SPEECH_ENERGY = 150.0  # 発話とみなす最低エネルギー
+NOISE_ALPHA = 0.05  # 騒音レベルの追従速度
+START_FRAMES = 3  # 発話開始とみなす連続フレーム数
+PRE_ROLL_MS = 300  # 発話開始前に含める音声（ミリ秒）
+END_SILENCE_MS = 700  # 発話終了とみなす無音の長さ（ミリ秒）
+MAX_UTTERANCE_SEC = 30  # 1発話の最大長（秒）
+
+# 読み上げ中の割り込み（バージイン）検出の設定
+# スピーカーの出力レベルのうちマイクに回り込む割合（未設定なら最初の読み上げ中に測る）
+ECHO_RATIO = float(os.getenv("BARGE_IN_ECHO_RATIO")) if os.getenv("BARGE_IN_ECHO_RATIO") else None
+ECHO_CALIBRATION_FRAMES = 30  # 回り込む割合を測る読み上げ中のフレーム数（約0.9秒）
+ECHO_PERCENTILE = 90  # 測った割合のうち、この百分位を回り込みの大きさとみなす
+ECHO_MARGIN = 1.5  # 測った割合に掛ける余裕
+BARGE_IN_FRAMES = 3  # 読み上げ中に発話とみなす連続フレーム数（約90ミリ秒）
+
+class ListenTimeout(Exception):
+    """待ち時間内に発話が始まらなかったことを表す例外"""
+
+class ListenCancelled(Exception):
+    """聞き取りが外から中止されたことを表す例外"""
+
+def frame_energy(frame):
+    """フレームのRMSエネルギーを返す"""
+    samples = frame.astype(np.float32)
+    return float(np.sqrt(np.mean(samples * samples)))
+
+class EnergyVAD:
+    """騒音レベルに追従するエネルギー型の音声区間検出"""
+
+    def __init__(self, ratio=SPEECH_RATIO, min_energy=MIN_SPEECH_ENERGY, alpha=NOISE_ALPHA, echo_ratio=ECHO_RATIO):
+        self.ratio = ratio
+        self.min_energy = min_energy
+        self.alpha = alpha
+        self.noise_floor = None
+        self.echo_ratio = echo_ratio
+        self.echo_samples = []  # 測定中の (マイクの音量 / スピーカーの出力レベル)
+
+    def threshold(self):
+        """現在の発話判定閾値を返す"""
+        if self.noise_floor is None:
+            return self.min_energy
+        return max(self.min_energy, self.noise_floor * self.ratio)
+
+    def calibrate(self, frames):
+        """無音とみなせるフレーム列から騒音レベルを初期化する"""
+        energies = [frame_energy(f) for f in frames]
+        if energies:
+            self.noise_floor = float(np.median(energies))
+
+    def calibrate_echo(self, energy, echo_level):
+        """読み上げ中のマイクの音量と出力レベルの比を集め、回り込む割合を決める
+
+        echo_levelは再生する音声のRMSで、マイクに届く音量とは単位が違うため、
+        実際の比はスピーカーの音量やマイクとの距離で大きく変わる。
+        """
+        if echo_level < self.min_energy:
+            # 読み上げの切れ目では比が大きく出るため使わない
+            return
+        self.echo_samples.append(energy / echo_level)
+        if len(self.echo_samples) >= ECHO_CALIBRATION_FRAMES:
+            self.echo_ratio = float(np.percentile(self.echo_samples, ECHO_PERCENTILE)) * ECHO_MARGIN
+            self.echo_samples = []
+            print(f"スピーカーからの回り込みを測定しました（BARGE_IN_ECHO_RATIO={self.echo_ratio:.3f}）")
+
+    def is_speech(self, frame, echo_level=0.0):
+        """フレームが発話かどうかを判定し、無音なら騒音レベルを更新する
+
+        echo_levelには読み上げ中のスピーカーの出力レベルを渡す。回り込んだ
+        読み上げの音を発話とみなさないよう、その分だけ閾値を上げる。
+        回り込む割合がまだ決まっていなければ、最初の読み上げ中に測り、
+        測り終わるまでは読み上げ中の音を発話とみなさない。
+        """
+        energy = frame_energy(frame)
+        if self.noise_floor is None:
+            # 騒音レベルは読み上げの音が入っていないフレームから始める
+            if not echo_level:
+                self.noise_floor = energy
+            return False
+        if echo_level and self.echo_ratio is None:
+            self.calibrate_echo(energy, echo_level)
+            return False
+        if energy > max(self.threshold(), echo_level * (self.echo_ratio or 0.0)):
+            return True
+        # 読み上げの音は騒音レベルに含めない
+        if not echo_level:
+            self.noise_floor += self.alpha * (energy - self.noise_floor)
+        return False
+
+class AudioCapture:
+    """入力ストリームを開いたまま保持し、発話区間ごとにフレームを供給するクラス"""
+
+    def __init__(self, samplerate=SAMPLE_RATE, frame_samples=FRAME_SAMPLES, device=None, vad=None):
+        self.samplerate = samplerate
+        self.frame_samples = frame_samples
+        self.device = device
+        self.vad = vad or EnergyVAD()
+        self.frames = queue.Queue(maxsize=MAX_QUEUED_FRAMES)
+        self.stream = None
+        self.lock = threading.Lock()
+
+    def _callback(self, indata, frames, time_info, status):
+        """入力ストリームのコールバック関数"""
+        if status:
+            print(status)
+        frame = indata[:, 0].copy()
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            # 読み出しが追いつかない場合は古いフレームを捨てる
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                pass
+            self.frames.put_nowait(frame)
+
+    def start(self, calibration_sec=1.0):
+        """入力ストリームを開始し、最初の一回だけ騒音レベルを測定する"""
+        with self.lock:
+            if self.stream is not None:
+                return
+            self.stream = sd.InputStream(
+                samplerate=self.samplerate,
+                blocksize=self.frame_samples,
+                channels=1,
+                dtype="int16",
+                device=self.device,
+                callback=self._callback
+            )
+            self.stream.start()
+        count = max(1, int(calibration_sec * 1000 / FRAME_MS))
+        calibration = [f for f in (self.read_frame(timeout=1.0) for _ in range(count)) if f is not None]
+        self.vad.calibrate(calibration)
+        print(f"マイクを初期化しました（騒音レベル: {self.vad.noise_floor or 0:.0f}）")
+
+    def stop(self):
+        """入力ストリームを停止する"""
+        with self.lock:
+            if self.stream is not None:
+                self.stream.stop()
+                self.stream.close()
+            self.stream = None
+
+    def read_frame(self, timeout=None):
+        """フレームを1つ取り出す（タイムアウト時はNone）"""
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def flush(self):
+        """溜まっているフレームを捨てる"""
+        while self.read_frame(timeout=0) is not None:
+            pass
+
+    def barge_in_frames(self, is_playing, echo_level, stop_event=None):
+        """読み上げ中にユーザーが話し始めたら、発話開始までのフレームを返す
+
+        is_playing()が偽になるか、stop_eventがセットされたらNoneを返す。
+        発話の判定にはecho_level()で見積もったスピーカーからの回り込みを考慮する。
+        """
+        pre_roll = deque(maxlen=max(1, PRE_ROLL_MS // FRAME_MS))
+        speech_run = 0
+        while is_playing():
+            if stop_event is not None and stop_event.is_set():
+                return None
+            frame = self.read_frame(timeout=0.1)
+            if frame is None:
+                continue
+            pre_roll.append(frame)
+            if self.vad.is_speech(frame, echo_level()):
+                speech_run += 1
+                if speech_run >= BARGE_IN_FRAMES:
+                    return list(pre_roll)
+            else:
+                speech_run = 0
+        return None
+
+    def utterance_frames(self, timeout=10, end_silence_ms=END_SILENCE_MS, max_sec=MAX_UTTERANCE_SEC,
+                         cancel_event=None, started=None):
+        """発話開始を待ち、発話中のフレームを逐次返すジェネレータ。
+
+        末尾の無音を検出した時点で終了する。timeout秒以内に発話が始まらない場合は
+        ListenTimeoutを、cancel_eventがセットされた場合はListenCancelledを送出する。
+        startedに発話開始までのフレームを渡すと、発話開始を待たずにその続きを返す。
+        """
+        pre_roll = deque(started or (), maxlen=None if started else max(1, PRE_ROLL_MS // FRAME_MS))
+        end_frames = max(1, end_silence_ms // FRAME_MS)
+        max_frames = int(max_sec * 1000 / FRAME_MS)
+        deadline = time.monotonic() + timeout
+        speech_run = 0
+        while not started:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ListenCancelled()
+            frame = self.read_frame(timeout=0.1)
+            if frame is None:
+                if time.monotonic() > deadline:
+                    raise ListenTimeout()
+                continue
+            pre_roll.append(frame)
+            if self.vad.is_speech(frame):
+                speech_run += 1
+                if speech_run >= START_FRAMES:
+                    break
+            else:
+                speech_run = 0
+                if time.monotonic() > deadline:
+                    raise ListenTimeout()
+
+        # 発話開始直前の音声も含めて返す
+        yield from pre_roll
+        total = len(pre_roll)
+        silent = 0
+        while total < max_frames:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ListenCancelled()
+            frame = self.read_frame(timeout=1.0)
+            if frame is None:
+                break
+            yield frame
+            total += 1
+            silent = 0 if self.vad.is_speech(frame) else silent + 1
+            if silent >= end_frames:
+                break
+
+    def utterances(self, timeout=10):
+        """発話区間ごとの音声バッファを返し続けるジェネレータ"""
+        while True:
+            try:
+                frames = list(self.utterance_frames(timeout=timeout))
+            except ListenTimeout:
+                continue
+            if frames:
+                yield np.concatenate(frames)
@@ -3,58 +3,49 @@
 
 import os
 import json
-import csv
 import random
 import datetime
 from collections import defaultdict
-import openai
 from dotenv import load_dotenv
+from topic_store import TOPICS_DIR, get_topic_store
+from message_record import Message, GameResult
+from session_archive import get_session_archive
 
 # .envファイルの読み込み
 load_dotenv()
 
 class ConversationManager:
-    def __init__(self, storage_dir="conversation_history"):
+    def __init__(self, storage_dir=TOPICS_DIR):
         """会話履歴管理クラスの初期化"""
         self.storage_dir = storage_dir
         self.current_conversation = []
-        self.topics = []
+        self.topic_store = None
         self.game_results = []
         self.summaries = []
         self.start_time = datetime.datetime.now()
         
         # 保存ディレクトリの作成
         os.makedirs(self.storage_dir, exist_ok=True)
+        # 過去の会話セッションは開始時刻の索引付きで保存する
+        self.archive = get_session_archive(os.path.join(self.storage_dir, "sessions.db"))
         
         # 過去の会話トピックと要約の読み込み
         self.load_topics()
         self.load_summaries()
     
+    @property
+    def topics(self):
+        """保存済みのトピック一覧"""
+        return self.topic_store.topics
+    
+    @property
+    def topic_recommender(self):
+        """トピックの推薦器（ストアと共有し、追加したトピックもすぐに候補になる）"""
+        return self.topic_store.recommender
+    
     def load_topics(self):
-        """過去の会話トピックを読み込む"""
-        topics_file = os.path.join(self.storage_dir, "topics.json")
-        if os.path.exists(topics_file):
-            try:
-                with open(topics_file, "r", encoding="utf-8") as f:
-                    self.topics = json.load(f)
-            except Exception as e:
-                print(f"トピック読み込みエラー: {e}")
-                self.topics = []
-        else:
-            # デフォルトのトピック
-            self.topics = [
-                "今日はどんな一日でしたか？",
-                "最近見た映画や読んだ本について教えてください",
-                "お気に入りの食べ物は何ですか？",
-                "今日のニュースで気になることはありますか？",
-                "天気はどうですか？",
-                "何か楽しい予定はありますか？",
-                "最近うれしかったことを教えてください",
-                "健康のために何か気をつけていることはありますか？",
-                "昔の思い出について話しませんか？",
-                "今度の休みには何をする予定ですか？"
-            ]
-            self.save_topics()
+        """過去の会話トピックを読み込む（ストアは同じディレクトリを使う全インスタンスで共有する）"""
+        self.topic_store = get_topic_store(self.storage_dir)
     
     def load_summaries(self):
         """過去の会話要約を読み込む"""
@@ -68,13 +59,8 @@ class ConversationManager:
                 self.summaries = []
     
     def save_topics(self):
-        """トピックをファイルに保存"""
-        topics_file = os.path.join(self.storage_dir, "topics.json")
-        try:
-            with open(topics_file, "w", encoding="utf-8") as f:
-                json.dump(self.topics, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"トピック保存エラー: {e}")
+        """トピックをスナップショットにまとめて保存（書き込みはバックグラウンドで行う）"""
+        self.topic_store.compact()
     
     def save_summaries(self):
         """要約をファイルに保存"""
@@ -103,12 +89,7 @@ class ConversationManager:
         if speaker == "user" and ("プログラム終了" in text or "プログラムを終了" in text):
             return
             
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.current_conversation.append({
-            "timestamp": timestamp,
-            "speaker": speaker,
-            "text": text
-        })
+        self.current_conversation.append(Message(speaker, text))
         
         # ユーザーの発言から新しいトピックを抽出
         if speaker == "user" and len(text) > 5:
@@ -116,16 +97,15 @@ class ConversationManager:
             if not any(word in text for word in ["うん", "はい", "そうですね", "なるほど"]):
                 # 質問でない場合は会話トピックとして記録
                 if "？" not in text and "?" not in text:
-                    # 重複を避けてトピックを追加
-                    if text not in self.topics and len(self.topics) < 100:  # 最大100トピックまで
-                        self.topics.append(text)
-                        self.save_topics()
+                    # 重複を避けてトピックを追加（最大100トピックまで、保存は追記ログに行う）
+                    self.topic_store.add(text)
     
     def get_random_topic(self):
-        """ランダムなトピックを取得"""
+        """最近使っておらず、直近の会話と似ていないトピックを取得"""
         if not self.topics:
             return "今日はどんな一日でしたか？"
-        return random.choice(self.topics)
+        recent_texts = [msg.content for msg in self.current_conversation[-self.topic_recommender.history_turns:]]
+        return self.topic_recommender.recommend(recent_texts)
     
     def suggest_topic(self):
         """会話履歴から新しい話題を提案"""
@@ -150,6 +130,7 @@ class ConversationManager:
             {self.current_conversation}
             """
             
+            import openai
             response = openai.ChatCompletion.create(
                 model="gpt-3.5-turbo",
                 messages=[{"role": "user", "content": topic_prompt}],
@@ -165,29 +146,25 @@ class ConversationManager:
     
     def record_game_result(self, game_type, score, total_questions, duration):
         """ゲーム結果を記録"""
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.game_results.append({
-            "timestamp": timestamp,
-            "game_type": game_type,
-            "score": score,
-            "total_questions": total_questions,
-            "duration": duration
-        })
+        self.game_results.append(GameResult(game_type, score, total_questions, duration))
+    
+    def save_session(self):
+        """会話セッションをアーカイブに保存し、セッションIDを返す"""
+        return self.archive.save_session(self.current_conversation, started=self.start_time)
     
     def save_session_to_csv(self):
-        """会話セッションをCSVファイルに保存"""
+        """会話セッションをアーカイブに保存し、CSVファイルにも書き出す"""
         try:
+            session_id = self.save_session()
+            
             # 現在の日時を取得
             now = datetime.datetime.now()
-            filename = f"conversation_log_{now.strftime('%Y%m%d_%H%M%S')}.csv"
+            export_dir = os.path.join(self.storage_dir, "exports")
+            os.makedirs(export_dir, exist_ok=True)
+            filename = os.path.join(export_dir, f"conversation_log_{now.strftime('%Y%m%d_%H%M%S')}.csv")
             
             # CSVファイルに保存
-            with open(filename, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(['timestamp', 'role', 'content'])
-                for msg in self.current_conversation:
-                    writer.writerow([msg['timestamp'], msg['speaker'], msg['text']])
-                    
+            self.archive.export_csv(session_id, filename)
             print(f"会話履歴を{filename}に保存しました")
             
         except Exception as e:
@@ -205,20 +182,20 @@ class ConversationManager:
         
         # 会話の要約
         if self.current_conversation:
-            user_messages = [msg for msg in self.current_conversation if msg["speaker"] == "user"]
-            assistant_messages = [msg for msg in self.current_conversation if msg["speaker"] == "assistant"]
+            user_messages = [msg for msg in self.current_conversation if msg.role == "user"]
+            assistant_messages = [msg for msg in self.current_conversation if msg.role == "assistant"]
             
             summary_lines.append(f"会話回数: {len(user_messages)}回")
             
             if user_messages:
-                summary_lines.append(f"最初の会話: {user_messages[0]['text'][:30]}...")
-                summary_lines.append(f"最後の会話: {user_messages[-1]['text'][:30]}...")
+                summary_lines.append(f"最初の会話: {user_messages[0].content[:30]}...")
+                summary_lines.append(f"最後の会話: {user_messages[-1].content[:30]}...")
         
         # ゲーム結果の要約
         if self.game_results:
             game_types = defaultdict(list)
             for result in self.game_results:
-                game_types[result["game_type"]].append(result["score"])
+                game_types[result.game_type].append(result.score)
             
             summary_lines.append("\n◆ ゲーム結果")
             for game_type, scores in game_types.items():
@@ -237,20 +214,22 @@ class ConversationManager:
         self.game_results = []
         self.start_time = datetime.datetime.now()
     
-    def load_conversation_history(self):
-        """会話履歴を読み込む"""
-        # 最新の会話履歴ファイルを探す
-        conversation_files = [f for f in os.listdir(self.storage_dir) if f.startswith("conversation_")]
-        if not conversation_files:
-            return []
-        
-        latest_file = max(conversation_files)
-        file_path = os.path.join(self.storage_dir, latest_file)
-        
+    def load_conversation_history(self, offset=0, limit=100):
+        """前回の会話履歴を読み込む（最新のセッションの発話を offset から limit 件）
+
+        戻り値はMessageのリスト（以前のCSVの行の辞書ではないため、
+        msg["role"] ではなく msg.role・msg.content で参照する）。
+        """
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                return list(reader)
+            # 最新のセッションは索引から1件引くだけで見つかる
+            session = self.archive.latest_session()
+            if session is None:
+                return []
+            return session.turns(offset, limit)
         except Exception as e:
             print(f"会話履歴読み込みエラー: {e}")
-            return [] 
\ No newline at end of file
+            return []
+    
+    def sessions_between(self, start, end):
+        """期間内に開始した会話セッションを古い順に取得（発話は必要な時に読み込む）"""
+        return self.archive.sessions_between(start, end) 
\ No newline at end of file
@@ -1,20 +1,37 @@
 import csv
-import json
 import subprocess
 from datetime import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from langchain_openai import ChatOpenAI
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from record_journal import get_record_journal
+from message_record import Message
+from session_archive import get_session_archive
+# LangChainは起動を遅くするため、使う関数の中で読み込む
 
-SERVICE_ACCOUNT_FILE = "rzpi_chat.json"
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 
-# 会話の内容をCSVに保存する関数
+# シートのヘッダー行
+SUMMARY_HEADER = ["日時", "会話時間", "要約", "感情キーワード"]
+CALC_GAME_HEADER = ["実施日時", "所要時間", "スコア", "詳細"]
+
+# 途中で中止された会話の会話時間に付ける印
+PARTIAL_MARK = "（中断）"
+
+# 会話の内容をアーカイブに保存し、CSVにも書き出す関数
 def save_conversation_to_csv(conversations):
     now = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"conversation_{now}.csv"
+    archive = get_session_archive()
+    export_dir = os.path.join(os.path.dirname(archive.path), "exports")
+    filename = os.path.join(export_dir, f"conversation_{now}.csv")
     try:
+        # (ユーザー, AI) の組を発話ごとの記録にして、索引付きで保存する
+        messages = []
+        for user_text, ai_text in conversations:
+            messages.append(Message("user", user_text))
+            messages.append(Message("assistant", ai_text))
+        archive.save_session(messages)
+        os.makedirs(export_dir, exist_ok=True)
         with open(filename, mode='w', newline='', encoding='utf-8') as file:
             writer = csv.writer(file)
             writer.writerow(["User", "AI"])  # ヘッダー
@@ -49,122 +66,134 @@ def run_js_summary_script(conversations):
 # スプレッドシートに要約を追加する関数
 def append_summary_to_sheet(summary):
     try:
-        # Google Sheets API および Google Drive API のスコープと認証情報を設定
-        scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
-        
-        # 認証してGoogleスプレッドシートにアクセス
-        client = gspread.authorize(credentials)
-        
-        # スプレッドシート名を指定（"conversation_log"）
-        sheet = client.open("conversation_log").sheet1  # シートの名前が "Sheet1" の場合
-        
         # 現在の日時と要約を取得
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # スプレッドシートに新しい行を追加（新しいデータは下に追加される）
-        sheet.append_row([now, summary])
-        print(f"Appended summary to Google Sheets")  # デバッグ用ログ
+        # スプレッドシート名を指定（"conversation_log"）の先頭シートに追加（送信はバックグラウンドで行う）
+        get_record_journal().record(None, [now, summary], spreadsheet_name="conversation_log")
+        print(f"Queued summary for Google Sheets")  # デバッグ用ログ
     except Exception as e:
         print(f"Failed to append to Google Sheets: {e}")  # デバッグ用ログ
 
-def save_conversation_summary(history, start_time, end_time):
-    """
-    Sheet1に、1セッションごとに1行、
-    日時・会話時間・ユーザー発話要約・感情キーワードを保存
-    """
-    # ユーザー発話のみ抽出
-    user_texts = [msg['content'] for msg in history if msg.get('role') == 'user']
-    if not user_texts:
-        print("ユーザー発話がありません")
-        return False
-    user_text = "\n".join(user_texts)
+# 要約用のLLMクライアント（初回に作成して使い回す）
+_summary_llm = None
+_summary_llm_lock = threading.Lock()
 
-    # 会話時間計算
-    duration = end_time - start_time
-    minutes = int(duration // 60)
-    seconds = int(duration % 60)
-    conversation_time = f"{minutes}分{seconds}秒"
+# 要約と感情キーワードの出力形式
+SUMMARY_SCHEMA = {
+    "title": "conversation_summary",
+    "description": "ユーザー発話の要約と感情キーワード",
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string", "description": "会話の中で伝えたかったことの150文字以内の要約"},
+        "emotions": {"type": "array", "items": {"type": "string"}, "description": "感情キーワード（3つ以内）"}
+    },
+    "required": ["summary", "emotions"]
+}
+
+# 終了時の要約はバックグラウンドで1件ずつ処理する
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+def get_summary_llm():
+    """要約用のLLMを返す（要約と感情キーワードを構造化して返す）"""
+    global _summary_llm
+    with _summary_llm_lock:
+        if _summary_llm is None:
+            from langchain_openai import ChatOpenAI
+            llm = ChatOpenAI(model="gpt-4", temperature=0.7, max_tokens=300)
+            _summary_llm = llm.with_structured_output(SUMMARY_SCHEMA)
+        return _summary_llm
 
-    # LangChain+OpenAIで要約・感情分析
-    llm = ChatOpenAI(model="gpt-4", temperature=0.7, max_tokens=200)
+def summarize_user_text(user_text):
+    """ユーザー発話から (要約, カンマ区切りの感情キーワード) を返す"""
     prompt = f"""
-    会話の中で伝えたかったことを150文字以内で要約してください。
+    ユーザー発話について、次の2つを出力してください。
+    summary: 会話の中で伝えたかったことを150文字以内で要約してください。
     感情や重要なポイントをピックアップしてください。
     AIの応答内容は無視してください。
     ほっこりするメッセージにしてください。
     最後の終了コマンドは無視してください。
+    emotions: 感情キーワード（例：楽しい、寂しい、嬉しい、悲しいなど）を3つ以内で抽出してください。
     ユーザー発話:
     {user_text}
     """
-    try:
-        summary_resp = llm.invoke(prompt)
-        summary = summary_resp.content.strip()
-    except Exception as e:
-        print(f"要約生成エラー: {e}")
-        summary = "要約生成に失敗しました"
+    # 失敗した時は例外をそのまま送出し、会話はジャーナルに残して後で要約し直す
+    result = get_summary_llm().invoke(prompt)
+    summary = (result.get("summary") or "").strip() or "要約生成に失敗しました"
+    emotions = ",".join(e.strip().replace("。", "") for e in result.get("emotions", [])[:3] if e.strip())
+    return summary, emotions
 
-    # 感情キーワード抽出
-    emotion_prompt = f"""
-    以下のユーザー発話から感情キーワード（例：楽しい、寂しい、嬉しい、悲しいなど）を3つ以内で抽出し、カンマ区切りで出力してください。
-    ユーザー発話:
-    {user_text}
+def summarize_pending_transcripts():
+    """ジャーナルに残っている会話を要約してSheet1への記録に置き換え、要約できた件数を返す
+
+    要約に失敗した会話はそのまま残し、次のセッションの終了時か次回起動時に要約し直す。
     """
-    try:
-        emotion_resp = llm.invoke(emotion_prompt)
-        emotions = emotion_resp.content.strip().replace("。", "").replace("、", ",")
-    except Exception as e:
-        print(f"感情抽出エラー: {e}")
-        emotions = ""
+    journal = get_record_journal()
+    summarized = 0
+    for transcript_id, user_text, start_time, end_time, partial in journal.due_transcripts():
+        try:
+            # LangChain+OpenAIで要約と感情キーワードを1回の呼び出しでまとめて取得
+            summary, emotions = summarize_user_text(user_text)
+        except Exception as e:
+            delay = journal.postpone_transcript(transcript_id)
+            print(f"要約生成エラー（会話は保存済み、{delay:.0f}秒後以降に再試行）: {e}")
+            # オフラインの間は、残りの会話も続けて失敗するため後回しにする
+            break
 
-    # Google Sheets保存
-    try:
-        scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
-        client = gspread.authorize(credentials)
-        
-        # スプレッドシートを開く
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
-        print(f"使用中のGoogleシートID: {GOOGLE_SHEET_ID}")
-        
-        # 既存のシートを確認
-        worksheet_list = spreadsheet.worksheets()
-        sheet_names = [ws.title.lower() for ws in worksheet_list]
-        print(f"既存のシート一覧: {sheet_names}")
-        
-        # シート名を正規化（小文字に統一）
-        target_sheet_name = "sheet1"
-        
-        # シートの取得または作成
-        sheet = None
-        for ws in worksheet_list:
-            if ws.title.lower() == target_sheet_name:
-                sheet = ws
-                print(f"既存の{ws.title}を使用します")
-                break
-        
-        if sheet is None:
-            print(f"{target_sheet_name}が見つからないため、新規作成します")
-            try:
-                sheet = spreadsheet.add_worksheet(title=target_sheet_name, rows="1000", cols="20")
-                print(f"{target_sheet_name}を新規作成しました")
-                # ヘッダー行を追加
-                sheet.append_row(["日時", "会話時間", "要約", "感情キーワード"])
-            except Exception as e:
-                print(f"シート作成エラー: {e}")
-                return False
-        
-        # データを保存
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        sheet.append_row([now, conversation_time, summary, emotions])
-        print(f"{sheet.title}に会話履歴を保存しました")
-        return True
-        
-    except Exception as e:
-        import traceback
-        print(f"Google Sheets保存エラー: {e}")
-        traceback.print_exc()
+        # 会話時間計算
+        duration = end_time - start_time
+        minutes = int(duration // 60)
+        seconds = int(duration % 60)
+        conversation_time = f"{minutes}分{seconds}秒" + (PARTIAL_MARK if partial else "")
+
+        # Google Sheets保存（ローカルに記録し、送信はバックグラウンドで行う）
+        now = datetime.fromtimestamp(end_time).strftime("%Y-%m-%d %H:%M:%S")
+        journal.complete_transcript(transcript_id, "sheet1", [now, conversation_time, summary, emotions], header=SUMMARY_HEADER)
+        print("sheet1への会話履歴の保存を予約しました")
+        summarized += 1
+    return summarized
+
+def summarize_pending_transcripts_async():
+    """summarize_pending_transcriptsをバックグラウンドで実行し、Futureを返す"""
+    return summary_executor.submit(summarize_pending_transcripts)
+
+def save_conversation_summary(history, start_time, end_time, summarizer=None, partial=False):
+    """
+    全発話をアーカイブに保存し、Sheet1に、1セッションごとに1行、
+    日時・会話時間・ユーザー発話要約・感情キーワードを保存
+    summarizerがあれば、全発話の代わりに途中要約と直近のやり取りを要約する
+    要約の入力はまずジャーナルに保存するため、オフラインでも会話は失われない
+    partialなら途中で中止された会話として、会話時間に「（中断）」を付けて記録する
+    """
+    # 全発話をアーカイブに保存する（前回の会話はここから読み込む）
+    if history:
+        try:
+            get_session_archive().save_session(history, started=start_time, ended=end_time)
+        except Exception as e:
+            print(f"会話履歴のアーカイブに失敗しました: {e}")
+
+    # ユーザー発話のみ抽出
+    user_texts = [msg.content for msg in history if msg.role == 'user']
+    if not user_texts:
+        print("ユーザー発話がありません")
         return False
+    if summarizer is not None and summarizer.has_content():
+        summarizer.wait()
+        # 最後の終了コマンドなど、要約に反映されていない発話を加える
+        user_text = summarizer.context_text()
+        if history and history[-1].role == 'user':
+            user_text += f"\nuser: {history[-1].content}"
+    else:
+        user_text = "\n".join(user_texts)
+
+    # 要約する前に会話をジャーナルに保存し、前回までに要約できなかった分とまとめて要約する
+    get_record_journal().record_transcript(user_text, start_time, end_time, partial=partial)
+    summarize_pending_transcripts()
+    return True
+
+def save_conversation_summary_async(history, start_time, end_time, summarizer=None, partial=False):
+    """save_conversation_summaryをバックグラウンドで実行し、Futureを返す"""
+    return summary_executor.submit(save_conversation_summary, list(history), start_time, end_time, summarizer, partial)
 
 def save_conversation_record(history):
     # 必要に応じて実装
@@ -175,45 +204,19 @@ def save_calc_game_result(start_time, end_time, score, total_questions, detail_r
     """
     Sheet2に、脳トレゲームの実施日時・所要時間・スコア・詳細結果を保存
     """
-    try:
-        scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
-        client = gspread.authorize(credentials)
-        
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
-        worksheet_list = spreadsheet.worksheets()
-        sheet_names = [ws.title.lower() for ws in worksheet_list]
-        target_sheet_name = "sheet2"
-        
-        # シートの取得または作成
-        sheet = None
-        for ws in worksheet_list:
-            if ws.title.lower() == target_sheet_name:
-                sheet = ws
-                break
-        if sheet is None:
-            sheet = spreadsheet.add_worksheet(title=target_sheet_name, rows="1000", cols="20")
-            # ヘッダー行を追加
-            sheet.append_row(["実施日時", "所要時間", "スコア", "詳細"])
-        
-        # 所要時間計算
-        duration = end_time - start_time
-        minutes = int(duration // 60)
-        seconds = int(duration % 60)
-        play_time = f"{minutes}分{seconds}秒"
-        
-        # 実施日時
-        exec_time = datetime.fromtimestamp(start_time).strftime("%Y-%m-%d %H:%M:%S")
-        
-        # 詳細（リストを1つの文字列にまとめる）
-        detail_str = "; ".join(detail_results)
-        
-        # データを保存
-        sheet.append_row([exec_time, play_time, f"{score}/{total_questions}", detail_str])
-        print(f"{sheet.title}に脳トレゲーム結果を保存しました")
-        return True
-    except Exception as e:
-        import traceback
-        print(f"Google Sheets保存エラー: {e}")
-        traceback.print_exc()
-        return False
+    # 所要時間計算
+    duration = end_time - start_time
+    minutes = int(duration // 60)
+    seconds = int(duration % 60)
+    play_time = f"{minutes}分{seconds}秒"
+    
+    # 実施日時
+    exec_time = datetime.fromtimestamp(start_time).strftime("%Y-%m-%d %H:%M:%S")
+    
+    # 詳細（リストを1つの文字列にまとめる）
+    detail_str = "; ".join(detail_results)
+    
+    # データを保存（ローカルに記録し、送信はバックグラウンドで行う）
+    get_record_journal().record("sheet2", [exec_time, play_time, f"{score}/{total_questions}", detail_str], header=CALC_GAME_HEADER)
+    print("sheet2への脳トレゲーム結果の保存を予約しました")
+    return True
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+# 履歴の上限の設定
+MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "40"))  # 1セッションで保持するメッセージ数
+TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))  # 1セッションで保持する推定トークン数
+MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "8"))  # 同時に保持するセッション数
+SESSION_TTL = float(os.getenv("HISTORY_SESSION_TTL_HOURS", "6")) * 3600  # 使われないセッションを消すまでの時間（秒）
+
+def message_role(message):
+    """辞書・LangChainのメッセージのどちらからでも役割を取り出す"""
+    if isinstance(message, dict):
+        return message.get("role")
+    return getattr(message, "role", None) or getattr(message, "type", None)
+
+def message_content(message):
+    """辞書・LangChainのメッセージのどちらからでも本文を取り出す"""
+    if isinstance(message, dict):
+        return message.get("content", "")
+    content = getattr(message, "content", "")
+    return content if isinstance(content, str) else str(content)
+
+def estimate_tokens(text):
+    """トークン数の目安（日本語はおおむね1文字1トークン）"""
+    return len(text)
+
+def trim_messages(messages, max_messages=MAX_MESSAGES, token_budget=TOKEN_BUDGET):
+    """システムプロンプトは残し、新しいメッセージから件数とトークン数の上限まで残したリストを返す"""
+    system = [m for m in messages if message_role(m) == "system"]
+    budget = token_budget - sum(estimate_tokens(message_content(m)) for m in system)
+    limit = max_messages - len(system)
+    recent = []
+    for message in reversed(messages):
+        if message_role(message) == "system":
+            continue
+        cost = estimate_tokens(message_content(message))
+        # 最新のメッセージは上限を超えても必ず残す
+        if recent and (len(recent) >= limit or cost > budget):
+            break
+        recent.append(message)
+        budget -= cost
+    recent.reverse()
+    return system + recent
+
+def messages_size(messages):
+    """メッセージが使っているおおよそのメモリ量（バイト）"""
+    size = sys.getsizeof(messages)
+    for message in messages:
+        size += sys.getsizeof(message) + sys.getsizeof(message_content(message))
+    return size
+
+class HistoryStore:
+    """セッションIDごとの会話履歴を、件数・トークン数・セッション数の上限付きで保持するクラス
+
+    RunnableWithMessageHistoryに渡すget_session_historyの保存先として使う。
+    履歴は取り出すたびに上限まで切り詰め、一定時間使われないセッションや、
+    上限を超えた古いセッションは削除する。
+    """
+
+    def __init__(self, factory, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL,
+                 max_messages=MAX_MESSAGES, token_budget=TOKEN_BUDGET, clock=time.monotonic):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.clock = clock
+        self.sessions = OrderedDict()  # セッションID -> (履歴, 最後に使った時刻)。古い順
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __getitem__(self, session_id):
+        return self.get(session_id)
+
+    def get(self, session_id):
+        """セッションの履歴を返す（なければ作成し、あれば上限まで切り詰める）"""
+        with self.lock:
+            now = self.clock()
+            self._evict_idle(now)
+            if session_id in self.sessions:
+                history = self.sessions.pop(session_id)[0]
+                self.trim(history)
+            else:
+                history = self.factory()
+            self.sessions[session_id] = (history, now)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+            return history
+
+    def trim(self, history):
+        """履歴のメッセージを上限まで切り詰める"""
+        messages = history.messages
+        if len(messages) > self.max_messages or \
+                sum(estimate_tokens(message_content(m)) for m in messages) > self.token_budget:
+            history.messages = trim_messages(messages, self.max_messages, self.token_budget)
+
+    def _evict_idle(self, now):
+        while self.sessions:
+            session_id, (_, last_used) = next(iter(self.sessions.items()))
+            if now - last_used < self.ttl:
+                break
+            del self.sessions[session_id]
+            self.evicted += 1
+
+    def memory_report(self):
+        """保持しているセッション数・メッセージ数・おおよそのメモリ量を返す"""
+        with self.lock:
+            histories = [history for history, _ in self.sessions.values()]
+        return {
+            "sessions": len(histories),
+            "messages": sum(len(h.messages) for h in histories),
+            "bytes": sum(messages_size(h.messages) for h in histories),
+            "evicted": self.evicted
+        }
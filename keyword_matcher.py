@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+from collections import deque
+from aizuchi import EMOTION_KEYWORDS
+
+# 操作に使うキーワード（カテゴリ -> キーワード）
+COMMAND_KEYWORDS = {
+    "exit": ["終了", "さようなら", "終わります", "終了します"],
+    "menu_chat": ["おしゃべり"],
+    "menu_calc": ["脳トレ", "ゲーム"],
+    "menu_potz": ["ポッツ", "接続"],
+    "topic_request": ["話題", "何か話", "面白い話", "提案", "おすすめ", "困った", "沈黙"],
+    "question_marker": ["とは", "教えて"],
+}
+
+class KeywordMatcher:
+    """複数のキーワードを一度に探すAho–Corasick法のマッチャー
+
+    キーワードの数に関係なく、発話を先頭から1回なぞるだけで、一致したすべての
+    キーワードとそのカテゴリ・位置がわかる。オートマトンは作成時に一度だけ作る。
+    """
+
+    def __init__(self, categories):
+        self.goto = [{}]  # 状態ごとの遷移（文字 -> 次の状態）
+        self.fail = [0]  # 一致しなかった時に戻る状態
+        self.output = [[]]  # 状態ごとに一致が確定する (キーワード, カテゴリ)
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                self._insert(keyword, category)
+        self._build_failure_links()
+
+    def _insert(self, keyword, category):
+        state = 0
+        for ch in keyword:
+            if ch not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][ch] = len(self.goto) - 1
+            state = self.goto[state][ch]
+        self.output[state].append((keyword, category))
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find_all(self, text):
+        """一致したキーワードを (開始位置, キーワード, カテゴリ) のリストで返す"""
+        matches = []
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for keyword, category in output[state]:
+                matches.append((i - len(keyword) + 1, keyword, category))
+        return matches
+
+    def categories(self, text):
+        """一致したカテゴリと、その最初の一致位置の辞書を返す"""
+        found = {}
+        for start, _, category in self.find_all(text):
+            if category not in found or start < found[category]:
+                found[category] = start
+        return found
+
+    def first(self, text, categories):
+        """categoriesの順に見て、最初に一致したカテゴリを返す（なければNone）"""
+        found = self.categories(text)
+        for category in categories:
+            if category in found:
+                return category
+        return None
+
+# 感情キーワードと操作キーワードをまとめたマッチャー
+INTENT_MATCHER = KeywordMatcher({**EMOTION_KEYWORDS, **COMMAND_KEYWORDS})
+
+def benchmark(sizes=(10, 50, 100, 300, 1000), repeat=2000):
+    """キーワード数を増やしながら、1発話あたりの判定時間を従来の方法と比べる"""
+    utterance = "今日は孫と公園に行って、とても楽しかったです。また行きたいなと思っています"
+    base = [kw for keywords in EMOTION_KEYWORDS.values() for kw in keywords]
+    print(f"{'キーワード数':>8s} {'従来(μs)':>10s} {'AC法(μs)':>10s}")
+    for size in sizes:
+        keywords = (base + [f"語彙{i}番" for i in range(size)])[:size]
+        groups = {f"cat{i % 8}": [] for i in range(8)}
+        for i, kw in enumerate(keywords):
+            groups[f"cat{i % 8}"].append(kw)
+        matcher = KeywordMatcher(groups)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            [c for c, kws in groups.items() if any(kw in utterance for kw in kws)]
+        naive = (time.perf_counter() - start) / repeat * 1e6
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            matcher.categories(utterance)
+        automaton = (time.perf_counter() - start) / repeat * 1e6
+        print(f"{size:>12d} {naive:>12.1f} {automaton:>12.1f}")
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        benchmark()
+    else:
+        # 従来の部分文字列の判定と同じ結果になることを確認する
+        samples = ["今日は楽しかったです", "疲れたけど面白い話を教えて", "おしゃべり", "脳トレゲーム",
+                   "終了します", "何か話題ある？", "すごく気になる", "さようなら"]
+        all_keywords = {**EMOTION_KEYWORDS, **COMMAND_KEYWORDS}
+        for text in samples:
+            expected = {c for c, kws in all_keywords.items() if any(kw in text for kw in kws)}
+            assert set(INTENT_MATCHER.categories(text)) == expected, text
+            for start, keyword, _ in INTENT_MATCHER.find_all(text):
+                assert text[start:start + len(keyword)] == keyword
+        print("動作確認OK")
@@ -3,71 +3,70 @@
 
 import os
 import sys
-import time
-from dotenv import load_dotenv
-from speech_input import listen
-from speech_output import speak
-from api_chat import start_voice_chat
-from voice_calc_game import VoiceCalculationGame
-from file_operations import save_conversation_record
+import threading
+import asyncio
 import subprocess
-import webbrowser  # ← 追加
+from dotenv import load_dotenv
+from session_orchestrator import SessionOrchestrator
 
 # .envファイルの読み込み
 load_dotenv()
 
+# 起動時間の計測対象（読み込み順）
+PROFILE_MODULES = [
+    "dotenv", "numpy", "sounddevice", "soundfile", "speech_recognition", "vosk",
+    "speech_input", "speech_output",
+    "openai", "langchain_core", "langchain_openai", "langchain_community",
+    "gspread", "oauth2client", "api_chat", "voice_calc_game"
+]
+
+# 新しいインタープリタで1つのモジュールを読み込み、かかった秒数を表示するスクリプト
+PROFILE_SCRIPT = (
+    "import sys, time, importlib\n"
+    "start = time.perf_counter()\n"
+    "importlib.import_module(sys.argv[1])\n"
+    "print(time.perf_counter() - start)\n"
+)
+
+def profile_imports(modules=PROFILE_MODULES):
+    """モジュールごとの読み込み時間を表示する（python3 main.py --profile-imports）
+
+    すでに読み込んだモジュールの影響を受けないよう、モジュールごとに新しい
+    インタープリタを起動して測る（依存するモジュールの読み込みも含む）。
+    """
+    print("◆ 読み込み時間（モジュールごとに新しいプロセスで計測、依存モジュールを含む）")
+    for name in modules:
+        result = subprocess.run(
+            [sys.executable, "-c", PROFILE_SCRIPT, name],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if result.returncode == 0:
+            print(f"{name:22s} {float(result.stdout.strip().splitlines()[-1]) * 1000:8.1f} ms")
+        else:
+            error = (result.stderr.strip().splitlines() or ["不明なエラー"])[-1]
+            print(f"{name:22s} {'':>8s}    失敗: {error}")
+    print("詳細は python3 -X importtime -c 'import api_chat' などで確認できます")
+
 def main():
     """メインプログラム"""
     try:
         # 初期化
         print("システムを起動しています...")
-        speak("もしもし。おしゃべり、脳トレゲーム、ポッツに接続のどれをしますか？")
-        
-        while True:
-            # モード選択
-            user_input = listen()
-            if user_input is None:
-                continue
-                
-            # 「終了」や「さようなら」「終わります」で終了
-            if any(word in user_input for word in ["終了", "さようなら", "終わります", "終了します"]):
-                speak("プログラムを終了します。")
-                break
-                
-            # モード判定
-            normalized_input = user_input.replace(" ", "").replace("　", "")
-            if "おしゃべり" in normalized_input:
-                speak("おしゃべりしましょう")
-                start_voice_chat()
-                speak("おしゃべりを終了しました。次は何かしますか？おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？")
-                continue
-                
-            elif "脳トレ" in user_input or "ゲーム" in user_input:
-                speak("脳トレゲームをしましょう")
-                game = VoiceCalculationGame()
-                game.run_game()
-                speak("脳トレゲームを終了しました。次は何かしますか？おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？")
-                continue
-                
-            elif "ポッツ" in user_input or "接続" in user_input:
-                speak("ポッツへの接続を開始します")
-                webbrowser.open("https://ftc.potz.jp/dashboard")
-                time.sleep(3)
-                speak("ポッツに接続しました。次は何かしますか？おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？")
-                continue
-                
-            else:
-                speak("選んでください")
-                print("選択可能なモード：")
-                print("1. おしゃべり")
-                print("2. 脳トレゲーム")
-                print("3. ポッツに接続")
-                print("4. 終了")
-                
+        # 音声認識モデルの読み込みは挨拶と並行して行う
+        from speech_input import preload_recognizer
+        threading.Thread(target=preload_recognizer, daemon=True).start()
+        # 前回までに要約・送信できなかった記録をバックグラウンドで要約・送信する
+        from file_operations import summarize_pending_transcripts_async
+        summarize_pending_transcripts_async()
+        # モードの切り替えは画面版と同じ状態機械で行う
+        asyncio.run(SessionOrchestrator().run())
     except KeyboardInterrupt:
         print("\nプログラムを終了します")
     except Exception as e:
         print(f"エラーが発生しました: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--profile-imports" in sys.argv:
+        profile_imports()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+from datetime import datetime
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def format_timestamp(timestamp, fmt=TIMESTAMP_FORMAT):
+    """UNIX時刻を表示・保存用の文字列にする（書き出す時だけ使う）"""
+    return datetime.fromtimestamp(timestamp).strftime(fmt)
+
+class Message:
+    """会話の1発話を表す小さな記録
+
+    辞書の代わりに__slots__で持ち、役割（user/assistantなど）は intern した
+    文字列を共有する。時刻はUNIX時刻のまま持ち、書き出す時に文字列にする。
+    """
+
+    __slots__ = ("role", "content", "created")
+
+    def __init__(self, role, content, created=None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.created = time.time() if created is None else created
+
+    @property
+    def timestamp(self):
+        """書き出し用の時刻の文字列"""
+        return format_timestamp(self.created)
+
+    def to_dict(self):
+        return {"timestamp": self.timestamp, "role": self.role, "content": self.content}
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content!r})"
+
+class GameResult:
+    """ゲーム1回分の結果を表す小さな記録"""
+
+    __slots__ = ("game_type", "score", "total_questions", "duration", "created")
+
+    def __init__(self, game_type, score, total_questions, duration, created=None):
+        self.game_type = sys.intern(game_type)
+        self.score = score
+        self.total_questions = total_questions
+        self.duration = duration
+        self.created = time.time() if created is None else created
+
+    @property
+    def timestamp(self):
+        """書き出し用の時刻の文字列"""
+        return format_timestamp(self.created)
+
+    def to_dict(self):
+        return {
+            "timestamp": self.timestamp,
+            "game_type": self.game_type,
+            "score": self.score,
+            "total_questions": self.total_questions,
+            "duration": self.duration
+        }
+
+def benchmark(turns=10000):
+    """1日1万発話を記録した時のメモリ使用量を、従来の辞書と比べる"""
+    import tracemalloc
+    texts = [f"今日は{i % 50}時ごろに散歩に行きました" for i in range(turns)]
+
+    def measure(build):
+        tracemalloc.start()
+        records = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return records, size
+
+    _, dict_size = measure(lambda: [
+        {"timestamp": datetime.now().strftime(TIMESTAMP_FORMAT), "speaker": "user" if i % 2 else "assistant", "text": text}
+        for i, text in enumerate(texts)
+    ])
+    _, record_size = measure(lambda: [
+        Message("user" if i % 2 else "assistant", text) for i, text in enumerate(texts)
+    ])
+    print(f"{turns}発話の記録に使うメモリ（本文は共有のため除く）")
+    print(f"辞書と時刻の文字列: {dict_size / 1024:8.1f} KB")
+    print(f"Message:            {record_size / 1024:8.1f} KB")
+
+if __name__ == "__main__":
+    benchmark()
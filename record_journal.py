@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from sheets_sink import get_sheets_sink
+
+# ジャーナルの設定
+JOURNAL_PATH = os.getenv("RECORD_JOURNAL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_history", "records.db"))
+UPLOAD_INTERVAL = float(os.getenv("RECORD_UPLOAD_INTERVAL", "5"))  # 送信を確認する間隔（秒）
+UPLOAD_BATCH = 50  # 1回に送信する最大件数
+RETRY_BASE = 5.0  # 再送までの最初の待ち時間（秒）
+RETRY_MAX = 600.0  # 再送までの最大の待ち時間（秒）
+COMPACT_EVERY = 200  # この件数を送信し終えるたびにファイルを詰める
+ACKED_RETENTION = 30 * 24 * 3600  # 送信済みの記録を重複判定のために残す期間（秒）
+
+# 記録の状態
+PENDING = "pending"  # 未送信
+SENDING = "sending"  # 送信中（このまま残っていれば、送信の途中で終了した）
+ACKED = "acked"  # 送信済み
+
+def sheet_row(row):
+    """シートから読み出した時と同じ形（文字列のリスト、末尾の空欄なし）にする"""
+    values = ["" if value is None else str(value) for value in row]
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+def make_record_id(target, sheet_name, row):
+    """記録内容から重複判定用のIDを作る"""
+    data = json.dumps([target, sheet_name, row], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+class RecordJournal:
+    """セッション記録をまずローカルに保存し、バックグラウンドでSheetsに送るクラス
+
+    記録はSQLiteに追記してから戻るため、ネットワークが切れていても失われない。
+    送信に失敗した記録は指数バックオフで再送する。送信済みの記録は削除せずに
+    送信済みとして残し、同じ内容をもう一度記録しても送信しない。
+    送信中に終了した記録は、次の送信の前にシートにすでにあるかを確かめる。
+    """
+
+    def __init__(self, path=JOURNAL_PATH, sink_factory=get_sheets_sink, upload_interval=UPLOAD_INTERVAL):
+        self.path = path
+        self.sink_factory = sink_factory
+        self.upload_interval = upload_interval
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.uploader = None
+        self.uploaded_since_compact = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " record_id TEXT PRIMARY KEY, spreadsheet_key TEXT, spreadsheet_name TEXT,"
+            " sheet_name TEXT, row TEXT, header TEXT, created REAL,"
+            " attempts INTEGER DEFAULT 0, next_attempt REAL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(records)")}
+        if "state" not in columns:
+            # 送信済みの記録を削除していた以前のジャーナル
+            self.db.execute(f"ALTER TABLE records ADD COLUMN state TEXT DEFAULT '{PENDING}'")
+            self.db.execute("ALTER TABLE records ADD COLUMN acked REAL")
+        self.db.execute("CREATE INDEX IF NOT EXISTS records_due ON records (state, next_attempt)")
+        # 要約してから記録する会話（要約できるまで残す）
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS transcripts ("
+            " transcript_id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT, started REAL, ended REAL,"
+            " partial INTEGER DEFAULT 0, attempts INTEGER DEFAULT 0, next_attempt REAL DEFAULT 0)"
+        )
+        self.db.commit()
+
+    def record(self, sheet_name, row, header=None, spreadsheet_key=None, spreadsheet_name=None):
+        """記録をジャーナルに追記してIDを返す（ネットワークは使わない）"""
+        if spreadsheet_key is None and spreadsheet_name is None:
+            spreadsheet_key = os.getenv("GOOGLE_SHEET_ID")
+        record_id = make_record_id([spreadsheet_key, spreadsheet_name], sheet_name, row)
+        with self.lock:
+            # 同じIDの記録は、送信済みのものも含めて二重に登録しない
+            self.db.execute(
+                "INSERT OR IGNORE INTO records (record_id, spreadsheet_key, spreadsheet_name, sheet_name, row, header, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record_id, spreadsheet_key, spreadsheet_name, sheet_name,
+                 json.dumps(row, ensure_ascii=False), json.dumps(header, ensure_ascii=False), time.time())
+            )
+            self.db.commit()
+        self.wake_event.set()
+        return record_id
+
+    def pending_count(self):
+        """未送信の記録の件数"""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM records WHERE state != ?", (ACKED,)).fetchone()[0]
+
+    def transcript_count(self):
+        """まだ要約していない会話の件数"""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+
+    def record_transcript(self, text, started, ended, partial=False):
+        """要約前の会話をジャーナルに追記してIDを返す（partialは途中で中止された会話）"""
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO transcripts (text, started, ended, partial) VALUES (?, ?, ?, ?)",
+                (text, started, ended, int(partial))
+            )
+            self.db.commit()
+        return cursor.lastrowid
+
+    def due_transcripts(self):
+        """要約する時期になった会話を (ID, 会話, 開始時刻, 終了時刻, 中断したか) のリストで返す"""
+        with self.lock:
+            return self.db.execute(
+                "SELECT transcript_id, text, started, ended, partial FROM transcripts WHERE next_attempt <= ? ORDER BY started",
+                (time.time(),)
+            ).fetchall()
+
+    def complete_transcript(self, transcript_id, sheet_name, row, header=None):
+        """要約できた会話を、要約の記録に置き換える"""
+        spreadsheet_key = os.getenv("GOOGLE_SHEET_ID")
+        record_id = make_record_id([spreadsheet_key, None], sheet_name, row)
+        with self.lock:
+            # 記録の追加と会話の削除は1つのトランザクションで行う
+            self.db.execute(
+                "INSERT OR IGNORE INTO records (record_id, spreadsheet_key, spreadsheet_name, sheet_name, row, header, created)"
+                " VALUES (?, ?, NULL, ?, ?, ?, ?)",
+                (record_id, spreadsheet_key, sheet_name,
+                 json.dumps(row, ensure_ascii=False), json.dumps(header, ensure_ascii=False), time.time())
+            )
+            self.db.execute("DELETE FROM transcripts WHERE transcript_id = ?", (transcript_id,))
+            self.db.commit()
+        self.wake_event.set()
+        return record_id
+
+    def postpone_transcript(self, transcript_id):
+        """要約できなかった会話を、指数バックオフで後回しにする"""
+        with self.lock:
+            attempts = self.db.execute(
+                "SELECT attempts FROM transcripts WHERE transcript_id = ?", (transcript_id,)
+            ).fetchone()[0] + 1
+            delay = min(RETRY_MAX, RETRY_BASE * (2 ** (attempts - 1))) * random.uniform(0.8, 1.2)
+            self.db.execute(
+                "UPDATE transcripts SET attempts = ?, next_attempt = ? WHERE transcript_id = ?",
+                (attempts, time.time() + delay, transcript_id)
+            )
+            self.db.commit()
+        return delay
+
+    def _set_state(self, ids, state, **columns):
+        marks = ",".join("?" * len(ids))
+        assignments = "".join(f", {name} = ?" for name in columns)
+        with self.lock:
+            self.db.execute(
+                f"UPDATE records SET state = ?{assignments} WHERE record_id IN ({marks})",
+                [state] + list(columns.values()) + ids
+            )
+            self.db.commit()
+
+    def _already_uploaded(self, sink, sheet_name, group):
+        """送信中に終了した記録のうち、シートにすでにある記録のIDを返す"""
+        uncertain = [i for i, sending in enumerate(group["sending"]) if sending]
+        if not uncertain:
+            return set()
+        existing = {tuple(sheet_row(row)) for row in sink.read_rows(sheet_name)}
+        return {group["ids"][i] for i in uncertain if tuple(sheet_row(group["rows"][i])) in existing}
+
+    def upload_due(self):
+        """送信時期になった記録をまとめて送信し、送信できた件数を返す"""
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT record_id, spreadsheet_key, spreadsheet_name, sheet_name, row, header, attempts, state"
+                " FROM records WHERE state != ? AND next_attempt <= ? ORDER BY created LIMIT ?",
+                (ACKED, now, UPLOAD_BATCH)
+            ).fetchall()
+
+        # 送信先のシートごとにまとめる
+        groups = {}
+        for record_id, key, name, sheet_name, row, header, attempts, state in rows:
+            group = groups.setdefault(
+                (key, name, sheet_name), {"ids": [], "rows": [], "sending": [], "header": None, "attempts": 0}
+            )
+            group["ids"].append(record_id)
+            group["rows"].append(json.loads(row))
+            group["sending"].append(state == SENDING)
+            group["header"] = json.loads(header) or group["header"]
+            group["attempts"] = max(group["attempts"], attempts)
+
+        uploaded = 0
+        for (key, name, sheet_name), group in groups.items():
+            done = set()
+            try:
+                sink = self.sink_factory(key, name)
+                # 前回、送信後に送信済みと記録する前に終了した分は送り直さない
+                done = self._already_uploaded(sink, sheet_name, group)
+                if done:
+                    self._set_state(sorted(done), ACKED, acked=time.time())
+                    uploaded += len(done)
+                ids = [i for i in group["ids"] if i not in done]
+                rows = [row for i, row in zip(group["ids"], group["rows"]) if i not in done]
+                if not ids:
+                    continue
+                self._set_state(ids, SENDING)
+                sink.write_rows(sheet_name, rows, header=group["header"])
+            except Exception as e:
+                ids = [i for i in group["ids"] if i not in done]
+                attempts = group["attempts"] + 1
+                delay = min(RETRY_MAX, RETRY_BASE * (2 ** (attempts - 1))) * random.uniform(0.8, 1.2)
+                print(f"記録の送信に失敗しました（{len(ids)}件、{delay:.0f}秒後に再送）: {e}")
+                self._set_state(ids, PENDING, attempts=attempts, next_attempt=time.time() + delay)
+                continue
+            self._set_state(ids, ACKED, acked=time.time())
+            uploaded += len(ids)
+
+        self.uploaded_since_compact += uploaded
+        if self.uploaded_since_compact >= COMPACT_EVERY:
+            self.compact()
+        return uploaded
+
+    def compact(self):
+        """保存期間を過ぎた送信済みの記録を削除し、ファイルを詰める"""
+        with self.lock:
+            self.db.execute("DELETE FROM records WHERE state = ? AND acked < ?", (ACKED, time.time() - ACKED_RETENTION))
+            self.db.commit()
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.db.execute("VACUUM")
+        self.uploaded_since_compact = 0
+
+    def _upload_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.upload_due()
+            except Exception as e:
+                print(f"記録の送信処理でエラーが発生しました: {e}")
+            self.wake_event.wait(self.upload_interval)
+            self.wake_event.clear()
+
+    def start(self):
+        """バックグラウンドの送信スレッドを開始する"""
+        if self.uploader is None or not self.uploader.is_alive():
+            self.stop_event.clear()
+            self.uploader = threading.Thread(target=self._upload_loop, daemon=True)
+            self.uploader.start()
+
+    def stop(self):
+        """送信スレッドを停止する（未送信の記録は次回起動時に送る）"""
+        self.stop_event.set()
+        self.wake_event.set()
+
+# 共有のジャーナル
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_record_journal():
+    """共有のジャーナルを返す（初回に送信スレッドも開始する）"""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = RecordJournal()
+            _journal.start()
+        return _journal
+
+if __name__ == "__main__":
+    # 前回までに送信できなかった記録を送信する
+    journal = RecordJournal()
+    print(f"未送信の記録: {journal.pending_count()}件、要約前の会話: {journal.transcript_count()}件")
+    uploaded = journal.upload_due()
+    print(f"{uploaded}件を送信しました。残り{journal.pending_count()}件")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import re
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+# キャッシュの設定
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_history", "response_cache.db"))
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "6")) * 3600  # 有効期限（秒）
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+# 答えが日時によって変わる発話（キャッシュしない）
+TIME_RELATIVE = re.compile(
+    r"今日|きょう|明日|あした|昨日|きのう|今週|来週|先週|今月|来月|先月|今年|来年|去年|"
+    r"今[はの]?何|いま|現在|最近|さっき|何時|何曜|何日|何月|天気|ニュース"
+)
+
+def is_time_relative(text):
+    """今日・明日・何曜日など、答えが日時によって変わる発話かどうか"""
+    return TIME_RELATIVE.search(unicodedata.normalize("NFKC", text)) is not None
+
+def normalize_input(text):
+    """ユーザー発話を正規化する（空白・全角半角・文末の記号の違いを吸収）"""
+    text = unicodedata.normalize("NFKC", text)
+    text = "".join(text.split())
+    return text.rstrip("。.!！?？")
+
+def _hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """プロンプトのテンプレートと正規化した発話をキーにLLMの応答を保存するキャッシュ"""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " template_hash TEXT, input_hash TEXT, response TEXT,"
+            " expires REAL, last_used REAL,"
+            " PRIMARY KEY (template_hash, input_hash))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
+
+    def _key(self, template, user_input):
+        return _hash(template), _hash(normalize_input(user_input))
+
+    def get(self, template, user_input):
+        """有効な応答があれば返す（なければNone）"""
+        key = self._key(template, user_input)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT response, expires FROM responses WHERE template_hash = ? AND input_hash = ?", key
+            ).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                if row is not None:
+                    self.db.execute("DELETE FROM responses WHERE template_hash = ? AND input_hash = ?", key)
+                    self.db.commit()
+                return None
+            self.db.execute(
+                "UPDATE responses SET last_used = ? WHERE template_hash = ? AND input_hash = ?", (now,) + key
+            )
+            self.db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, template, user_input, response, ttl=None):
+        """応答を保存し、上限を超えたら最近使われていないものから削除する"""
+        key = self._key(template, user_input)
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", key + (response, expires, now)
+            )
+            self.db.execute(
+                "DELETE FROM responses WHERE rowid IN ("
+                " SELECT rowid FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.db.commit()
+
+    def stats(self):
+        """ヒット数・ミス数・保存件数を返す"""
+        with self.lock:
+            size = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size
+        }
+
+    def clear(self):
+        """キャッシュをすべて削除する"""
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.commit()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 要約の設定
+SUMMARY_MAX_CHARS = 300  # 途中要約の最大文字数
+FOLD_TIMEOUT = 10  # 最後の要約を待つ最大時間（秒）
+FOLD_EVERY = int(os.getenv("ROLLING_SUMMARY_EVERY", "3"))  # このやり取り数ごとに途中要約を更新する
+MAX_PENDING = 12  # 要約に失敗し続けた時に残しておく直近のやり取りの数
+# 途中要約は毎回呼ぶため、最後の要約より軽いモデルを使う
+ROLLING_SUMMARY_MODEL = os.getenv("ROLLING_SUMMARY_MODEL", "gpt-3.5-turbo")
+
+_rolling_llm = None
+_rolling_llm_lock = threading.Lock()
+
+def get_rolling_llm():
+    """途中要約用のLLMを返す（初回に作成して使い回す）"""
+    global _rolling_llm
+    with _rolling_llm_lock:
+        if _rolling_llm is None:
+            from langchain_openai import ChatOpenAI
+            _rolling_llm = ChatOpenAI(model=ROLLING_SUMMARY_MODEL, temperature=0.3, max_tokens=400)
+        return _rolling_llm
+
+class RollingSummarizer:
+    """会話のやり取りが終わるたびに、バックグラウンドで途中要約に畳み込むクラス
+
+    最後の要約や家族向けメッセージは、途中要約と未反映の直近のやり取りだけを
+    入力にするため、会話が長くなっても入力の長さは一定に収まる。
+    要約はfold_everyのやり取りごとにまとめて更新する。更新に失敗し続けても、
+    未反映のやり取りは直近のmax_pending件だけを残す。
+    """
+
+    def __init__(self, llm_factory=get_rolling_llm, max_chars=SUMMARY_MAX_CHARS,
+                 fold_every=FOLD_EVERY, max_pending=MAX_PENDING):
+        self.llm_factory = llm_factory
+        self.max_chars = max_chars
+        self.fold_every = max(1, fold_every)
+        self.max_pending = max(self.fold_every, max_pending)
+        self.summary = ""
+        self.pending = []  # まだ要約に反映していないやり取り
+        self.fold_at = self.fold_every  # 未反映のやり取りがこの数になったら更新する
+        self.dropped = 0  # 要約に反映できずに捨てたやり取りの数
+        self.lock = threading.Lock()
+        self.future = None
+        self.running = False
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rolling-summary")
+
+    def add_exchange(self, user_text, assistant_text):
+        """1回分のやり取りを追加し、要約の更新を予約する"""
+        with self.lock:
+            self.pending.append((user_text, assistant_text))
+            if len(self.pending) > self.max_pending:
+                # 要約できない状態が続いても、古いやり取りから捨てて入力の長さを保つ
+                overflow = len(self.pending) - self.max_pending
+                del self.pending[:overflow]
+                self.dropped += overflow
+                self.fold_at = max(self.fold_every, self.fold_at - overflow)
+            # 更新中なら、終わった後にまとめて反映する
+            if not self.running and len(self.pending) >= self.fold_at:
+                self.running = True
+                self.future = self.executor.submit(self._fold)
+
+    def _fold(self):
+        while True:
+            with self.lock:
+                if len(self.pending) < self.fold_at:
+                    self.running = False
+                    return
+                exchanges = self.pending[:]
+                summary = self.summary
+                dropped = self.dropped
+            prompt = f"""
+            高齢者との会話の途中要約を更新してください。
+            ユーザーが話した内容・気持ち・家族へのメッセージを中心に、{self.max_chars}文字以内でまとめてください。
+            AIの応答は、話の流れがわかる程度にだけ含めてください。
+            これまでの要約:
+            {summary or "（まだありません）"}
+            新しいやり取り:
+            {self._format(exchanges)}
+            """
+            try:
+                new_summary = self.llm_factory().invoke(prompt).content.strip()
+            except Exception as e:
+                print(f"途中要約の更新に失敗しました: {e}")
+                with self.lock:
+                    # 失敗した直後に毎回呼び直さず、fold_everyのやり取りが増えてから再試行する
+                    self.fold_at = len(self.pending) + self.fold_every
+                    self.running = False
+                return
+            with self.lock:
+                self.summary = new_summary[:self.max_chars * 2]
+                # 更新中に上限を超えて捨てたやり取りは、すでにpendingから消えている
+                del self.pending[:max(0, len(exchanges) - (self.dropped - dropped))]
+                self.fold_at = self.fold_every
+
+    @staticmethod
+    def _format(exchanges):
+        lines = []
+        for user_text, assistant_text in exchanges:
+            lines.append(f"user: {user_text}")
+            if assistant_text:
+                lines.append(f"assistant: {assistant_text}")
+        return "\n".join(lines)
+
+    def wait(self, timeout=FOLD_TIMEOUT):
+        """実行中の要約の更新を待つ（間に合わなくても未反映分は context_text に含まれる）"""
+        future = self.future
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    def has_content(self):
+        with self.lock:
+            return bool(self.summary or self.pending)
+
+    def context_text(self):
+        """途中要約と未反映の直近のやり取りを、最後の要約の入力用に返す"""
+        with self.lock:
+            parts = []
+            if self.summary:
+                parts.append(f"これまでの要約:\n{self.summary}")
+            if self.pending:
+                parts.append(f"直近のやり取り:\n{self._format(self.pending)}")
+            return "\n".join(parts)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import time
+import sqlite3
+import threading
+import datetime
+from message_record import Message, format_timestamp
+
+# アーカイブの設定
+ARCHIVE_PATH = os.getenv("SESSION_ARCHIVE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_history", "sessions.db"))
+PAGE_SIZE = 100  # 1回に読み込む発話数
+
+def to_epoch(value):
+    """datetime・date・UNIX時刻のどれでもUNIX時刻にする"""
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time()).timestamp()
+    return float(value)
+
+class SessionInfo:
+    """アーカイブされた1セッションの情報（発話は必要になった時に読み込む）"""
+
+    __slots__ = ("archive", "session_id", "started", "ended", "turn_count")
+
+    def __init__(self, archive, session_id, started, ended, turn_count):
+        self.archive = archive
+        self.session_id = session_id
+        self.started = started
+        self.ended = ended
+        self.turn_count = turn_count
+
+    def turns(self, offset=0, limit=PAGE_SIZE):
+        """発話を1ページ分読み込む"""
+        return self.archive.turns(self.session_id, offset, limit)
+
+    def iter_turns(self, page_size=PAGE_SIZE):
+        """発話をページごとに読み込みながら順に返す"""
+        return self.archive.iter_turns(self.session_id, page_size)
+
+    def __repr__(self):
+        return f"SessionInfo({self.session_id}, {format_timestamp(self.started)}, {self.turn_count}発話)"
+
+class SessionArchive:
+    """会話セッションを開始時刻の索引付きでSQLiteに保存するアーカイブ
+
+    前回の会話は索引の末尾を1件引くだけで開け、日付の範囲での検索や、
+    発話のページごとの読み込みもできる。ログが何年分たまっても
+    ディレクトリ全体を調べたり、ファイル全体を読んだりすることはない。
+    """
+
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id INTEGER PRIMARY KEY AUTOINCREMENT, started REAL, ended REAL, turn_count INTEGER)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " session_id INTEGER, seq INTEGER, created REAL, role TEXT, content TEXT,"
+            " PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+        self.db.commit()
+
+    def save_session(self, messages, started=None, ended=None):
+        """Messageのリストを1セッションとして保存し、セッションIDを返す"""
+        messages = list(messages)
+        ended = to_epoch(ended) if ended is not None else time.time()
+        if started is not None:
+            started = to_epoch(started)
+        else:
+            started = messages[0].created if messages else ended
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO sessions (started, ended, turn_count) VALUES (?, ?, ?)",
+                (started, ended, len(messages))
+            )
+            session_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO turns VALUES (?, ?, ?, ?, ?)",
+                [(session_id, seq, msg.created, msg.role, msg.content) for seq, msg in enumerate(messages)]
+            )
+            self.db.commit()
+        return session_id
+
+    def _session(self, row):
+        return SessionInfo(self, *row) if row else None
+
+    def latest_session(self):
+        """最新のセッションを返す（なければNone）"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT session_id, started, ended, turn_count FROM sessions ORDER BY started DESC LIMIT 1"
+            ).fetchone()
+        return self._session(row)
+
+    def get_session(self, session_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT session_id, started, ended, turn_count FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return self._session(row)
+
+    def sessions_between(self, start, end):
+        """開始時刻が start 以上 end 未満のセッションを古い順に返す"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT session_id, started, ended, turn_count FROM sessions"
+                " WHERE started >= ? AND started < ? ORDER BY started",
+                (to_epoch(start), to_epoch(end))
+            ).fetchall()
+        return [self._session(row) for row in rows]
+
+    def sessions_on(self, date):
+        """指定した日のセッションを返す"""
+        return self.sessions_between(date, date + datetime.timedelta(days=1))
+
+    def turns(self, session_id, offset=0, limit=PAGE_SIZE):
+        """セッションの発話を offset から limit 件読み込む"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT role, content, created FROM turns WHERE session_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (session_id, offset, limit)
+            ).fetchall()
+        return [Message(role, content, created) for role, content, created in rows]
+
+    def iter_turns(self, session_id, page_size=PAGE_SIZE):
+        """セッションの発話をページごとに読み込みながら順に返す"""
+        offset = 0
+        while True:
+            page = self.turns(session_id, offset, page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def export_csv(self, session_id, path):
+        """セッションの発話をCSVに書き出す"""
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["timestamp", "role", "content"])
+            for msg in self.iter_turns(session_id):
+                writer.writerow([msg.timestamp, msg.role, msg.content])
+        return path
+
+# ファイルごとの共有のアーカイブ（接続はファイルごとに1つだけ開く）
+_archives = {}
+_archives_lock = threading.Lock()
+
+def get_session_archive(path=ARCHIVE_PATH):
+    """ファイルごとに共有のアーカイブを返す"""
+    key = os.path.abspath(path)
+    with _archives_lock:
+        if key not in _archives:
+            _archives[key] = SessionArchive(key)
+        return _archives[key]
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import asyncio
+import importlib
+import threading
+import webbrowser
+from concurrent.futures import ThreadPoolExecutor
+from keyword_matcher import INTENT_MATCHER
+
+# セッションの状態
+MENU = "menu"
+CHAT = "chat"
+CALC = "calc"
+POTZ = "potz"
+EXIT = "exit"
+
+# 状態ごとに移れる状態
+TRANSITIONS = {
+    MENU: {CHAT, CALC, POTZ, EXIT},
+    CHAT: {MENU, EXIT},
+    CALC: {MENU, EXIT},
+    POTZ: {MENU, EXIT},
+    EXIT: set(),
+}
+
+# 画面を閉じた時に、終了の案内を読み上げ終わるまで待つ最長の時間（秒）
+STOP_TIMEOUT = 5.0
+# モードがエラーで終わった時、次のモードを始めるまで待つ時間（秒）
+ERROR_RETRY_DELAY = 1.0
+
+POTZ_URL = "https://ftc.potz.jp/dashboard"
+MENU_CHOICES = "おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？"
+GREETING = "もしもし。おしゃべり、脳トレゲーム、ポッツに接続のどれをしますか？"
+# モードからメニューに戻った時の案内
+RETURN_PROMPTS = {
+    CHAT: "おしゃべりを終了しました。次は何かしますか？" + MENU_CHOICES,
+    CALC: "脳トレゲームを終了しました。次は何かしますか？" + MENU_CHOICES,
+    POTZ: "ポッツに接続しました。次は何かしますか？" + MENU_CHOICES,
+}
+
+class SessionResources:
+    """マイク・スピーカー・LLMを、中止できる非同期の操作として提供するクラス
+
+    それぞれの操作は専用の1スレッドで実行し、待っているタスクが中止されたら
+    中止フラグを立てて、聞き取り・読み上げ・応答の生成をすぐに止める。
+    """
+
+    def __init__(self):
+        self.mic_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mic")
+        self.speaker_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speaker")
+        self.llm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="respond")
+        # 読み込みや保存は、応答の生成が止まるのを待たずに実行できるよう別のスレッドで行う
+        self.call_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="call")
+
+    async def _run(self, executor, func, cancel_event=None, on_cancel=None):
+        """funcを別スレッドで実行して結果を待つ（中止されたらスレッド側も止める）"""
+        future = asyncio.get_running_loop().run_in_executor(executor, func)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if cancel_event is not None:
+                cancel_event.set()
+            if on_cancel is not None:
+                on_cancel()
+            raise
+
+    def start_barge_in(self):
+        """読み上げ中にユーザーが話し始めたら、読み上げを止めて聞き取りに移れるようにする"""
+        import speech_input
+        import speech_output
+        speech_input.start_barge_in_monitor(speech_output.is_speaking, speech_output.echo_level, speech_output.interrupt)
+
+    async def call(self, func, *args):
+        """中止できない処理（モジュールの読み込みや保存など）を別スレッドで実行する"""
+        return await self._run(self.call_executor, lambda: func(*args))
+
+    async def listen(self, vocabulary=None):
+        """発話を1つ聞き取って返す（聞き取れなければNone）"""
+        import speech_input
+        cancel_event = threading.Event()
+        return await self._run(
+            self.mic_executor,
+            lambda: speech_input.listen(vocabulary, cancel_event=cancel_event),
+            cancel_event
+        )
+
+    async def speak(self, text, urgent=False):
+        """テキストを読み上げ、読み上げ終わるまで待つ（割り込まれたらFalse）
+
+        urgentなら、読み上げを待っている他の依頼より先に読み上げる（終了の案内など）。
+        """
+        import speech_input
+        import speech_output
+        # ユーザーが話している途中なら次の案内は読み上げず、すぐ聞き取りに移る
+        if speech_input.has_pending_speech():
+            print(f"コンピュータ（省略）: {text}")
+            return False
+        return await self._run(
+            self.speaker_executor,
+            lambda: speech_output.speak(text, speech_output.PRIORITY_URGENT if urgent else speech_output.PRIORITY_NORMAL),
+            on_cancel=speech_output.interrupt
+        )
+
+    async def respond(self, api_chat, user_input, history, on_sentence=None):
+        """応答を生成しながら読み上げ、応答全体のテキストを返す"""
+        import speech_output
+        cancel_event = threading.Event()
+        return await self._run(
+            self.llm_executor,
+            lambda: api_chat.respond(user_input, history, on_sentence=on_sentence, cancel_event=cancel_event),
+            cancel_event,
+            on_cancel=speech_output.interrupt
+        )
+
+class SessionOrchestrator:
+    """メニュー・おしゃべり・脳トレゲーム・ポッツ接続を切り替える状態機械
+
+    各モードは1つのasyncioタスクとして実行し、モードが次の状態を返すか、
+    request()で別の状態が指定されるとタスクを終えて次のモードに移る。
+    画面側はadd_listener()で状態や表示内容の変化を受け取る
+    （リスナーは任意のスレッドから呼ばれる）。
+    """
+
+    def __init__(self, resources=None):
+        self.resources = resources or SessionResources()
+        self.state = MENU
+        self.listeners = []
+        self.loop = None
+        self.thread = None  # start_in_thread()で起動したスレッド
+        self.task = None  # 今のモードのタスク
+        self.requested = None  # 外から指定された次の状態
+        self.menu_prompt = GREETING
+        self.modes = {
+            MENU: self.run_menu,
+            CHAT: self.run_chat,
+            CALC: self.run_calc,
+            POTZ: self.run_potz,
+        }
+
+    def add_listener(self, listener):
+        """listener(event, value) を登録する（eventは state, chat_response, calc_question, calc_result）"""
+        self.listeners.append(listener)
+
+    def notify(self, event, value=None):
+        for listener in self.listeners:
+            try:
+                listener(event, value)
+            except Exception as e:
+                print(f"画面の更新に失敗しました: {e}")
+
+    def transition(self, new_state):
+        """状態を移す（移れない状態ならValueError）"""
+        if new_state not in TRANSITIONS[self.state]:
+            raise ValueError(f"{self.state}から{new_state}には移れません")
+        if new_state == MENU:
+            self.menu_prompt = RETURN_PROMPTS.get(self.state, MENU_CHOICES)
+        self.state = new_state
+        self.notify("state", new_state)
+
+    def request(self, new_state):
+        """今のモードを中止して new_state に移る（どのスレッドからでも呼べる）"""
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._request, new_state)
+            except RuntimeError:
+                # runが終わってイベントループが閉じている
+                pass
+
+    def _request(self, new_state):
+        if new_state not in TRANSITIONS[self.state]:
+            print(f"{self.state}から{new_state}には移れません")
+            return
+        self.requested = new_state
+        if self.task is not None and not self.task.done():
+            # 聞き取り・読み上げ・応答の生成はすぐに止まる
+            self.task.cancel()
+
+    async def run(self):
+        """終了が選ばれるまでモードを順に実行する"""
+        self.loop = asyncio.get_running_loop()
+        # マイクの騒音測定は最初の案内を読み上げる前に済ませる
+        await self.resources.call(self.resources.start_barge_in)
+        self.notify("state", self.state)
+        while self.state != EXIT:
+            self.task = asyncio.create_task(self.modes[self.state]())
+            try:
+                next_state = await self.task
+            except asyncio.CancelledError:
+                # request()による中止でなければ、run自体が中止された
+                if self.requested is None:
+                    raise
+                next_state = None
+            except Exception as e:
+                # モードの失敗でセッション全体を止めず、メニューからやり直す
+                print(f"{self.state}の実行中にエラーが発生しました: {e}")
+                next_state = MENU
+                await asyncio.sleep(ERROR_RETRY_DELAY)
+            if self.requested is not None:
+                next_state, self.requested = self.requested, None
+            if next_state == MENU and self.state == MENU:
+                # メニュー自体の失敗は、もう一度メニューを実行する
+                continue
+            self.transition(next_state)
+        await self.resources.speak("プログラムを終了します。", urgent=True)
+
+    def start_in_thread(self):
+        """別スレッドでイベントループを動かしてrunを実行する（画面を持つ場合に使う）"""
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """終了に移り、start_in_thread()のスレッドが終わるまで最長timeout秒待つ
+
+        終わればTrueを返す。画面を閉じる時に呼び、終了の案内の読み上げや
+        記録の保存が途中で打ち切られないようにする。
+        """
+        if self.thread is None:
+            return True
+        if self.state != EXIT:
+            self.request(EXIT)
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    async def run_menu(self):
+        """モードを聞き取り、次の状態を返す"""
+        import speech_input
+        r = self.resources
+        await r.speak(self.menu_prompt)
+        while True:
+            user_input = await r.listen(speech_input.MENU_VOCABULARY)
+            if not user_input:
+                continue
+            matched = INTENT_MATCHER.categories(user_input.replace(" ", "").replace("　", ""))
+            # 「終了」や「さようなら」「終わります」で終了
+            if "exit" in matched:
+                return EXIT
+            if "menu_chat" in matched:
+                return CHAT
+            if "menu_calc" in matched:
+                return CALC
+            if "menu_potz" in matched:
+                return POTZ
+            print("選択可能なモード：")
+            print("1. おしゃべり")
+            print("2. 脳トレゲーム")
+            print("3. ポッツに接続")
+            print("4. 終了")
+            await r.speak("もう一度お願いします。" + MENU_CHOICES)
+
+    async def run_chat(self):
+        """おしゃべり（「終了」でメニューに戻る）"""
+        r = self.resources
+        await r.speak("おしゃべりしましょう")
+        # LangChainやOpenAIはおしゃべりを始める時に初めて読み込む
+        api_chat = await r.call(importlib.import_module, "api_chat")
+        from rolling_summary import RollingSummarizer
+        summarizer = api_chat.session_summarizer = RollingSummarizer()
+        history = api_chat.ConversationHistory(summarizer=summarizer)
+        start_time = time.time()
+        partial = True  # 「終了」で終わらずに中止されたか
+        try:
+            await r.speak(random.choice(api_chat.INITIAL_TOPICS))
+            while True:
+                self.notify("chat_response", "")
+                user_input = await r.listen()
+                if not user_input:
+                    continue
+                print(f"ユーザー: {user_input}")
+                if "終了" in user_input:
+                    partial = False
+                    await r.speak("会話を終了します。", urgent=True)
+                    return MENU
+                history.add_message("user", user_input)
+                response = await r.respond(
+                    api_chat, user_input, history,
+                    on_sentence=lambda text: self.notify("chat_response", text)
+                )
+                if response:
+                    history.add_message("assistant", response)
+        finally:
+            # 要約と保存はバックグラウンドで行う（途中で中止された場合は中断した会話として記録する）
+            try:
+                api_chat.save_conversation_summary_async(
+                    history.get_messages(), start_time, time.time(), summarizer=summarizer, partial=partial
+                )
+            except Exception as e:
+                print(f"会話履歴の保存に失敗しました: {e}")
+
+    async def run_calc(self):
+        """脳トレゲーム（10問、「終了」で途中終了）"""
+        r = self.resources
+        await r.speak("脳トレゲームをしましょう")
+        voice_calc_game = await r.call(importlib.import_module, "voice_calc_game")
+        # 出題・採点・保存はvoice_calc_game.pyの手順をそのまま使う
+        game = voice_calc_game.VoiceCalculationGame()
+        for text in voice_calc_game.INTRO_MESSAGES:
+            await r.speak(text)
+
+        game.start()
+        for i in range(1, game.total_questions + 1):
+            question, answer = game.next_question(i)
+            self.notify("calc_question", f"第{i}問目: {question}")
+            self.notify("calc_result", "")
+            await r.speak(question)
+            response = await r.listen(voice_calc_game.ANSWER_VOCABULARY)
+            if not response:
+                await r.speak(voice_calc_game.RETRY_MESSAGE)
+                await r.speak(question)
+                response = await r.listen(voice_calc_game.ANSWER_VOCABULARY)
+                if not response:
+                    self.notify("calc_result", game.skip(i))
+                    continue
+            result, messages, finished = game.grade(i, response, answer)
+            self.notify("calc_result", result)
+            for text in messages:
+                await r.speak(text)
+            if finished:
+                break
+
+        closing = game.finish()
+        self.notify("calc_question", "")
+        self.notify("calc_result", f"ゲーム終了！{game.score}問正解でした。")
+        # Googleスプレッドシート（Sheet2）への記録はバックグラウンドで送信される
+        await r.call(game.save_result)
+        for text in closing:
+            await r.speak(text)
+        return MENU
+
+    async def run_potz(self):
+        """ポッツのダッシュボードを開いてメニューに戻る"""
+        await self.resources.speak("ポッツへの接続を開始します")
+        webbrowser.open(POTZ_URL)
+        await asyncio.sleep(3)
+        return MENU
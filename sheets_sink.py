@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import threading
+
+SERVICE_ACCOUNT_FILE = "rzpi_chat.json"
+SCOPE = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+# google: Google Sheets / local: ローカルのCSVに書き込む（動作確認用）
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "google")
+LOCAL_SHEETS_DIR = os.getenv("LOCAL_SHEETS_DIR", "sheets_local")
+
+def authorize_gspread():
+    """サービスアカウントで認証したgspreadクライアントを返す"""
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, SCOPE)
+    return gspread.authorize(credentials)
+
+class LocalWorksheet:
+    """Google Sheetsのワークシートの代わりにCSVファイルへ書き込むクラス"""
+
+    def __init__(self, path, title):
+        self.path = path
+        self.title = title
+        self.calls = []  # 受け取った (行のリスト, value_input_option)
+
+    def append_row(self, row, value_input_option="RAW"):
+        self.append_rows([row], value_input_option)
+
+    def append_rows(self, rows, value_input_option="RAW"):
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(rows)
+        self.calls.append(([list(row) for row in rows], value_input_option))
+
+    def get_all_values(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))
+
+class LocalSpreadsheet:
+    """Google Sheetsのスプレッドシートの代わりにディレクトリを使うクラス"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.added = []  # add_worksheetで作成したシート名
+        os.makedirs(directory, exist_ok=True)
+
+    def worksheets(self):
+        names = sorted(f[:-4] for f in os.listdir(self.directory) if f.endswith(".csv"))
+        return [LocalWorksheet(os.path.join(self.directory, f"{name}.csv"), name) for name in names]
+
+    def add_worksheet(self, title, rows, cols):
+        self.added.append(title)
+        path = os.path.join(self.directory, f"{title}.csv")
+        open(path, "a", encoding="utf-8").close()
+        return LocalWorksheet(path, title)
+
+    @property
+    def sheet1(self):
+        sheets = self.worksheets()
+        return sheets[0] if sheets else self.add_worksheet("sheet1", 1000, 20)
+
+class LocalSheetsClient:
+    """gspreadクライアントの代わりにローカルのCSVへ書き込むクライアント"""
+
+    def __init__(self, directory=LOCAL_SHEETS_DIR):
+        self.directory = directory
+
+    def open_by_key(self, key):
+        return LocalSpreadsheet(os.path.join(self.directory, key or "default"))
+
+    def open(self, name):
+        return LocalSpreadsheet(os.path.join(self.directory, name))
+
+class SheetsSink:
+    """認証済みクライアントとワークシートを保持し、行をまとめて追記するクラス
+
+    write_rows()は渡された行をワークシートごとに1回のappend_rowsで送信する。
+    送信の再試行は記録のジャーナル（record_journal.py）が行う。
+    """
+
+    def __init__(self, spreadsheet_key=None, spreadsheet_name=None, client_factory=None):
+        self.spreadsheet_key = spreadsheet_key
+        self.spreadsheet_name = spreadsheet_name
+        self.client_factory = client_factory or authorize_gspread
+        self.spreadsheet = None
+        self.worksheets = {}  # 小文字のシート名 -> ワークシート
+        self.headers = {}  # シート名 -> 新規作成時のヘッダー行
+        self.lock = threading.RLock()
+
+    def _open_spreadsheet(self):
+        if self.spreadsheet is None:
+            client = self.client_factory()
+            if self.spreadsheet_key:
+                self.spreadsheet = client.open_by_key(self.spreadsheet_key)
+            else:
+                self.spreadsheet = client.open(self.spreadsheet_name)
+            # シート一覧は接続時に一度だけ取得する
+            self.worksheets = {ws.title.lower(): ws for ws in self.spreadsheet.worksheets()}
+        return self.spreadsheet
+
+    def get_worksheet(self, sheet_name):
+        """ワークシートを返す（なければヘッダー付きで作成、Noneなら先頭のシート）"""
+        # 同じシートを2回作成しないよう、確認と作成はロックの中で行う
+        with self.lock:
+            spreadsheet = self._open_spreadsheet()
+            if sheet_name is None:
+                return spreadsheet.sheet1
+            key = sheet_name.lower()
+            if key not in self.worksheets:
+                print(f"{sheet_name}が見つからないため、新規作成します")
+                ws = spreadsheet.add_worksheet(title=sheet_name, rows="1000", cols="20")
+                header = self.headers.get(sheet_name)
+                if header:
+                    ws.append_row(header, value_input_option="RAW")
+                self.worksheets[key] = ws
+            return self.worksheets[key]
+
+    def write_rows(self, sheet_name, rows, header=None):
+        """行をすぐに1回のappend_rowsで送信する（失敗時は接続を作り直して例外を送出）
+
+        値はRAWで書き込む（「3/10」のようなスコアが日付に、「=」で始まる文が
+        数式に変換されないようにする）。
+        """
+        with self.lock:
+            if header:
+                self.headers[sheet_name] = header
+            try:
+                ws = self.get_worksheet(sheet_name)
+                ws.append_rows(rows, value_input_option="RAW")
+            except Exception:
+                self.spreadsheet = None
+                self.worksheets = {}
+                raise
+        print(f"{ws.title}に{len(rows)}行を保存しました")
+
+    def read_rows(self, sheet_name):
+        """ワークシートの全行を文字列のリストとして返す（送信済みかの確認用）"""
+        with self.lock:
+            try:
+                return self.get_worksheet(sheet_name).get_all_values()
+            except Exception:
+                self.spreadsheet = None
+                self.worksheets = {}
+                raise
+
+# スプレッドシートごとの共有の書き込み先
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+def get_sheets_sink(spreadsheet_key=None, spreadsheet_name=None):
+    """スプレッドシートごとに共有のSheetsSinkを返す"""
+    if spreadsheet_key is None and spreadsheet_name is None:
+        spreadsheet_key = os.getenv("GOOGLE_SHEET_ID")
+    key = (spreadsheet_key, spreadsheet_name)
+    with _sinks_lock:
+        if key not in _sinks:
+            factory = LocalSheetsClient if SHEETS_BACKEND == "local" else authorize_gspread
+            _sinks[key] = SheetsSink(spreadsheet_key, spreadsheet_name, client_factory=factory)
+        return _sinks[key]
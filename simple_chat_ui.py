@@ -1,18 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import tkinter as tk
 from tkinter import scrolledtext, font
 import threading
 import time
 import queue
-import api_chat  # 既存のAPI会話機能をインポート
-import subprocess
 import sys
-import webbrowser
-import voice_calc_game
+import session_orchestrator
+from session_orchestrator import SessionOrchestrator
 import pygame
 import platform
+from collections import OrderedDict
 
 # モード選択肢
 MODES = [
@@ -35,6 +35,19 @@ if platform.system() == "Darwin":
 else:
     FONT_PATH = VL_GOTHIC_LOCAL
 
+# 話者ごとの表示名とタグ（名前用のタグ, 本文用のタグ）
+SPEAKER_LABELS = {
+    "system": ("アシスタント: ", "assistant", "assistant_msg"),  # システムメッセージは「アシスタント」として表示
+    "user": ("あなた: ", "user", "user_msg"),
+    "assistant": ("アシスタント: ", "assistant", "assistant_msg"),
+}
+
+# PygameUIの描画の設定
+FPS = 30  # 状態の変化を確認する回数（1秒あたり）
+TEXT_CACHE_SIZE = 256  # 折り返し・描画済みの文字列を覚えておく数
+# 1で以前と同じく毎フレーム全体を描き直し、文字列も毎回描画する（描画負荷を比べるための基準）
+RENDER_BASELINE = os.getenv("UI_RENDER_BASELINE", "0") == "1"
+
 class SimpleChatUI:
     def __init__(self, root, standalone=True):
         self.root = root
@@ -44,8 +57,10 @@ class SimpleChatUI:
         #self.root.configure(bg="#F0F0F0")  # 背景色
         self.root.configure(bg="#FFFFFF")
         
-        # メッセージキュー
+        # メッセージキュー（表示はTkのスレッドでまとめて行う）
         self.message_queue = queue.Queue()
+        self.drain_lock = threading.Lock()
+        self.drain_scheduled = False
         
         # フォント設定（大きく）
         self.title_font = font.Font(family="Helvetica", size=32, weight="bold")
@@ -53,12 +68,10 @@ class SimpleChatUI:
         self.button_font = font.Font(family="Helvetica", size=24, weight="bold")
         
         self.create_widgets()
+        self.configure_tags()
         
-        # メッセージ処理スレッド
+        # 画面を閉じた後は表示しない
         self.stop_event = threading.Event()
-        self.ui_update_thread = threading.Thread(target=self.update_ui)
-        self.ui_update_thread.daemon = True
-        self.ui_update_thread.start()
         
         # 終了時の処理を登録
         if self.standalone:
@@ -128,43 +141,8 @@ class SimpleChatUI:
             )
             self.back_button.pack(padx=10)
     
-    def update_ui(self):
-        """UIを更新するスレッド"""
-        while not self.stop_event.is_set():
-            try:
-                # キューからメッセージを取得
-                if not self.message_queue.empty():
-                    msg_type, msg_text = self.message_queue.get(block=False)
-                    self.add_message(msg_type, msg_text)
-                    self.message_queue.task_done()
-                time.sleep(0.1)
-            except Exception as e:
-                print(f"UI更新エラー: {e}")
-                time.sleep(1)
-    
-    def add_message(self, speaker, message):
-        """会話表示エリアにメッセージを追加"""
-        self.chat_display.config(state=tk.NORMAL)
-        
-        # 話者に合わせて色を変更
-        if speaker == "system":
-            # システムメッセージは「アシスタント」として表示
-            self.chat_display.insert(tk.END, "アシスタント: ", "assistant")
-            tag = "assistant_msg"
-        elif speaker == "user":
-            self.chat_display.insert(tk.END, "あなた: ", "user")
-            tag = "user_msg"
-        elif speaker == "assistant":
-            self.chat_display.insert(tk.END, "アシスタント: ", "assistant")
-            tag = "assistant_msg"
-        else:
-            self.chat_display.insert(tk.END, f"{speaker}: ", "other")
-            tag = "other_msg"
-        
-        # メッセージ本文
-        self.chat_display.insert(tk.END, f"{message}\n\n", tag)
-        
-        # タグの設定
+    def configure_tags(self):
+        """会話表示エリアのタグを設定（作成時に一度だけ）"""
         self.chat_display.tag_config("system", foreground="#006600", font=self.text_font)
         self.chat_display.tag_config("user", foreground="#0066CC", font=self.text_font)
         self.chat_display.tag_config("assistant", foreground="#006600", font=self.text_font)
@@ -174,7 +152,49 @@ class SimpleChatUI:
         self.chat_display.tag_config("user_msg", foreground="#333333", font=self.text_font)
         self.chat_display.tag_config("assistant_msg", foreground="#333333", font=self.text_font)
         self.chat_display.tag_config("other_msg", foreground="#333333", font=self.text_font)
+    
+    def post_message(self, speaker, message):
+        """メッセージをキューに入れ、Tkのスレッドでの表示を予約する（どのスレッドからでも呼べる）"""
+        self.message_queue.put((speaker, message))
+        with self.drain_lock:
+            # 表示の予約済みなら、次の表示でまとめて表示される
+            if self.drain_scheduled:
+                return
+            self.drain_scheduled = True
+        try:
+            self.root.after(0, self.drain_messages)
+        except (RuntimeError, tk.TclError):
+            # 画面が閉じられている
+            pass
+    
+    def drain_messages(self):
+        """キューにたまったメッセージをまとめて表示する（Tkのスレッドで実行）"""
+        with self.drain_lock:
+            self.drain_scheduled = False
+        messages = []
+        while True:
+            try:
+                messages.append(self.message_queue.get_nowait())
+            except queue.Empty:
+                break
+            self.message_queue.task_done()
+        if messages and not self.stop_event.is_set():
+            self.add_messages(messages)
+    
+    def add_message(self, speaker, message):
+        """会話表示エリアにメッセージを追加（Tkのスレッドで呼ぶ）"""
+        self.add_messages([(speaker, message)])
+    
+    def add_messages(self, messages):
+        """会話表示エリアに複数のメッセージを1回の挿入で追加（Tkのスレッドで呼ぶ）"""
+        chunks = []
+        for speaker, message in messages:
+            # 話者に合わせて色を変更
+            label, label_tag, tag = SPEAKER_LABELS.get(speaker, (f"{speaker}: ", "other", "other_msg"))
+            chunks.extend([label, label_tag, f"{message}\n\n", tag])
         
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.insert(tk.END, *chunks)
         self.chat_display.config(state=tk.DISABLED)
         self.chat_display.see(tk.END)  # 最新メッセージまでスクロール
         
@@ -205,115 +225,74 @@ class SimpleChatUI:
     
     def run_conversation(self):
         """会話処理を実行"""
+        # 会話機能（LLM・音声入出力）は会話を始める時に読み込む
+        import api_chat
+        import speech_output
         try:
-            # オリジナルの関数をオーバーライド
-            def custom_speak(text, wait=True):
-                # UIにメッセージを追加
-                self.message_queue.put(("assistant", text))
-                # 元の関数を呼び出し
+            def say_message(role, text, priority=speech_output.PRIORITY_NORMAL, wait=True):
+                """読み上げを依頼して会話に記録する
+
+                最後まで読み上げればTrue、中止されればFalseを返す。wait=Falseなら
+                読み上げ終わりを待たずにFutureを返す。
+                """
+                print(f"{'システム' if role == 'system' else 'アシスタント'}: {text}")
                 try:
-                    # 再帰呼び出しを防ぐために直接subprocess呼び出し
-                    print(f"アシスタント: {text}")
-                    # 会話を記録
-                    api_chat.conversation_manager.add_to_conversation("assistant", text)
-                    
-                    # AIが話し始めるフラグをセット
-                    api_chat.gpt_speaking = True
-                    
-                    # 「は」を「わ」と発音させるための置換
-                    speaking_text = text.replace("は", "わ").replace("初めましょう", "はじめましょう")
-                    
-                    # 句読点で区切って発話をより自然にする
-                    for mark in ["。", "、", "！", "？"]:
-                        speaking_text = speaking_text.replace(mark, mark + " ")
-                    
-                    # macOSのsayコマンドを使用
-                    if wait:
-                        subprocess.run(["say", "-v", "Kyoko", "-r", "140", speaking_text])
-                        api_chat.gpt_speaking = False
-                    else:
-                        # 待たずに次の処理に進む
-                        process = subprocess.Popen(["say", "-v", "Kyoko", "-r", "140", speaking_text])
-                        # 非同期で終了を検知
-                        def monitor_process():
-                            process.wait()
-                            api_chat.gpt_speaking = False
-                        threading.Thread(target=monitor_process, daemon=True).start()
-                    
+                    api_chat.conversation_manager.add_to_conversation(role, text)
+                    # 合成と再生は読み上げサービスが1つのスレッドで順に行う
+                    future = speech_output.speak_async(text, priority)
                     # 最後の活動時間を更新
                     api_chat.last_activity_time = time.time()
-                    return None
+                    if wait:
+                        return speech_output.wait(future)
+                    return future
                 except Exception as e:
                     print(f"音声出力エラー: {e}")
-                    api_chat.gpt_speaking = False
-                    return None
+                    return False
+
+            # オリジナルの関数をオーバーライド
+            def custom_speak(text, priority=speech_output.PRIORITY_NORMAL, wait=True):
+                # UIにメッセージを追加
+                self.post_message("assistant", text)
+                return say_message("assistant", text, priority, wait)
             
-            def custom_say_system_message(message, wait=True):
-                """システムメッセージを発話する（相槌など）"""
-                # 相槌は画面に表示しない（短いメッセージは相槌と見なす）
-                if len(message) <= 10 and any(word in message for word in ["うん", "はい", "そうですね", "なるほど"]):
-                    # 相槌は表示しない
-                    pass
-                else:
-                    # システムメッセージとして表示（トピック提案など長めのメッセージ）
-                    self.message_queue.put(("system", message))
-                
+            def custom_speak_stream(chunks, cancel_event=None):
+                """LLMの応答を文ごとに読み上げ、読み上げ終わった応答全体を表示・記録する"""
+                sentences = []
+
+                def collect():
+                    for chunk in chunks:
+                        sentences.append(chunk)
+                        yield chunk
+
                 try:
-                    # 再帰呼び出しを防ぐために直接処理
-                    print(f"システム: {message}")
-                    
-                    # AIが話し始めるフラグをセット（相槌でも設定）
-                    api_chat.gpt_speaking = True
-                    
-                    # 会話を記録
-                    api_chat.conversation_manager.add_to_conversation("system", message)
-                    
-                    # 「は」を「わ」と発音させるための置換
-                    speaking_text = message.replace("は", "わ").replace("初めましょう", "はじめましょう")
-                    
-                    # 句読点で区切って発話をより自然にする
-                    for mark in ["。", "、", "！", "？"]:
-                        speaking_text = speaking_text.replace(mark, mark + " ")
-                    
-                    # macOSのsayコマンドを使用
-                    if wait:
-                        subprocess.run(["say", "-v", "Kyoko", "-r", "140", speaking_text])
-                        api_chat.gpt_speaking = False
-                    else:
-                        # 待たずに次の処理に進む
-                        process = subprocess.Popen(["say", "-v", "Kyoko", "-r", "140", speaking_text])
-                        # 非同期で終了を検知
-                        def monitor_process():
-                            process.wait()
-                            api_chat.gpt_speaking = False
-                        threading.Thread(target=monitor_process, daemon=True).start()
-                    
-                    # 最後の活動時間を更新
-                    api_chat.last_activity_time = time.time()
-                except Exception as e:
-                    print(f"システムメッセージ発話中にエラーが発生しました: {e}")
-                    api_chat.gpt_speaking = False
+                    return original_speak_stream(collect(), cancel_event=cancel_event)
+                finally:
+                    response = "".join(sentences)
+                    if response:
+                        self.post_message("assistant", response)
+                        api_chat.conversation_manager.add_to_conversation("assistant", response)
+                        api_chat.last_activity_time = time.time()
             
             # 関数をオーバーライド
             original_speak = api_chat.speak
-            original_say_system = api_chat.say_system_message
+            original_speak_stream = api_chat.speak_stream
             
             api_chat.speak = custom_speak
-            api_chat.say_system_message = custom_say_system_message
+            api_chat.speak_stream = custom_speak_stream
             
             # ユーザー発話を取得する関数をオーバーライド
             original_listen = api_chat.listen
             
-            def custom_listen(conversation_history):
+            def custom_listen(vocabulary=None):
                 # UIのステータスを更新
                 self.root.after(0, lambda: self.update_status("聞いています..."))
                 # 元の関数を呼び出し
                 try:
-                    text = original_listen(conversation_history)
+                    text = original_listen(vocabulary)
                     if text:
                         # UIにメッセージを追加（短すぎる相槌っぽいものは非表示）
                         if len(text) > 2:  # 短すぎる応答は表示しない
-                            self.message_queue.put(("user", text))
+                            self.post_message("user", text)
                     return text
                 except Exception as e:
                     print(f"音声認識エラー: {e}")
@@ -332,7 +311,7 @@ class SimpleChatUI:
             
             # 元の関数を復元
             api_chat.speak = original_speak
-            api_chat.say_system_message = original_say_system
+            api_chat.speak_stream = original_speak_stream
             api_chat.listen = original_listen
             
             # 終了ステータスを表示
@@ -340,13 +319,15 @@ class SimpleChatUI:
             
         except Exception as e:
             print(f"会話エラー: {e}")
-            self.root.after(0, lambda: self.update_status(f"エラーが発生しました: {e}"))
+            status = f"エラーが発生しました: {e}"
+            self.root.after(0, lambda: self.update_status(status))
     
     def back_to_main(self):
         """メインメニューに戻る"""
         # 会話が実行中なら終了
         if self.conversation_thread and self.conversation_thread.is_alive():
             # 会話を終了
+            import api_chat
             api_chat.last_activity_time = time.time()
             api_chat.silence_counter = 0
             
@@ -356,7 +337,7 @@ class SimpleChatUI:
         
         # 親ウィンドウに戻る準備
         self.update_status("メインメニューに戻ります...")
-        self.stop_event.set()  # UIの更新スレッドを停止
+        self.stop_event.set()  # 以降のメッセージは表示しない
         
         # rootウィンドウを閉じる（親ウィンドウは残る）
         self.root.destroy()
@@ -366,6 +347,7 @@ class SimpleChatUI:
         # 会話が実行中なら終了
         if self.conversation_thread and self.conversation_thread.is_alive():
             # 会話を終了
+            import api_chat
             api_chat.last_activity_time = time.time()
             api_chat.silence_counter = 0
         
@@ -380,10 +362,52 @@ class SimpleDisplayUI:
         self.root.configure(bg="#FFFFFF")
         self.current_frame = None
         self.mode = None
+        self.closing = False
         self.question_no = 0
         self.last_result = ""
+        # モードの切り替えと音声のやり取りは状態機械に任せ、画面は通知に合わせて切り替える
+        self.orchestrator = SessionOrchestrator()
+        self.orchestrator.add_listener(self.on_session_event)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.create_mode_select()
         print("モード選択画面を表示")
+        self.orchestrator.start_in_thread()
+
+    def on_session_event(self, event, value):
+        """状態機械からの通知をTkのスレッドで画面に反映する（どのスレッドからでも呼ばれる）"""
+        if self.closing:
+            # 閉じる途中はTkのスレッドが終了を待っているため、表示しない
+            return
+        try:
+            self.root.after(0, self.apply_session_event, event, value)
+        except (RuntimeError, tk.TclError):
+            # 画面が閉じられている
+            pass
+
+    def apply_session_event(self, event, value):
+        if event == "state":
+            screens = {
+                session_orchestrator.MENU: self.create_mode_select,
+                session_orchestrator.CHAT: self.show_chat,
+                session_orchestrator.CALC: self.show_calc_game,
+                session_orchestrator.POTZ: self.show_potz,
+                session_orchestrator.EXIT: self.show_exit,
+            }
+            if value != self.mode:
+                screens[value]()
+        elif event == "chat_response":
+            self.set_chat_response(value)
+        elif event == "calc_question":
+            self.set_calc_question(value)
+        elif event == "calc_result":
+            self.set_calc_result(value)
+
+    def on_closing(self):
+        """ウィンドウを閉じたら、聞き取りや読み上げを止め、状態機械が終わるのを待って終了する"""
+        self.closing = True
+        if not self.orchestrator.stop():
+            print("終了処理が時間内に終わりませんでした")
+        self.root.quit()
         
     def clear_frame(self):
         if self.current_frame:
@@ -392,7 +416,7 @@ class SimpleDisplayUI:
 
     def create_mode_select(self):
         self.clear_frame()
-        self.mode = None
+        self.mode = session_orchestrator.MENU
         frame = tk.Frame(self.root, bg="#F8F8F8")
         frame.pack(expand=True, fill=tk.BOTH)
         self.current_frame = frame
@@ -413,36 +437,10 @@ class SimpleDisplayUI:
                 fg="#444"
             )
             mode_label.pack(pady=20)
-        # 音声認識で選択を開始
-        threading.Thread(target=self.listen_mode_select, daemon=True).start()
-
-    def listen_mode_select(self):
-        import speech_input
-        import speech_output
-        speech_output.speak("おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？")
-        while True:
-            user_input = speech_input.listen()
-            if not user_input:
-                continue
-            normalized = user_input.replace(" ", "").replace("　", "")
-            if any(word in normalized for word in ["終了", "さようなら", "終わります", "終了します"]):
-                self.show_exit()
-                return
-            elif "おしゃべり" in normalized:
-                self.show_chat()
-                return
-            elif "脳トレ" in normalized or "ゲーム" in normalized:
-                self.show_calc_game()
-                return
-            elif "ポッツ" in normalized or "接続" in normalized:
-                self.show_potz()
-                return
-            else:
-                speech_output.speak("もう一度お願いします。おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？")
 
     def show_chat(self):
         self.clear_frame()
-        self.mode = "chat"
+        self.mode = session_orchestrator.CHAT
         frame = tk.Frame(self.root, bg="#F8F8F8")
         frame.pack(expand=True, fill=tk.BOTH)
         self.current_frame = frame
@@ -462,29 +460,6 @@ class SimpleDisplayUI:
             fg="#333"
         )
         self.chat_response_label.pack(pady=40)
-        threading.Thread(target=self.run_chat, daemon=True).start()
-
-    def run_chat(self):
-        import speech_input
-        import speech_output
-        history = api_chat.ConversationHistory()
-        while True:
-            self.set_chat_status("声を聞いています")
-            user_input = speech_input.listen()
-            if not user_input:
-                continue
-            if "終了" in user_input:
-                speech_output.speak("会話を終了します。")
-                self.create_mode_select()
-                return
-            history.add_message("user", user_input)
-            response = api_chat.generate_response(user_input, history)
-            if response:
-                response = api_chat.postprocess_response(response)
-                self.set_chat_response(response)
-                speech_output.speak(response)
-                history.add_message("assistant", response)
-            time.sleep(0.5)
 
     def set_chat_status(self, text):
         if hasattr(self, 'chat_response_label'):
@@ -496,7 +471,7 @@ class SimpleDisplayUI:
 
     def show_calc_game(self):
         self.clear_frame()
-        self.mode = "calc"
+        self.mode = session_orchestrator.CALC
         frame = tk.Frame(self.root, bg="#F8F8F8")
         frame.pack(expand=True, fill=tk.BOTH)
         self.current_frame = frame
@@ -516,51 +491,6 @@ class SimpleDisplayUI:
             fg="#333"
         )
         self.calc_result_label.pack(pady=40)
-        threading.Thread(target=self.run_calc_game, daemon=True).start()
-
-    def run_calc_game(self):
-        import speech_input
-        import speech_output
-        game = voice_calc_game.VoiceCalculationGame()
-        total_questions = 10
-        score = 0
-        for i in range(1, total_questions + 1):
-            level = 1 if i <= 5 else 2
-            question, answer = game.generate_question(level=level)
-            self.set_calc_question(f"第{i}問目: {question}")
-            self.set_calc_result("")
-            speech_output.speak(question)
-            response = speech_input.listen()
-            if not response:
-                speech_output.speak("もう一度同じ問題を出します。")
-                speech_output.speak(question)
-                response = speech_input.listen()
-                if not response:
-                    self.set_calc_result("スキップ")
-                    continue
-            if "終了" in response:
-                self.set_calc_result("終了します")
-                speech_output.speak("ゲームを終了します。")
-                self.create_mode_select()
-                return
-            try:
-                user_answer = voice_calc_game.japanese_number_to_int(response)
-                if user_answer == answer:
-                    self.set_calc_result("正解！")
-                    speech_output.speak("正解です！")
-                    score += 1
-                else:
-                    self.set_calc_result(f"不正解（正解: {answer}）")
-                    speech_output.speak(f"残念、正解は{answer}でした。")
-            except Exception:
-                self.set_calc_result("無効な回答")
-                speech_output.speak("数字で答えてください。")
-            time.sleep(1)
-        self.set_calc_question("")
-        self.set_calc_result(f"ゲーム終了！{score}問正解でした。")
-        speech_output.speak(f"ゲーム終了です。{score}問正解でした。お疲れ様でした。")
-        time.sleep(2)
-        self.create_mode_select()
 
     def set_calc_question(self, text):
         if hasattr(self, 'calc_question_label'):
@@ -572,6 +502,7 @@ class SimpleDisplayUI:
 
     def show_potz(self):
         self.clear_frame()
+        self.mode = session_orchestrator.POTZ
         frame = tk.Frame(self.root, bg="#F8F8F8")
         frame.pack(expand=True, fill=tk.BOTH)
         self.current_frame = frame
@@ -583,11 +514,10 @@ class SimpleDisplayUI:
             fg="#1976D2"
         )
         label.pack(pady=120)
-        webbrowser.open("https://ftc.potz.jp/dashboard")
-        self.root.after(3000, self.create_mode_select)
 
     def show_exit(self):
         self.clear_frame()
+        self.mode = session_orchestrator.EXIT
         frame = tk.Frame(self.root, bg="#F8F8F8")
         frame.pack(expand=True, fill=tk.BOTH)
         self.current_frame = frame
@@ -599,7 +529,9 @@ class SimpleDisplayUI:
             fg="#B71C1C"
         )
         label.pack(pady=120)
-        self.root.after(2000, self.root.quit)
+        # 終了画面を表示してから、終了の案内を読み上げ終わるのを待って閉じる
+        self.root.update_idletasks()
+        self.root.after(0, self.on_closing)
 
 class PygameUI:
     def __init__(self):
@@ -610,188 +542,150 @@ class PygameUI:
         self.font_item = pygame.font.Font(FONT_PATH, 48)
         self.font_status = pygame.font.Font(FONT_PATH, 44)
         self.font_result = pygame.font.Font(FONT_PATH, 40)
-        self.state = "menu"  # menu, chat, calc, potz, exit
+        self.state = session_orchestrator.MENU
         self.chat_response = ""
         self.calc_question = ""
         self.calc_result = ""
-        self.calc_score = 0
-        self.calc_no = 1
         self.running = True
-        self.listen_thread = None
         self.bg_color = (255, 255, 255)
         self.fg_color = (30, 30, 30)
-        self.start_menu()
-
-    def start_menu(self):
-        self.state = "menu"
-        self.chat_response = ""
-        self.calc_question = ""
-        self.calc_result = ""
-        self.calc_score = 0
-        self.calc_no = 1
-        if self.listen_thread and self.listen_thread.is_alive():
-            self.listen_thread = None
-        self.listen_thread = threading.Thread(target=self.listen_menu, daemon=True)
-        self.listen_thread.start()
-
-    def listen_menu(self):
-        import speech_input
-        import speech_output
-        speech_output.speak("おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？")
-        while self.state == "menu":
-            user_input = speech_input.listen()
-            if not user_input:
-                continue
-            normalized = user_input.replace(" ", "").replace("　", "")
-            if any(word in normalized for word in ["終了", "さようなら", "終わります", "終了します"]):
-                self.state = "exit"
-                return
-            elif "おしゃべり" in normalized:
-                self.state = "chat"
-                self.start_chat()
-                return
-            elif "脳トレ" in normalized or "ゲーム" in normalized:
-                self.state = "calc"
-                self.start_calc()
-                return
-            elif "ポッツ" in normalized or "接続" in normalized:
-                self.state = "potz"
-                self.start_potz()
-                return
-            else:
-                speech_output.speak("もう一度お願いします。おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？")
-
-    def start_chat(self):
-        self.chat_response = ""
-        if self.listen_thread and self.listen_thread.is_alive():
-            self.listen_thread = None
-        self.listen_thread = threading.Thread(target=self.run_chat, daemon=True)
-        self.listen_thread.start()
-
-    def run_chat(self):
+        # 折り返しと描画済みの文字列のキャッシュ（古いものから捨てる）
+        self.wrap_cache = OrderedDict()
+        self.render_cache = OrderedDict()
+        # 前回描画した画面の状態と描画範囲
+        self.last_view = None
+        self.last_rects = []
+        # 描画時間とCPU使用率の計測
+        self.frames = 0
+        self.redraws = 0
+        self.draw_time = 0.0
+        # 音声認識モデルの読み込みは画面の表示・挨拶と並行して行う
         import speech_input
-        import speech_output
-        history = api_chat.ConversationHistory()
-        while self.state == "chat":
+        threading.Thread(target=speech_input.preload_recognizer, daemon=True).start()
+        # モードの切り替えと音声のやり取りは状態機械に任せ、画面は通知された内容を描く
+        self.orchestrator = SessionOrchestrator()
+        self.orchestrator.add_listener(self.on_session_event)
+        self.orchestrator.start_in_thread()
+
+    def on_session_event(self, event, value):
+        """状態機械からの通知を画面の状態に反映する（描画はmainloopが変化を見て行う）"""
+        if event == "state":
+            self.state = value
             self.chat_response = ""
-            user_input = speech_input.listen()
-            if not user_input:
-                continue
-            if "終了" in user_input:
-                speech_output.speak("会話を終了します。")
-                self.start_menu()
-                return
-            history.add_message("user", user_input)
-            response = api_chat.generate_response(user_input, history)
-            if response:
-                response = api_chat.postprocess_response(response)
-                self.chat_response = response
-                speech_output.speak(response)
-                history.add_message("assistant", response)
-            time.sleep(0.5)
-
-    def start_calc(self):
-        self.calc_score = 0
-        self.calc_no = 1
-        self.calc_question = ""
-        self.calc_result = ""
-        if self.listen_thread and self.listen_thread.is_alive():
-            self.listen_thread = None
-        self.listen_thread = threading.Thread(target=self.run_calc, daemon=True)
-        self.listen_thread.start()
-
-    def run_calc(self):
-        import speech_input
-        import speech_output
-        game = voice_calc_game.VoiceCalculationGame()
-        total_questions = 10
-        for i in range(1, total_questions + 1):
-            if self.state != "calc":
-                return
-            level = 1 if i <= 5 else 2
-            question, answer = game.generate_question(level=level)
-            self.calc_question = f"第{i}問目: {question}"
+            self.calc_question = ""
             self.calc_result = ""
-            speech_output.speak(question)
-            response = speech_input.listen()
-            if not response:
-                speech_output.speak("もう一度同じ問題を出します。")
-                speech_output.speak(question)
-                response = speech_input.listen()
-                if not response:
-                    self.calc_result = "スキップ"
-                    continue
-            if "終了" in response:
-                self.calc_result = "終了します"
-                speech_output.speak("ゲームを終了します。")
-                self.start_menu()
-                return
-            try:
-                user_answer = voice_calc_game.japanese_number_to_int(response)
-                if user_answer == answer:
-                    self.calc_result = "正解！"
-                    speech_output.speak("正解です！")
-                    self.calc_score += 1
-                else:
-                    self.calc_result = f"不正解（正解: {answer}）"
-                    speech_output.speak(f"残念、正解は{answer}でした。")
-            except Exception:
-                self.calc_result = "無効な回答"
-                speech_output.speak("数字で答えてください。")
-            time.sleep(1)
-        self.calc_question = ""
-        self.calc_result = f"ゲーム終了！{self.calc_score}問正解でした。"
-        speech_output.speak(f"ゲーム終了です。{self.calc_score}問正解でした。お疲れ様でした。")
-        time.sleep(2)
-        self.start_menu()
-
-    def start_potz(self):
-        self.state = "potz"
-        webbrowser.open("https://ftc.potz.jp/dashboard")
-        threading.Thread(target=self.potz_wait_and_return, daemon=True).start()
-
-    def potz_wait_and_return(self):
-        time.sleep(3)
-        self.start_menu()
+        elif event == "chat_response":
+            self.chat_response = value
+        elif event == "calc_question":
+            self.calc_question = value
+        elif event == "calc_result":
+            self.calc_result = value
+
+    def view_state(self):
+        """画面に表示する内容（変わった時だけ描き直す）"""
+        if self.state == "chat":
+            return (self.state, self.chat_response)
+        if self.state == "calc":
+            return (self.state, self.calc_question, self.calc_result)
+        return (self.state,)
 
     def mainloop(self):
         clock = pygame.time.Clock()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
         while self.running:
+            full_redraw = False
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    # 聞き取りや読み上げを止めて終了する（終わるのはループの後で待つ）
                     self.running = False
-            self.screen.fill(self.bg_color)
-            if self.state == "menu":
-                self.draw_menu()
-            elif self.state == "chat":
-                self.draw_chat()
-            elif self.state == "calc":
-                self.draw_calc()
-            elif self.state == "potz":
-                self.draw_potz()
-            elif self.state == "exit":
-                self.draw_exit()
-                pygame.display.update()
-                time.sleep(2)
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.VIDEORESIZE):
+                    # ウィンドウが隠れた後などは全体を描き直す
+                    full_redraw = True
+            view = self.view_state()
+            if RENDER_BASELINE:
+                self.redraw(view, True)
+            elif full_redraw or view != self.last_view:
+                self.redraw(view, full_redraw or self.last_view is None)
+            if self.state == "exit":
                 self.running = False
                 break
-            pygame.display.update()
-            clock.tick(30)
+            self.frames += 1
+            clock.tick(FPS)
+        self.report_render_stats(time.perf_counter() - wall_start, time.process_time() - cpu_start)
+        # 終了の案内を読み上げ終わるまで、終了画面を表示したまま待つ
+        if not self.orchestrator.stop():
+            print("終了処理が時間内に終わりませんでした")
         pygame.quit()
         sys.exit()
 
+    def redraw(self, view, full=False):
+        """前回描いた範囲を消して今の状態を描き、変わった範囲だけ画面に反映する"""
+        start = time.perf_counter()
+        if full:
+            self.screen.fill(self.bg_color)
+        else:
+            for rect in self.last_rects:
+                self.screen.fill(self.bg_color, rect)
+        rects = []
+        if self.state == "menu":
+            rects = self.draw_menu()
+        elif self.state == "chat":
+            rects = self.draw_chat()
+        elif self.state == "calc":
+            rects = self.draw_calc()
+        elif self.state == "potz":
+            rects = self.draw_potz()
+        elif self.state == "exit":
+            rects = self.draw_exit()
+        if full:
+            pygame.display.update()
+        else:
+            pygame.display.update(self.last_rects + rects)
+        self.last_view = view
+        self.last_rects = rects
+        self.redraws += 1
+        self.draw_time += time.perf_counter() - start
+
+    def report_render_stats(self, wall_time, cpu_time):
+        """描画回数・1回あたりの描画時間・CPU使用率を表示する"""
+        if not self.frames or not wall_time:
+            return
+        average = self.draw_time / self.redraws * 1000 if self.redraws else 0.0
+        mode = "（基準: 毎フレーム描き直し）" if RENDER_BASELINE else ""
+        print(f"描画{mode}: {self.frames}フレーム中{self.redraws}回描き直し、"
+              f"1回あたり{average:.1f}ms、CPU使用率{cpu_time / wall_time * 100:.1f}%")
+
+    def _cache_get(self, cache, key, create):
+        """キャッシュから取り出す（なければ作成し、上限を超えたら古いものを捨てる）"""
+        if RENDER_BASELINE:
+            return create()
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        value = cache[key] = create()
+        if len(cache) > TEXT_CACHE_SIZE:
+            cache.popitem(last=False)
+        return value
+
+    def render_text(self, text, font, color):
+        """文字列を描画した画像を返す（同じ文字列は使い回す）"""
+        return self._cache_get(self.render_cache, (text, font, color), lambda: font.render(text, True, color))
+
+    def blit_text(self, text, font, color, pos):
+        """文字列を描画し、描画した範囲を返す"""
+        return self.screen.blit(self.render_text(text, font, color), pos)
+
     def draw_menu(self):
-        title = self.font_title.render("モードを選んでください", True, self.fg_color)
-        self.screen.blit(title, (120, 80))
+        rects = [self.blit_text("モードを選んでください", self.font_title, self.fg_color, (120, 80))]
         for i, mode in enumerate(MODES):
-            text = self.font_item.render(mode, True, (50, 50, 50))
-            self.screen.blit(text, (200, 200 + i * 100))
+            rects.append(self.blit_text(mode, self.font_item, (50, 50, 50), (200, 200 + i * 100)))
+        return rects
 
     def draw_chat(self):
-        status = self.font_status.render("声を聞いています", True, (25, 90, 180))
-        self.screen.blit(status, (180, 120))
+        rects = [self.blit_text("声を聞いています", self.font_status, (25, 90, 180), (180, 120))]
         if self.chat_response:
-            self.draw_text(
+            rects += self.draw_text(
                 self.screen,
                 self.chat_response,
                 self.font_result,
@@ -799,13 +693,14 @@ class PygameUI:
                 120, 300,
                 max_width=760
             )
+        return rects
 
     def draw_calc(self):
+        rects = []
         if self.calc_question:
-            q = self.font_status.render(self.calc_question, True, (30, 120, 60))
-            self.screen.blit(q, (100, 120))
+            rects.append(self.blit_text(self.calc_question, self.font_status, (30, 120, 60), (100, 120)))
         if self.calc_result:
-            self.draw_text(
+            rects += self.draw_text(
                 self.screen,
                 self.calc_result,
                 self.font_result,
@@ -813,31 +708,42 @@ class PygameUI:
                 120, 300,
                 max_width=760
             )
+        return rects
 
     def draw_potz(self):
-        label = self.font_title.render("ポッツに接続中...", True, (25, 90, 180))
-        self.screen.blit(label, (180, 220))
+        return [self.blit_text("ポッツに接続中...", self.font_title, (25, 90, 180), (180, 220))]
 
     def draw_exit(self):
-        label = self.font_title.render("終了します", True, (180, 30, 30))
-        self.screen.blit(label, (320, 220))
+        return [self.blit_text("終了します", self.font_title, (180, 30, 30), (320, 220))]
+
+    def wrap_text(self, text, font, max_width):
+        """指定幅で折り返した行のリストを返す（文字幅を1回で求め、結果は使い回す）"""
+        def create():
+            metrics = font.metrics(text) or []
+            lines = []
+            line = ""
+            width = 0
+            for i, char in enumerate(text):
+                metric = metrics[i] if i < len(metrics) else None
+                advance = metric[4] if metric else font.size(char)[0]
+                if line and width + advance > max_width:
+                    lines.append(line)
+                    line = ""
+                    width = 0
+                line += char
+                width += advance
+            if line:
+                lines.append(line)
+            return lines
+        return self._cache_get(self.wrap_cache, (text, font, max_width), create)
 
     def draw_text(self, surface, text, font, color, x, y, max_width):
-        """指定幅で自動折り返ししてテキストを描画"""
-        lines = []
-        line = ""
-        for char in text:
-            test_line = line + char
-            if font.size(test_line)[0] > max_width:
-                lines.append(line)
-                line = char
-            else:
-                line = test_line
-        if line:
-            lines.append(line)
-        for i, l in enumerate(lines):
-            rendered = font.render(l, True, color)
-            surface.blit(rendered, (x, y + i * font.get_linesize()))
+        """指定幅で自動折り返ししてテキストを描画し、描画した範囲を返す"""
+        rects = []
+        for i, l in enumerate(self.wrap_text(text, font, max_width)):
+            rendered = self.render_text(l, font, color)
+            rects.append(surface.blit(rendered, (x, y + i * font.get_linesize())))
+        return rects
 
 def main():
     ui = PygameUI()
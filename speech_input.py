@@ -2,40 +2,299 @@
 # -*- coding: utf-8 -*-
 
 import os
+import json
 import queue
+import threading
 import time
 import speech_recognition as sr
+from audio_capture import AudioCapture, ListenTimeout, ListenCancelled, SAMPLE_RATE, FRAME_MS
 
 # 音声認識の状態管理
 is_user_speaking = False
 
+# 認識エンジンの設定
+# auto: 語彙指定があればVosk（オフライン）、なければGoogle / google / vosk
+RECOGNIZER_BACKEND = os.getenv("RECOGNIZER_BACKEND", "auto")
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "model")
+
+# モード選択で使う語彙（Voskの認識文法。複合語は辞書にある単語の列として書く）
+MENU_VOCABULARY = [
+    "おしゃべり", "脳トレ", "ゲーム", "脳トレ ゲーム", "ポッツ", "接続", "ポッツ に 接続",
+    "終了", "終了 し ます", "さようなら", "終わり ます"
+]
+
+# 騒音レベル推定の設定
+CALIBRATION_DURATION = 1.0  # 起動時の騒音測定時間（秒）
+
+# 読み上げ中の割り込み（バージイン）の設定
+BARGE_IN = os.getenv("BARGE_IN", "1") != "0"
+BARGE_IN_HOLD_SEC = 5.0  # 割り込んだ発話の音声を次の聞き取りまで保持する時間（秒）
+
 def get_is_user_speaking():
     """ユーザーが話しているかどうかを返す"""
     return is_user_speaking
 
-def listen(vocabulary: list[str] | None = None):
-    """音声を認識して返す。vocabularyは無視（SpeechRecognitionでは限定語彙未対応）"""
-    global is_user_speaking
-    is_user_speaking = True
-    r = sr.Recognizer()
-    with sr.Microphone() as source:
-        print("音声認識待機中...")
-        r.adjust_for_ambient_noise(source)
+class MicrophoneSession:
+    """マイクを開いたまま保持し、発話ごとに音声を返すクラス"""
+
+    def __init__(self, calibration_duration=CALIBRATION_DURATION):
+        self.capture = AudioCapture()
+        self.calibration_duration = calibration_duration
+        self.lock = threading.Lock()  # 聞き取りと割り込みの検出でマイクを取り合わないようにする
+        # 読み上げに割り込んだ発話の開始までのフレームと、その時刻
+        self.pending = None
+        self.pending_time = 0.0
+
+    @property
+    def noise_floor(self):
+        """現在の騒音レベル推定値"""
+        return self.capture.vad.noise_floor
+
+    def open(self):
+        """マイクを開き、最初の一回だけ騒音レベルを測定する"""
+        self.capture.start(calibration_sec=self.calibration_duration)
+
+    def close(self):
+        """マイクを閉じる"""
+        self.capture.stop()
+
+    def has_pending(self):
+        """読み上げに割り込んだ発話が、まだ聞き取られずに残っているかどうか"""
+        return self.pending is not None and time.monotonic() - self.pending_time < BARGE_IN_HOLD_SEC
+
+    def utterance_frames(self, timeout=10, cancel_event=None):
+        """発話中のフレームを逐次返す（発話がなければListenTimeout、中止されればListenCancelled）"""
+        with self.lock:
+            self.open()
+            started = self.pending if self.has_pending() else None
+            self.pending = None
+            if not started:
+                # 前のターンの読み上げ中に溜まった音声は捨てる
+                self.capture.flush()
+            # 読み上げに割り込んだ発話は、捉えた音声の続きから聞き取る
+            yield from self.capture.utterance_frames(timeout=timeout, cancel_event=cancel_event, started=started)
+
+    def detect_barge_in(self, is_playing, echo_level, stop_event=None):
+        """読み上げ中にユーザーが話し始めたらTrueを返す（聞き取り中なら何もしない）"""
+        if not self.lock.acquire(blocking=False):
+            return False
         try:
-            audio = r.listen(source, timeout=10, phrase_time_limit=5)
-            print("認識中...")
-            text = r.recognize_google(audio, language='ja-JP')
-            print(f"認識結果: {text}")
-            is_user_speaking = False
-            return text
-        except sr.WaitTimeoutError:
-            print("音声が検出されませんでした。")
-        except sr.UnknownValueError:
-            print("認識できた発話がありません。")
-        except sr.RequestError as e:
-            print(f"音声認識サービスに接続できません: {e}")
-        except Exception as e:
-            print(f"音声認識中にエラーが発生しました: {e}")
+            self.open()
+            frames = self.capture.barge_in_frames(is_playing, echo_level, stop_event)
+            if not frames:
+                return False
+            self.pending = frames
+            self.pending_time = time.monotonic()
+            return True
+        finally:
+            self.lock.release()
+
+class BargeInMonitor:
+    """読み上げ中もマイクを聞き、ユーザーが話し始めたら読み上げを止めるクラス
+
+    is_playing()が真の間だけマイクのフレームを読み、echo_level()で見積もった
+    スピーカーからの回り込みより大きな音が続いたらon_barge_in()を呼ぶ。
+    捉えた音声は次のlisten()がそのまま続きから聞き取る。
+    """
+
+    def __init__(self, session, is_playing, echo_level, on_barge_in):
+        self.session = session
+        self.is_playing = is_playing
+        self.echo_level = echo_level
+        self.on_barge_in = on_barge_in
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="barge-in", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        global is_user_speaking
+        while not self.stop_event.is_set():
+            # 割り込んだ発話がまだ聞き取られていない間は、次の割り込みを探さない
+            if not self.is_playing() or self.session.has_pending():
+                time.sleep(FRAME_MS / 1000)
+                continue
+            try:
+                detected = self.session.detect_barge_in(self.is_playing, self.echo_level, self.stop_event)
+            except Exception as e:
+                print(f"割り込みの検出中にエラーが発生しました: {e}")
+                self.stop_event.wait(1.0)
+                continue
+            if detected:
+                is_user_speaking = True
+                print("読み上げ中に発話を検出しました。読み上げを中止します。")
+                self.on_barge_in()
+            else:
+                time.sleep(FRAME_MS / 1000)
+
+class GoogleRecognizer:
+    """Google Web Speech APIによる認識（発話終了後にまとめて送信）"""
+
+    def __init__(self, language='ja-JP'):
+        self.language = language
+        self.recognizer = sr.Recognizer()
+        self.chunks = []
+
+    def start(self):
+        self.chunks = []
+
+    def accept(self, frame):
+        """発話中のフレームを受け取る"""
+        self.chunks.append(frame.tobytes())
+
+    def finish(self):
+        """発話終了時に認識結果を返す"""
+        audio = sr.AudioData(b"".join(self.chunks), SAMPLE_RATE, 2)
+        self.chunks = []
+        return self.recognizer.recognize_google(audio, language=self.language)
+
+class VoskRecognizer:
+    """Voskによるオフライン認識（語彙指定時は文法として制約する）"""
+
+    def __init__(self, model, vocabulary=None):
+        import vosk
+        if vocabulary:
+            # 語彙外の発話は[unk]として扱う
+            grammar = json.dumps(list(vocabulary) + ["[unk]"], ensure_ascii=False)
+            self.recognizer = vosk.KaldiRecognizer(model, SAMPLE_RATE, grammar)
+        else:
+            self.recognizer = vosk.KaldiRecognizer(model, SAMPLE_RATE)
+
+    def start(self):
+        self.recognizer.Reset()
+
+    def accept(self, frame):
+        """発話中のフレームをその場でデコードする"""
+        self.recognizer.AcceptWaveform(frame.tobytes())
+
+    def finish(self):
+        """発話終了時に認識結果を返す"""
+        result = json.loads(self.recognizer.FinalResult())
+        # 日本語モデルは単語間に空白が入るため除去する
+        text = result.get("text", "").replace("[unk]", "").replace(" ", "")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+# 共有Voskモデルと語彙ごとの認識器
+_vosk_model = None
+_vosk_recognizers = {}
+_vosk_lock = threading.Lock()
+
+def load_vosk_model(path=VOSK_MODEL_PATH):
+    """Voskモデルを一度だけ読み込んで共有する（利用できなければNone）
+
+    voskは最初にモデルが必要になった時に読み込む。
+    """
+    global _vosk_model
+    with _vosk_lock:
+        if _vosk_model is None and os.path.isdir(path):
+            try:
+                import vosk
+            except ImportError:
+                return None
+            try:
+                vosk.SetLogLevel(-1)
+                _vosk_model = vosk.Model(path)
+                print(f"Voskモデルを読み込みました: {path}")
+            except Exception as e:
+                print(f"Voskモデルの読み込みに失敗しました: {e}")
+        return _vosk_model
+
+def preload_recognizer():
+    """起動時に認識エンジンを準備しておく"""
+    if RECOGNIZER_BACKEND in ("auto", "vosk"):
+        load_vosk_model()
+
+def create_recognizer(vocabulary=None):
+    """設定と語彙に応じて認識器を選ぶ"""
+    if RECOGNIZER_BACKEND == "vosk" or (RECOGNIZER_BACKEND == "auto" and vocabulary):
+        model = load_vosk_model()
+        if model is not None:
+            key = tuple(vocabulary) if vocabulary else None
+            with _vosk_lock:
+                if key not in _vosk_recognizers:
+                    _vosk_recognizers[key] = VoskRecognizer(model, vocabulary)
+                return _vosk_recognizers[key]
+    return GoogleRecognizer()
+
+# 共有マイクセッション
+_session = None
+_session_lock = threading.Lock()
+
+def get_microphone_session():
+    """共有のマイクセッションを返す（初回のみ作成）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = MicrophoneSession()
+        return _session
+
+_monitor = None
+
+def start_barge_in_monitor(is_playing, echo_level, on_barge_in):
+    """読み上げ中の割り込みの監視を始める（BARGE_INが無効なら何もしない）
+
+    最初の読み上げより前に呼ぶ。マイクを開いて騒音レベルを測ってから監視を始めるため、
+    騒音レベルに読み上げの音が混ざらず、最初の読み上げから割り込みを検出できる。
+    """
+    global _monitor
+    if not BARGE_IN:
+        return None
+    session = get_microphone_session()
+    try:
+        with session.lock:
+            session.open()
+    except Exception as e:
+        print(f"マイクを開けませんでした: {e}")
+    with _session_lock:
+        if _monitor is None:
+            _monitor = BargeInMonitor(session, is_playing, echo_level, on_barge_in)
+            _monitor.start()
+        return _monitor
+
+def has_pending_speech():
+    """読み上げに割り込んだ発話が、まだ聞き取られずに残っているかどうか"""
+    return _session is not None and _session.has_pending()
+
+def listen(vocabulary: list[str] | None = None, cancel_event: threading.Event | None = None):
+    """音声を認識して返す。vocabularyを指定するとVoskの認識文法として使う
+
+    cancel_eventがセットされると、聞き取りをすぐにやめてNoneを返す。
+    """
+    global is_user_speaking
+    session = get_microphone_session()
+    recognizer = create_recognizer(vocabulary)
+    print("音声認識待機中...")
+    try:
+        recognizer.start()
+        # 発話中から認識器にフレームを渡していく
+        for frame in session.utterance_frames(timeout=10, cancel_event=cancel_event):
+            is_user_speaking = True
+            recognizer.accept(frame)
+        is_user_speaking = False
+        print("認識中...")
+        text = recognizer.finish()
+        print(f"認識結果: {text}")
+        return text
+    except ListenTimeout:
+        print("音声が検出されませんでした。")
+    except ListenCancelled:
+        print("音声認識を中止しました。")
+    except sr.UnknownValueError:
+        print("認識できた発話がありません。")
+    except sr.RequestError as e:
+        print(f"音声認識サービスに接続できません: {e}")
+    except Exception as e:
+        print(f"音声認識中にエラーが発生しました: {e}")
+        # デバイスエラーの可能性があるため次回は開き直す
+        session.close()
     is_user_speaking = False
     return None
 
@@ -45,4 +304,4 @@ if __name__ == "__main__":
     if result:
         print(f"認識結果: {result}")
     else:
-        print("音声を認識できませんでした。")
\ No newline at end of file
+        print("音声を認識できませんでした。")
@@ -2,32 +2,445 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import sys
+import queue
+import itertools
 import subprocess
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError
+import numpy as np
+import sounddevice as sd
+import soundfile as sf
 
-def speak(text):
-    """テキストを音声で読み上げる"""
+try:
+    from pyopenjtalk.openjtalk import OpenJTalk
+    from pyopenjtalk.htsengine import HTSEngine
+except ImportError:
+    OpenJTalk = None
+    HTSEngine = None
+
+# Open JTalkの設定
+DIC_PATH = "/var/lib/mecab/dic/open-jtalk/naist-jdic"
+VOICE_PATH = "/usr/share/hts-voice/nitech-jp-atr503-m001/nitech_jp_atr503_m001.htsvoice"
+SPEECH_RATE = 1.5
+
+# macOSのsayコマンドの設定
+SAY_VOICE = "Kyoko"
+SAY_RATE = 140  # 1分あたりの語数（高齢の方にも聞き取りやすい速さ）
+# sayが読み違える表記の読み替え（問いかけの「〜は？」を「ハ」と読むため）
+SAY_READINGS = [
+    (re.compile(r'は([？?])'), r'わ\1'),
+]
+
+# 合成音声のキャッシュ（0で無効）
+USE_TTS_CACHE = os.getenv("TTS_CACHE", "1") != "0"
+
+# 文の区切り
+SENTENCE_PATTERN = re.compile(r'[^。！？!?]+[。！？!?]*')
+
+# 再生中に中止を確認する間隔（ミリ秒）
+PLAYBACK_CHUNK_MS = 50
+
+# 読み上げの優先度（小さいほど先に読み上げる）
+PRIORITY_URGENT = 0  # 終了の案内など、待たせずに読み上げるもの
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20  # 相槌など
+
+# 出力を止めた後もマイクに回り込みが残る時間（ミリ秒）
+ECHO_TAIL_MS = 300
+
+class OpenJTalkEngine:
+    """辞書と音声モデルを常駐させたOpen JTalk合成エンジン
+
+    pyopenjtalkがあればプロセス内で合成し、なければopen_jtalkコマンドを使う。
+    どちらの場合も音声はメモリ上のバッファとして返す。
+    """
+
+    def __init__(self, dic_path=DIC_PATH, voice_path=VOICE_PATH, rate=SPEECH_RATE):
+        self.dic_path = dic_path
+        self.voice_path = voice_path
+        self.voice = os.path.splitext(os.path.basename(voice_path))[0]
+        self.rate = rate
+        self.frontend = None
+        self.engine = None
+        self.lock = threading.Lock()
+        if OpenJTalk is not None:
+            try:
+                self.frontend = OpenJTalk(dn_mecab=dic_path.encode("utf-8"))
+                self.engine = HTSEngine(voice_path.encode("utf-8"))
+                self.engine.set_speed(rate)
+                print("Open JTalkの辞書と音声モデルを読み込みました")
+            except Exception as e:
+                print(f"pyopenjtalkの初期化に失敗したためコマンドを使用します: {e}")
+                self.frontend = None
+                self.engine = None
+        else:
+            print("pyopenjtalkがないため、文ごとにopen_jtalkコマンドを起動して合成します（pip3 install pyopenjtalk で常駐させられます）")
+
+    def synthesize(self, text):
+        """テキストを合成して (int16の音声データ, サンプリングレート) を返す"""
+        with self.lock:
+            if self.engine is not None:
+                labels = self.frontend.make_label(self.frontend.run_frontend(text))
+                wav = self.engine.synthesize(labels)
+                samples = np.clip(wav, -32768, 32767).astype(np.int16)
+                return samples, self.engine.get_sampling_frequency()
+            return self._synthesize_command(text)
+
+    def _synthesize_command(self, text):
+        """open_jtalkコマンドで合成する（一時ファイルは呼び出しごとに作成）"""
+        with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+            cmd = [
+                "open_jtalk",
+                "-x", self.dic_path,
+                "-m", self.voice_path,
+                "-r", str(self.rate),
+                "-ow", f.name
+            ]
+            subprocess.run(cmd, input=text.encode("utf-8"), check=True)
+            samples, samplerate = sf.read(f.name, dtype="int16")
+        return samples, samplerate
+
+class SayEngine:
+    """macOSのsayコマンドで合成し、音声をメモリ上のバッファとして返すエンジン"""
+
+    def __init__(self, voice=SAY_VOICE, rate=SAY_RATE):
+        self.voice = voice
+        self.rate = rate
+
+    def synthesize(self, text):
+        """テキストを合成して (int16の音声データ, サンプリングレート) を返す"""
+        for pattern, reading in SAY_READINGS:
+            text = pattern.sub(reading, text)
+        with tempfile.NamedTemporaryFile(suffix=".aiff") as f:
+            cmd = ["say", "-v", self.voice, "-o", f.name, "--data-format=BEI16@22050"]
+            if self.rate:
+                cmd += ["-r", str(self.rate)]
+            subprocess.run(cmd + [text], check=True)
+            samples, samplerate = sf.read(f.name, dtype="int16")
+        return samples, samplerate
+
+class AudioPlayer:
+    """出力ストリームを開いたまま保持して音声バッファを再生するクラス"""
+
+    def __init__(self, device=None):
+        self.device = device
+        self.stream = None
+        self.samplerate = None
+        self.lock = threading.Lock()
+        # 直近に書き込んだ区切りごとの出力レベル（バージイン検出の閾値に使う）
+        self.levels = deque(maxlen=max(1, ECHO_TAIL_MS // PLAYBACK_CHUNK_MS))
+
+    def echo_level(self):
+        """直近の出力レベル（RMS）の最大値"""
+        return max(self.levels, default=0.0)
+
+    def _open(self, samplerate):
+        if self.stream is not None and self.samplerate == samplerate:
+            return
+        self.close()
+        self.stream = sd.OutputStream(samplerate=samplerate, channels=1, dtype="int16", device=self.device)
+        self.stream.start()
+        self.samplerate = samplerate
+
+    def play(self, samples, samplerate, stop_event=None):
+        """音声バッファを再生する（再生し終わるか、stop_eventがセットされるまで戻らない）
+
+        短い区切りごとに書き込み、stop_eventがセットされたら残りを捨てる。
+        最後まで再生できればTrueを返す。
+        """
+        samples = np.ascontiguousarray(samples, dtype=np.int16).reshape(-1, 1)
+        step = max(1, samplerate * PLAYBACK_CHUNK_MS // 1000)
+        with self.lock:
+            self._open(samplerate)
+            for start in range(0, len(samples), step):
+                if stop_event is not None and stop_event.is_set():
+                    # 出力バッファに残った音声もすぐに止める
+                    self.stream.abort()
+                    self.stream.start()
+                    return False
+                chunk = samples[start:start + step]
+                self.levels.append(float(np.sqrt(np.mean(chunk.astype(np.float32) ** 2))))
+                self.stream.write(chunk)
+        return True
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+        self.stream = None
+        self.samplerate = None
+
+def split_sentences(text):
+    """テキストを。！？で文に区切る"""
+    return [s.strip() for s in SENTENCE_PATTERN.findall(text) if s.strip()]
+
+class SpeechPipeline:
+    """次の文を合成しながら前の文を再生する読み上げパイプライン"""
+
+    def __init__(self, engine, player, prefetch=2):
+        self.engine = engine
+        self.player = player
+        self.prefetch = prefetch
+        # 合成は常駐する1スレッドで順番に行う
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+        # 今の読み上げの中止フラグ（読み上げごとに作り直す）
+        self.cancel_event = threading.Event()
+        # 読み上げ中はセットされる（文と文の間も含む）
+        self.speaking = threading.Event()
+
+    @staticmethod
+    def _put(results, item, cancel_event):
+        """合成結果をキューに入れる（中止されたら入れずにFalse）"""
+        while not cancel_event.is_set():
+            try:
+                results.put(item, timeout=0.05)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _get(results, cancel_event):
+        """合成結果を取り出す（中止されたらNone）"""
+        while not cancel_event.is_set():
+            try:
+                return results.get(timeout=0.05)
+            except queue.Empty:
+                continue
+        return None
+
+    def _synthesize_all(self, chunks, results, cancel_event):
+        try:
+            for chunk in chunks:
+                if not self._put(results, self.engine.synthesize(chunk), cancel_event):
+                    return
+        except Exception as e:
+            print(f"音声合成エラー: {e}")
+        self._put(results, None, cancel_event)
+
+    def speak_chunks(self, chunks, cancel_event=None):
+        """文の列を順に読み上げる（chunksは逐次生成されるイテレータでもよい）
+
+        cancel()が呼ばれるか、cancel_eventがセットされると再生中の文も含めて
+        すぐにやめ、Falseを返す。chunksは合成スレッドで読み出すため、逐次生成する
+        イテレータは同じcancel_eventを見て、セットされたらすぐに終わるようにする。
+        戻る時にはchunksの読み出しも終わっている。
+        """
+        cancel_event = self.cancel_event = cancel_event or threading.Event()
+        results = queue.Queue(maxsize=self.prefetch)
+        synthesis = self.executor.submit(self._synthesize_all, chunks, results, cancel_event)
+        self.speaking.set()
+        finished = False
+        try:
+            item = self._get(results, cancel_event)
+            while item is not None:
+                if not self.player.play(*item, stop_event=cancel_event):
+                    return False
+                item = self._get(results, cancel_event)
+            finished = True
+            return not cancel_event.is_set()
+        finally:
+            # 再生に失敗した時は合成スレッドも止め、chunksの読み出しが終わるのを待つ
+            if not finished:
+                cancel_event.set()
+            self.speaking.clear()
+            self.player.levels.clear()
+            synthesis.result()
+
+    def speak(self, text):
+        """テキストを文ごとに区切って読み上げる"""
+        return self.speak_chunks(split_sentences(text))
+
+    def cancel(self):
+        """今の読み上げを中止する"""
+        self.cancel_event.set()
+
+class Utterance:
+    """読み上げの依頼1件（futureは読み上げ終わるとTrue、中止されるとFalseになる）"""
+
+    __slots__ = ("chunks", "priority", "future", "cancel_event")
+
+    def __init__(self, chunks, priority, cancel_event=None):
+        self.chunks = chunks
+        self.priority = priority
+        self.future = Future()
+        self.cancel_event = cancel_event or threading.Event()
+
+class SpeechService:
+    """読み上げの依頼を優先度付きのキューで受け付け、1つのスレッドで順に読み上げるサービス
+
+    submit()はすぐに戻り、読み上げ終わるとTrue（中止されるとFalse）になるFutureを返す。
+    合成エンジン（Open JTalk / say）と再生は SpeechPipeline の中に隠れており、
+    呼び出し側がコマンドを起動したり、終了を待つスレッドを作ったりする必要はない。
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.queue = queue.PriorityQueue()
+        self.order = itertools.count()  # 同じ優先度は依頼順
+        self.futures = {}  # Future -> 読み上げ待ち・読み上げ中のUtterance
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="speech", daemon=True)
+        self.thread.start()
+
+    def submit(self, chunks, priority=PRIORITY_NORMAL, cancel_event=None):
+        """文の列の読み上げを依頼し、Futureを返す
+
+        chunksは逐次生成されるイテレータでもよい。その場合はcancel_eventを渡し、
+        イテレータもそれを見て、取り消されたらすぐに終わるようにする。
+        """
+        utterance = Utterance(chunks, priority, cancel_event)
+        with self.lock:
+            self.futures[utterance.future] = utterance
+        self.queue.put((priority, next(self.order), utterance))
+        return utterance.future
+
+    def say(self, text, priority=PRIORITY_NORMAL):
+        """テキストを文ごとに区切って読み上げるよう依頼し、Futureを返す"""
+        return self.submit(split_sentences(text), priority)
+
+    def cancel(self, future):
+        """依頼を取り消す（読み上げ中ならすぐに止める）"""
+        with self.lock:
+            utterance = self.futures.get(future)
+        if utterance is not None:
+            utterance.cancel_event.set()
+            future.cancel()
+
+    def cancel_all(self):
+        """読み上げ中のものも、待っているものもすべて取り消す"""
+        with self.lock:
+            futures = list(self.futures)
+        for future in futures:
+            self.cancel(future)
+
+    def _run(self):
+        while True:
+            _, _, utterance = self.queue.get()
+            future = utterance.future
+            try:
+                # 読み上げ前に取り消されたものは飛ばす
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self.pipeline.speak_chunks(utterance.chunks, utterance.cancel_event))
+                except Exception as e:
+                    future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.futures.pop(future, None)
+
+# 共有の合成エンジンと再生ストリーム
+_engine = None
+_player = None
+_pipeline = None
+_service = None
+_init_lock = threading.Lock()
+
+def get_engine():
+    """共有の合成エンジンを返す（初回のみ作成）"""
+    global _engine
+    with _init_lock:
+        if _engine is None:
+            if sys.platform == 'darwin':  # Macの場合
+                _engine = SayEngine()
+            else:  # Raspberry Piの場合
+                _engine = OpenJTalkEngine()
+            if USE_TTS_CACHE:
+                from tts_cache import TTSCache, CachedEngine
+                _engine = CachedEngine(_engine, TTSCache())
+        return _engine
+
+def get_player():
+    """共有の再生ストリームを返す（初回のみ作成）"""
+    global _player
+    with _init_lock:
+        if _player is None:
+            _player = AudioPlayer()
+        return _player
+
+def get_pipeline():
+    """共有の読み上げパイプラインを返す（初回のみ作成）"""
+    global _pipeline
+    engine = get_engine()
+    player = get_player()
+    with _init_lock:
+        if _pipeline is None:
+            _pipeline = SpeechPipeline(engine, player)
+        return _pipeline
+
+def get_service():
+    """共有の読み上げサービスを返す（初回のみ作成）"""
+    global _service
+    pipeline = get_pipeline()
+    with _init_lock:
+        if _service is None:
+            _service = SpeechService(pipeline)
+        return _service
+
+def interrupt():
+    """今の読み上げと、読み上げ待ちの依頼をすべて中止する"""
+    if _service is not None:
+        _service.cancel_all()
+    elif _pipeline is not None:
+        _pipeline.cancel()
+
+def is_speaking():
+    """読み上げ中かどうか"""
+    return _pipeline is not None and _pipeline.speaking.is_set()
+
+def echo_level():
+    """読み上げ中のスピーカーの出力レベル（読み上げ中でなければ0）"""
+    if not is_speaking():
+        return 0.0
+    return _pipeline.player.echo_level()
+
+def wait(future):
+    """読み上げ終わるまで待つ（最後まで読み上げればTrue、中止・失敗すればFalse）"""
+    try:
+        return future.result()
+    except CancelledError:
+        return False
+    except Exception as e:
+        print(f"音声出力エラー: {e}")
+        return False
+
+def speak_async(text, priority=PRIORITY_NORMAL):
+    """画面表示なしでテキストの読み上げを依頼し、すぐにFutureを返す"""
+    return get_service().say(text, priority)
+
+def play_text(text, priority=PRIORITY_NORMAL):
+    """画面表示なしでテキストを読み上げる（最後まで読み上げればTrue、中止されればFalse）"""
+    try:
+        future = speak_async(text, priority)
+    except Exception as e:
+        print(f"音声出力エラー: {e}")
+        return False
+    return wait(future)
+
+def speak(text, priority=PRIORITY_NORMAL):
+    """テキストを音声で読み上げる（最後まで読み上げればTrue、中止されればFalse）"""
     print(f"コンピュータ: {text}")
-    
-    # OSの判定
-    if sys.platform == 'darwin':  # Macの場合
-        subprocess.run(['say', '-v', 'Kyoko', text])
-    else:  # Raspberry Piの場合
-        wav_path = "/tmp/openjtalk.wav"
-        dic_path = "/var/lib/mecab/dic/open-jtalk/naist-jdic"
-        voice_path = "/usr/share/hts-voice/nitech-jp-atr503-m001/nitech_jp_atr503_m001.htsvoice"
-        
-        # Open JTalkのコマンドを構築
-        cmd = [
-            "open_jtalk",
-            "-x", dic_path,
-            "-m", voice_path,
-            "-r", "1.5",
-            "-ow", wav_path
-        ]
-        
-        # テキストを音声に変換
-        subprocess.run(f'echo "{text}" | ' + ' '.join(cmd), shell=True)
-        
-        # 音声を再生
-        subprocess.run(["aplay", wav_path])
+    return play_text(text, priority)
+
+def speak_stream(chunks, priority=PRIORITY_NORMAL, cancel_event=None):
+    """逐次生成される文を、そろった順に読み上げる（最後まで読み上げればTrue、中止されればFalse）
+
+    cancel_eventは読み上げの中止フラグで、interrupt()でもセットされる。chunksが次の文を
+    待っている間にセットされたら、chunksもすぐに終わるようにする。
+    """
+    def echo(chunks):
+        for chunk in chunks:
+            print(f"コンピュータ: {chunk}")
+            yield chunk
+
+    try:
+        future = get_service().submit(echo(chunks), priority, cancel_event)
+    except Exception as e:
+        print(f"音声出力エラー: {e}")
+        return False
+    return wait(future)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import unittest
+from unittest import mock
+
+try:
+    import api_chat
+except ImportError:  # 音声・LLMのパッケージが入っていない環境
+    api_chat = None
+
+@unittest.skipIf(api_chat is None, "api_chatの依存パッケージがありません")
+class RespondBargeInTest(unittest.TestCase):
+    """相槌や応答の読み上げに割り込まれた時の動作を確認する"""
+
+    def setUp(self):
+        self.cancel_event = threading.Event()
+        self.streamed = []
+        patches = [
+            mock.patch.object(api_chat, "plan_response", return_value=(None, api_chat.CHAT_PROMPT)),
+            mock.patch.object(api_chat, "llm_sentences", side_effect=self.slow_sentences),
+            mock.patch.object(api_chat, "speak_stream", side_effect=self.speak_stream),
+            mock.patch.object(api_chat, "SPECULATIVE_AIZUCHI", True),
+            mock.patch.object(api_chat, "AIZUCHI_DEADLINE", 0.05),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def slow_sentences(self, template, user_input, cancel_event=None):
+        # 相槌が読み上げられるよう、最初の文は締め切りより遅れて届く
+        time.sleep(0.2)
+        yield "お返事です。"
+
+    def speak_stream(self, chunks, cancel_event=None):
+        self.streamed.extend(chunks)
+        return True
+
+    def test_interrupted_aizuchi_skips_reply(self):
+        with mock.patch.object(api_chat, "speak", return_value=False), \
+                mock.patch.object(api_chat, "has_pending_speech", return_value=True):
+            response = api_chat.respond("昨日は散歩に行きました", None, cancel_event=self.cancel_event)
+        self.assertIsNone(response)
+        self.assertTrue(self.cancel_event.is_set())
+        self.assertEqual(self.streamed, [])
+
+    def test_pending_speech_skips_reply(self):
+        with mock.patch.object(api_chat, "speak", return_value=True), \
+                mock.patch.object(api_chat, "has_pending_speech", return_value=True):
+            response = api_chat.respond("昨日は散歩に行きました", None, cancel_event=self.cancel_event)
+        self.assertIsNone(response)
+        self.assertTrue(self.cancel_event.is_set())
+        self.assertEqual(self.streamed, [])
+
+    def test_reply_is_spoken_without_barge_in(self):
+        with mock.patch.object(api_chat, "speak", return_value=True), \
+                mock.patch.object(api_chat, "has_pending_speech", return_value=False):
+            response = api_chat.respond("昨日は散歩に行きました", None, cancel_event=self.cancel_event)
+        self.assertEqual(response, "お返事です。")
+        self.assertEqual(self.streamed, ["お返事です。"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+from record_journal import RecordJournal, SENDING
+from sheets_sink import SheetsSink, LocalSheetsClient
+
+HEADER = ["実施日時", "所要時間", "スコア", "詳細"]
+
+class FailingSink:
+    """常に送信に失敗する書き込み先"""
+
+    def read_rows(self, sheet_name):
+        raise ConnectionError("offline")
+
+    def write_rows(self, sheet_name, rows, header=None):
+        raise ConnectionError("offline")
+
+class RecordJournalTest(unittest.TestCase):
+    """ローカルの代替クライアントを使って、記録が一度だけ送信されることを確認する"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sink = SheetsSink("test", client_factory=lambda: LocalSheetsClient(self.directory))
+        self.path = os.path.join(self.directory, "records.db")
+        self.journal = self.open_journal()
+
+    def open_journal(self, sink=None):
+        sink = sink or self.sink
+        return RecordJournal(self.path, sink_factory=lambda key, name: sink, upload_interval=0)
+
+    def sheet_rows(self):
+        return self.sink.read_rows("Sheet2")
+
+    def test_uploaded_record_is_not_sent_again(self):
+        row = ["2025-01-01", "1分0秒", "3/10", "詳細"]
+        self.journal.record("Sheet2", row, header=HEADER)
+        self.assertEqual(self.journal.upload_due(), 1)
+        # 送信済みの記録と同じ内容をもう一度記録しても送信しない
+        self.journal.record("Sheet2", row, header=HEADER)
+        self.assertEqual(self.journal.pending_count(), 0)
+        self.assertEqual(self.journal.upload_due(), 0)
+        self.assertEqual(self.sheet_rows(), [HEADER, row])
+
+    def test_failed_upload_is_kept(self):
+        journal = self.open_journal(FailingSink())
+        journal.record("Sheet2", ["2025-01-01", "1分0秒", "3/10", "詳細"])
+        self.assertEqual(journal.upload_due(), 0)
+        self.assertEqual(journal.pending_count(), 1)
+
+    def test_crash_after_append_is_not_uploaded_twice(self):
+        sent = ["2025-01-01", "1分0秒", "3/10", "詳細"]
+        unsent = ["2025-01-02", "2分0秒", "5/10", "詳細"]
+        self.journal.record("Sheet2", sent, header=HEADER)
+        self.journal.record("Sheet2", unsent, header=HEADER)
+        # append_rowsの後、送信済みと記録する前に終了した状態を作る
+        self.sink.write_rows("Sheet2", [sent], header=HEADER)
+        self.journal.db.execute("UPDATE records SET state = ?", (SENDING,))
+        self.journal.db.commit()
+
+        journal = self.open_journal()
+        self.assertEqual(journal.upload_due(), 2)
+        self.assertEqual(journal.pending_count(), 0)
+        self.assertEqual(self.sheet_rows(), [HEADER, sent, unsent])
+
+    def test_transcript_is_kept_until_summarized(self):
+        transcript_id = self.journal.record_transcript("user: こんにちは", 0.0, 60.0)
+        # 要約に失敗した会話は残り、再試行まで後回しになる
+        self.journal.postpone_transcript(transcript_id)
+        self.assertEqual(self.journal.transcript_count(), 1)
+        self.assertEqual(self.journal.due_transcripts(), [])
+
+        row = ["2025-01-01 00:01:00", "1分0秒", "あいさつをした", "嬉しい"]
+        self.journal.complete_transcript(transcript_id, "sheet1", row, header=HEADER)
+        self.assertEqual(self.journal.transcript_count(), 0)
+        self.assertEqual(self.journal.pending_count(), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import tempfile
+import threading
+import unittest
+from sheets_sink import SheetsSink, LocalSheetsClient
+
+HEADER = ["実施日時", "所要時間", "スコア", "詳細"]
+
+class SheetsSinkTest(unittest.TestCase):
+    """ローカルの代替クライアントが受け取る内容を確認する"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sink = SheetsSink("test", client_factory=lambda: LocalSheetsClient(self.directory))
+
+    def rows(self, start, count):
+        return [[f"2025-01-{i + 1:02d}", "1分0秒", f"{i}/10", f"=要約{i}"] for i in range(start, start + count)]
+
+    def test_batch_is_one_append_in_order(self):
+        rows = self.rows(0, 5)
+        self.sink.write_rows("Sheet2", rows, header=HEADER)
+        ws = self.sink.get_worksheet("Sheet2")
+        # ヘッダーと、まとめた行の2回だけ送信する
+        self.assertEqual(ws.calls, [([HEADER], "RAW"), (rows, "RAW")])
+        self.assertEqual(ws.get_all_values(), [HEADER] + rows)
+
+    def test_header_is_written_once(self):
+        self.sink.write_rows("Sheet2", self.rows(0, 2), header=HEADER)
+        self.sink.write_rows("Sheet2", self.rows(2, 3), header=HEADER)
+        ws = self.sink.get_worksheet("sheet2")
+        self.assertEqual(self.sink.spreadsheet.added, ["Sheet2"])
+        self.assertEqual(ws.get_all_values(), [HEADER] + self.rows(0, 5))
+
+    def test_values_are_raw(self):
+        self.sink.write_rows("Sheet2", self.rows(0, 3), header=HEADER)
+        ws = self.sink.get_worksheet("Sheet2")
+        # 「3/10」や「=」で始まる値が日付や数式として解釈されないようにする
+        self.assertEqual({option for _, option in ws.calls}, {"RAW"})
+
+    def test_existing_sheet_is_reused(self):
+        self.sink.write_rows("Sheet2", self.rows(0, 1), header=HEADER)
+        sink = SheetsSink("test", client_factory=lambda: LocalSheetsClient(self.directory))
+        sink.write_rows("Sheet2", self.rows(1, 1), header=HEADER)
+        self.assertEqual(sink.spreadsheet.added, [])
+        self.assertEqual(sink.get_worksheet("Sheet2").get_all_values(), [HEADER] + self.rows(0, 2))
+
+    def test_concurrent_writes_create_sheet_once(self):
+        threads = [
+            threading.Thread(target=self.sink.write_rows, args=("Sheet3", self.rows(i, 1), HEADER))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        values = self.sink.get_worksheet("Sheet3").get_all_values()
+        self.assertEqual(self.sink.spreadsheet.added, ["Sheet3"])
+        self.assertEqual(values[0], HEADER)
+        self.assertEqual(sorted(values[1:]), sorted(self.rows(0, 8)))
+
+if __name__ == "__main__":
+    unittest.main()
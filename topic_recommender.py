@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import heapq
+import random
+import threading
+import unicodedata
+from collections import Counter
+
+# 推薦の設定
+NGRAM_SIZE = 2  # 文字n-gramの長さ
+HISTORY_TURNS = 6  # 似ていないかを比べる直近の発話数
+CANDIDATES = 5  # 最近使っていない順に比べる候補数
+RECENCY_HORIZON = 1800  # この秒数たてば使った話題も新しい話題と同じ扱いにする
+DEFAULT_TOPIC = "最近気になることはありますか？"
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    """文字n-gramの出現回数を返す（空白と記号の違いは無視する）"""
+    text = unicodedata.normalize("NFKC", text)
+    text = "".join(ch for ch in text if ch.isalnum())
+    if len(text) < n:
+        return Counter([text]) if text else Counter()
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+def _norm(vector):
+    return math.sqrt(sum(v * v for v in vector.values()))
+
+def cosine_similarity(a, a_norm, b, b_norm):
+    """2つのn-gramベクトルのコサイン類似度"""
+    if not a_norm or not b_norm:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0) for k, v in a.items()) / (a_norm * b_norm)
+
+class TopicRecommender:
+    """話題のストックから、最近使っておらず直近の会話と似ていない話題を選ぶクラス
+
+    話題ごとの文字n-gramベクトルは追加時に一度だけ作る。話題は最後に使った時刻の
+    ヒープで管理し、最も長く使っていない数件だけを直近の発話と比べるため、
+    1回の推薦はO(log n)で済み、APIも呼ばない。
+    """
+
+    def __init__(self, topics=(), history_turns=HISTORY_TURNS, candidates=CANDIDATES,
+                 recency_horizon=RECENCY_HORIZON, clock=time.monotonic):
+        self.history_turns = history_turns
+        self.candidates = candidates
+        self.recency_horizon = recency_horizon
+        self.clock = clock
+        self.topics = []
+        self.vectors = []  # 話題ごとの (n-gramベクトル, ノルム)
+        self.index = {}  # 話題 -> 番号
+        self.heap = []  # (最後に使った時刻, 同時刻の並び順, 番号)。未使用は-inf
+        self.lock = threading.Lock()
+        for topic in topics:
+            self.add(topic)
+
+    def __len__(self):
+        return len(self.topics)
+
+    def add(self, topic):
+        """話題を追加する（追加済みならFalse）"""
+        with self.lock:
+            if not topic or topic in self.index:
+                return False
+            topic_id = len(self.topics)
+            vector = char_ngrams(topic)
+            self.topics.append(topic)
+            self.vectors.append((vector, _norm(vector)))
+            self.index[topic] = topic_id
+            # 未使用の話題は同じ順位なので、並び順はランダムにする
+            heapq.heappush(self.heap, (-math.inf, random.random(), topic_id))
+            return True
+
+    def _score(self, entry, context, context_norm, now):
+        """直近の発話と似ていないほど、長く使っていないほど高いスコア"""
+        last_used, _, topic_id = entry
+        freshness = min(1.0, (now - last_used) / self.recency_horizon)
+        similarity = cosine_similarity(*self.vectors[topic_id], context, context_norm)
+        return (1.0 - similarity) * freshness
+
+    def recommend(self, recent_texts=()):
+        """直近の発話と似ていない、長く使っていない話題を返し、使用済みにする"""
+        context = Counter()
+        for text in list(recent_texts)[-self.history_turns:]:
+            context.update(char_ngrams(text))
+        context_norm = _norm(context)
+
+        with self.lock:
+            if not self.heap:
+                return DEFAULT_TOPIC
+            now = self.clock()
+            candidates = [heapq.heappop(self.heap) for _ in range(min(self.candidates, len(self.heap)))]
+            best = max(candidates, key=lambda entry: self._score(entry, context, context_norm, now))
+            for entry in candidates:
+                if entry is best:
+                    heapq.heappush(self.heap, (now, random.random(), entry[2]))
+                else:
+                    heapq.heappush(self.heap, entry)
+            return self.topics[best[2]]
+
+if __name__ == "__main__":
+    # 同じセッションで話題が繰り返されず、直前の話と似た話題が避けられることを確認する
+    topics = ["好きな食べ物は何ですか？", "最近の天気はどうですか？", "昔の思い出について話しませんか？",
+              "好きな食べ物の思い出はありますか？", "最近見た映画を教えてください"]
+    recommender = TopicRecommender(topics, candidates=len(topics))
+    picked = [recommender.recommend(["昨日は好きな食べ物を食べました"]) for _ in range(len(topics))]
+    print(picked)
+    assert sorted(picked) == sorted(topics)
+    assert "食べ物" not in picked[0]
+    print("動作確認OK")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import queue
+import atexit
+import threading
+from topic_recommender import TopicRecommender
+
+# ストアの設定
+TOPICS_DIR = os.getenv("TOPICS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_history"))
+MAX_TOPICS = 100  # 最大トピック数
+COMPACT_EVERY = 20  # ログにこの件数たまったらスナップショットにまとめる
+
+# 保存済みの話題がない時に使うデフォルトのトピック
+DEFAULT_TOPICS = [
+    "今日はどんな一日でしたか？",
+    "最近見た映画や読んだ本について教えてください",
+    "お気に入りの食べ物は何ですか？",
+    "今日のニュースで気になることはありますか？",
+    "天気はどうですか？",
+    "何か楽しい予定はありますか？",
+    "最近うれしかったことを教えてください",
+    "健康のために何か気をつけていることはありますか？",
+    "昔の思い出について話しませんか？",
+    "今度の休みには何をする予定ですか？"
+]
+
+def write_json_atomic(path, data):
+    """一時ファイルに書いてから置き換えることで、途中で電源が落ちても壊れないように保存する"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_topics(storage_dir):
+    """スナップショット（topics.json）と追記ログ（topics.log）から話題一覧を読み込む"""
+    topics = []
+    snapshot_path = os.path.join(storage_dir, "topics.json")
+    log_path = os.path.join(storage_dir, "topics.log")
+    if os.path.exists(snapshot_path):
+        try:
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                topics = json.load(f)
+        except Exception as e:
+            print(f"トピック読み込みエラー: {e}")
+    if os.path.exists(log_path):
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    topics.append(json.loads(line))
+                except ValueError:
+                    # 書き込み途中で止まった行は読み飛ばす
+                    continue
+    return list(dict.fromkeys(topics))
+
+class TopicStore:
+    """話題を重複なく保持し、追加分だけを追記ログに書き込むストア
+
+    追加はメモリ上の集合で重複を判定し、ファイルへの書き込みはバックグラウンドの
+    スレッドで行う。ログが一定数たまるとスナップショットに書き直してログを空にする。
+    recommenderは話題の推薦器で、追加した話題はすぐに推薦の候補になる。
+    """
+
+    def __init__(self, storage_dir, max_topics=MAX_TOPICS, compact_every=COMPACT_EVERY):
+        self.storage_dir = storage_dir
+        self.snapshot_path = os.path.join(storage_dir, "topics.json")
+        self.log_path = os.path.join(storage_dir, "topics.log")
+        self.max_topics = max_topics
+        self.compact_every = compact_every
+        self.topics = load_topics(storage_dir)
+        self.seen = set(self.topics)
+        self.recommender = TopicRecommender(self.topics)
+        self.log_count = 0
+        self.lock = threading.Lock()
+        self.writes = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        atexit.register(self.flush)
+        # 前回のログは起動時にまとめる（書き込み途中の行の後ろに追記しないため）
+        if os.path.exists(self.log_path):
+            self.compact()
+
+    def exists(self):
+        """保存済みの話題があるかどうか"""
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.log_path)
+
+    def __contains__(self, text):
+        return text in self.seen
+
+    def __len__(self):
+        return len(self.topics)
+
+    def add(self, text):
+        """話題を追加する（重複や上限超過の場合はFalse）"""
+        with self.lock:
+            if text in self.seen or len(self.topics) >= self.max_topics:
+                return False
+            self.topics.append(text)
+            self.seen.add(text)
+        self.recommender.add(text)
+        self.writes.put(("append", text))
+        return True
+
+    def replace(self, topics):
+        """話題一覧を置き換えてスナップショットに保存する"""
+        with self.lock:
+            self.topics = list(dict.fromkeys(topics))
+            self.seen = set(self.topics)
+            self.recommender = TopicRecommender(self.topics)
+        self.writes.put(("compact", None))
+
+    def _write_loop(self):
+        while True:
+            op, text = self.writes.get()
+            try:
+                if op == "append":
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(text, ensure_ascii=False) + "\n")
+                    self.log_count += 1
+                    if self.log_count >= self.compact_every:
+                        self._compact()
+                elif op == "compact":
+                    self._compact()
+            except Exception as e:
+                print(f"トピック保存エラー: {e}")
+            finally:
+                self.writes.task_done()
+
+    def _compact(self):
+        """スナップショットを書き直し、追記ログを空にする"""
+        with self.lock:
+            topics = list(self.topics)
+        write_json_atomic(self.snapshot_path, topics)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.log_count = 0
+
+    def compact(self):
+        """スナップショットへのまとめを予約する"""
+        self.writes.put(("compact", None))
+
+    def flush(self):
+        """予約された書き込みが終わるまで待つ"""
+        self.writes.join()
+
+# ディレクトリごとの共有のストア（同じファイルに書き込むスレッドを1つにする）
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_topic_store(storage_dir=TOPICS_DIR):
+    """ディレクトリごとに共有のTopicStoreを返す（保存済みの話題がなければデフォルトで始める）"""
+    key = os.path.abspath(storage_dir)
+    with _stores_lock:
+        if key not in _stores:
+            os.makedirs(key, exist_ok=True)
+            store = TopicStore(key)
+            if not store.exists():
+                store.replace(DEFAULT_TOPICS)
+            _stores[key] = store
+        return _stores[key]
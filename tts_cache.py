@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+import soundfile as sf
+
+# キャッシュの設定
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache"))
+MAX_CACHE_MB = int(os.getenv("TTS_CACHE_MAX_MB", "200"))
+
+# 固定で読み上げる定型文（main.py / voice_calc_game.py / simple_chat_ui.py）
+SYSTEM_PHRASES = [
+    "もしもし。おしゃべり、脳トレゲーム、ポッツに接続のどれをしますか？",
+    "おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？",
+    "もう一度お願いします。おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？",
+    "おしゃべりしましょう",
+    "おしゃべりを終了しました。次は何かしますか？おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？",
+    "脳トレゲームをしましょう",
+    "脳トレゲームを終了しました。次は何かしますか？おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？",
+    "ポッツへの接続を開始します",
+    "ポッツに接続しました。次は何かしますか？おしゃべり、脳トレゲーム、ポッツに接続、または終了しますか？",
+    "選んでください",
+    "プログラムを終了します。",
+    "会話を終了します。",
+    "今日はどのようにお過ごしですか？",
+    "楽しかったことはありました？",
+    "何のお話が良いですか？",
+    "すみません、もう一度お願いします。",
+    "はい", "ええ", "そうですね",
+    "計算問題を出しますので、答えを言ってください。",
+    "全部で10問です。途中でゲームを終了するには、「終了」と言ってください。",
+    "もう一度同じ問題を出します。",
+    "正解です！",
+    "数字で答えてください。",
+    "ゲームを終了します。",
+    "聞き取りが悪く不正解だった場合は、ごめんなさい。くじけずトレーニングしましょう。お疲れ様でした。",
+]
+
+def cache_key(text, voice, rate):
+    """テキスト・声・速度から内容に基づくキーを作る"""
+    data = f"{voice}\0{rate}\0{text}".encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+class TTSCache:
+    """合成済み音声をディスクに保存し、容量を超えたら古いものから削除するキャッシュ"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # キー -> ファイルサイズ（古い順）
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def _load_index(self):
+        """既存のキャッシュファイルを最終利用日時の古い順に並べる"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".wav"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def get(self, text, voice, rate):
+        """キャッシュがあれば (音声データ, サンプリングレート) を返す"""
+        key = cache_key(text, voice, rate)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            samples, samplerate = sf.read(path, dtype="int16")
+            # 最終利用日時を更新して再起動後もLRUの順序を保つ
+            os.utime(path)
+            return samples, samplerate
+        except Exception as e:
+            print(f"音声キャッシュ読み込みエラー: {e}")
+            self._remove(key)
+            return None
+
+    def put(self, text, voice, rate, samples, samplerate):
+        """合成した音声を保存する"""
+        key = cache_key(text, voice, rate)
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            sf.write(tmp_path, samples, samplerate, subtype="PCM_16", format="WAV")
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"音声キャッシュ保存エラー: {e}")
+            return
+        size = os.path.getsize(path)
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self._evict()
+
+    def _remove(self, key):
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """容量を超えた分を最終利用日時の古いものから削除する"""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+class CachedEngine:
+    """合成エンジンの前にキャッシュを挟むラッパー"""
+
+    def __init__(self, engine, cache):
+        self.engine = engine
+        self.cache = cache
+        self.voice = engine.voice
+        self.rate = engine.rate
+
+    def synthesize(self, text):
+        """キャッシュにあればそれを、なければ合成して保存したものを返す"""
+        cached = self.cache.get(text, self.voice, self.rate)
+        if cached is not None:
+            return cached
+        samples, samplerate = self.engine.synthesize(text)
+        self.cache.put(text, self.voice, self.rate, samples, samplerate)
+        return samples, samplerate
+
+def static_phrases():
+    """事前に合成しておく定型文の一覧を返す"""
+    import aizuchi
+    phrases = list(SYSTEM_PHRASES)
+    for responses in aizuchi.EMOTION_RESPONSES.values():
+        phrases.extend(responses)
+    phrases.extend(aizuchi.DEFAULT_RESPONSES)
+    from topic_store import get_topic_store
+    try:
+        phrases.extend(get_topic_store().topics)
+    except Exception as e:
+        print(f"話題リストの読み込みに失敗: {e}")
+    return list(dict.fromkeys(phrases))
+
+def warmup():
+    """定型文をすべて合成してキャッシュに入れる（インストール時に実行）"""
+    import speech_output
+    engine = speech_output.get_engine()
+    sentences = []
+    for phrase in static_phrases():
+        sentences.extend(speech_output.split_sentences(phrase))
+    sentences = list(dict.fromkeys(sentences))
+    for i, sentence in enumerate(sentences, 1):
+        try:
+            engine.synthesize(sentence)
+            print(f"[{i}/{len(sentences)}] {sentence}")
+        except Exception as e:
+            print(f"[{i}/{len(sentences)}] 合成失敗: {sentence} ({e})")
+    print(f"音声キャッシュを準備しました: {CACHE_DIR}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--warmup":
+        warmup()
+    else:
+        print("使い方: python3 tts_cache.py --warmup")
@@ -2,10 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import random
-import subprocess
 import time
-import re
-from conversation_manager import ConversationManager
 from speech_output import speak
 from datetime import datetime
 from file_operations import save_calc_game_result
@@ -17,6 +14,47 @@ KANJI_NUMS = {
     "じゅう": 10, "ひゃく": 100
 }
 
+# 問題に使う数の範囲（回答の語彙の範囲もここから決める）
+EASY_RANGE = (1, 9)  # level=1
+ADD_RANGE = (10, 99)  # level=2のたし算・ひき算
+MUL_RANGE = (2, 12)  # level=2のかけ算・わり算
+MIN_ANSWER = EASY_RANGE[0] - EASY_RANGE[1]  # 1ひく9
+MAX_ANSWER = max(2 * ADD_RANGE[1], MUL_RANGE[1] ** 2)  # 99たす99
+
+# ゲームの進め方
+TOTAL_QUESTIONS = 10  # 問題数
+HARD_FROM = 6  # この問題から難易度アップ
+PROGRESS_AT = (5, 10)  # 途中経過をアナウンスする問題
+INTRO_MESSAGES = [
+    "計算問題を出しますので、答えを言ってください。",
+    f"全部で{TOTAL_QUESTIONS}問です。途中でゲームを終了するには、「終了」と言ってください。",
+]
+RETRY_MESSAGE = "もう一度同じ問題を出します。"
+CLOSING_MESSAGE = "聞き取りが悪く不正解だった場合は、ごめんなさい。くじけずトレーニングしましょう。お疲れ様でした。"
+
+# 数の読み（Voskの辞書にある単語だけを使う）
+DIGIT_WORDS = ["ぜろ", "いち", "に", "さん", "よん", "ご", "ろく", "なな", "はち", "きゅう"]
+
+def number_words(n):
+    """0〜999の数を読みの単語の列にする（例: 198 → ひゃく きゅう じゅう はち）"""
+    if n == 0:
+        return [DIGIT_WORDS[0]]
+    words = []
+    for value, unit in ((100, "ひゃく"), (10, "じゅう")):
+        count, n = divmod(n, value)
+        if count > 1:
+            words.append(DIGIT_WORDS[count])
+        if count:
+            words.append(unit)
+    if n:
+        words.append(DIGIT_WORDS[n])
+    return words
+
+# 回答の認識で使う語彙（Voskの認識文法）。答えになりうる数はすべて単語の列として入れる
+ANSWER_VOCABULARY = [
+    " ".join(["マイナス"] * (n < 0) + number_words(abs(n))) for n in range(MIN_ANSWER, MAX_ANSWER + 1)
+] + ["終了"]
+
 def japanese_number_to_int(text):
     """日本語の数字（1〜99程度、マイナス対応、フィラー・空白除去）を数値に変換"""
     if not text:
@@ -57,47 +95,42 @@ def japanese_number_to_int(text):
     return -value if is_negative else value
 
 class VoiceCalculationGame:
-    """音声による計算ゲーム"""
+    """音声による計算ゲーム
+
+    出題・採点・結果の保存を1問ずつの手順に分けており、聞き取りと読み上げは
+    呼び出し側が行う。run_game()はこの手順を同期的に実行し、
+    session_orchestrator.pyは同じ手順を中止できる非同期のモードとして実行する。
+    """
     
-    def __init__(self):
+    def __init__(self, total_questions=TOTAL_QUESTIONS):
         """初期化"""
-        self.conversation_manager = ConversationManager()
+        self.total_questions = total_questions
+        self.start()
         
     def speak(self, text):
-        print(f"コンピュータ: {text}")
-        self.conversation_manager.add_to_conversation("system", text)
-        m = re.search(r'(.*)は([？?])', text)
-        if m:
-            before = m.group(1)
-            after = m.group(2)
-            # 前半を日本語で
-            if before:
-                subprocess.run(['say', '-v', 'Kyoko', before])
-            # 「wa?」を英語で
-            subprocess.run(['say', '-v', 'Samantha', 'wa' + after])
-        else:
-            subprocess.run(['say', '-v', 'Kyoko', text])
+        """読み上げる（「〜は？」の読み方は合成エンジン側で直す）"""
+        return speak(text)
     
     def generate_question(self, level=1):
         """計算問題を生成（level=1:簡単, level=2:難しい）"""
         if level == 1:
-            a = random.randint(1, 9)
-            b = random.randint(1, 9)
+            a = random.randint(*EASY_RANGE)
+            b = random.randint(*EASY_RANGE)
             operator = random.choice(["+", "-", "*"])
         else:
             operator = random.choice(["+", "-", "*", "/"])
             if operator == "+":
-                a = random.randint(10, 99)
-                b = random.randint(10, 99)
+                a = random.randint(*ADD_RANGE)
+                b = random.randint(*ADD_RANGE)
             elif operator == "-":
-                a = random.randint(10, 99)
-                b = random.randint(10, a)  # a >= b
+                a = random.randint(*ADD_RANGE)
+                b = random.randint(ADD_RANGE[0], a)  # a >= b
             elif operator == "*":
-                a = random.randint(2, 12)
-                b = random.randint(2, 12)
+                a = random.randint(*MUL_RANGE)
+                b = random.randint(*MUL_RANGE)
             else:  # "/"
-                b = random.randint(2, 12)
-                answer = random.randint(2, 12)
+                b = random.randint(*MUL_RANGE)
+                answer = random.randint(*MUL_RANGE)
                 a = b * answer  # 割り切れるように
         
         if operator == "+":
@@ -113,65 +146,90 @@ class VoiceCalculationGame:
             question = f"問題です。{a}わる{b}は？"
         return question, answer
     
+    def start(self):
+        """スコアと結果を初期化し、時間の計測を始める"""
+        self.score = 0
+        self.asked = 0
+        self.detail_results = []
+        self.start_time = time.time()
+        self.end_time = None
+    
+    def next_question(self, i):
+        """i問目の (問題, 正解) を返す（HARD_FROM問目以降は難易度アップ）"""
+        self.asked = i
+        question, answer = self.generate_question(level=1 if i < HARD_FROM else 2)
+        print(f"【出題】{question}")  # 問題と正解を表示
+        return question, answer
+    
+    def skip(self, i):
+        """聞き取れなかった問題を記録し、画面に表示する結果を返す"""
+        self.detail_results.append(f"{i}問目: スキップ")
+        return "スキップ"
+    
+    def grade(self, i, response, answer):
+        """回答を採点し、(画面に表示する結果, 読み上げる文のリスト, 終了するか) を返す"""
+        if "終了" in response:
+            self.detail_results.append(f"{i}問目: ユーザーが終了を選択")
+            return "終了します", [], True
+        try:
+            # 日本語数字→数値変換
+            user_answer = japanese_number_to_int(response)
+            print(f"【ユーザー発話】{response} → 【変換後】{user_answer}")  # 認識結果と変換後数値を表示
+        except Exception:
+            print(f"【ユーザー発話】{response} → 【変換失敗】")
+            self.detail_results.append(f"{i}問目: 無効回答")
+            return "無効な回答", ["数字で答えてください。"], False
+        if user_answer == answer:
+            self.score += 1
+            self.detail_results.append(f"{i}問目: 正解")
+            result, messages = "正解！", ["正解です！"]
+        else:
+            self.detail_results.append(f"{i}問目: 不正解（答: {answer}）")
+            result, messages = f"不正解（正解: {answer}）", [f"残念、正解は{answer}でした。"]
+        # 途中経過をアナウンス
+        if i in PROGRESS_AT:
+            messages.append(f"{i}問目が終わりました。ここまで{self.score}問正解です。")
+        return result, messages, False
+    
+    def finish(self):
+        """時間の計測を終え、終了時に読み上げる文のリストを返す"""
+        self.end_time = time.time()
+        return [f"ゲーム終了です。{self.asked}問中{self.score}問正解でした。", CLOSING_MESSAGE]
+    
+    def save_result(self):
+        """Googleスプレッドシート（Sheet2）に記録"""
+        return save_calc_game_result(self.start_time, self.end_time, self.score, self.asked, self.detail_results)
+    
     def run_game(self):
         """ゲームを実行（10問固定、途中経過アナウンス、難易度調整）"""
-        speak("計算問題を出しますので、答えを言ってください。")
-        speak("全部で10問です。途中でゲームを終了するには、「終了」と言ってください。")
+        for text in INTRO_MESSAGES:
+            self.speak(text)
         
-        score = 0
-        total_questions = 10
-        detail_results = []
-        start_time = time.time()
-        
-        for i in range(1, total_questions + 1):
-            # 5問目以降は難易度アップ
-            level = 1 if i <= 5 else 2
-            question, answer = self.generate_question(level=level)
-            speak(question)
-            print(f"【出題】{question}")  # 問題と正解を表示
+        self.start()
+        for i in range(1, self.total_questions + 1):
+            question, answer = self.next_question(i)
+            self.speak(question)
             
-            response = listen()
-            if response is None:
+            response = listen(ANSWER_VOCABULARY)
+            if not response:
                 # もう一度同じ問題を出します。
-                speak("もう一度同じ問題を出します。")
-                speak(question)
-                response = listen()
-                if response is None:
-                    detail_results.append(f"{i}問目: スキップ")
+                self.speak(RETRY_MESSAGE)
+                self.speak(question)
+                response = listen(ANSWER_VOCABULARY)
+                if not response:
+                    self.skip(i)
                     continue
             
-            if "終了" in response:
-                detail_results.append(f"{i}問目: ユーザーが終了を選択")
+            _, messages, finished = self.grade(i, response, answer)
+            for text in messages:
+                self.speak(text)
+            if finished:
                 break
-            
-            try:
-                # 日本語数字→数値変換
-                user_answer = japanese_number_to_int(response)
-                print(f"【ユーザー発話】{response} → 【変換後】{user_answer}")  # 認識結果と変換後数値を表示
-                if user_answer == answer:
-                    speak("正解です！")
-                    score += 1
-                    detail_results.append(f"{i}問目: 正解")
-                else:
-                    speak(f"残念、正解は{answer}でした。")
-                    detail_results.append(f"{i}問目: 不正解（答: {answer}）")
-            except Exception:
-                print(f"【ユーザー発話】{response} → 【変換失敗】")
-                speak("数字で答えてください。")
-                detail_results.append(f"{i}問目: 無効回答")
-                continue
-            
-            # 5問目と10問目で途中経過をアナウンス
-            if i == 5 or i == 10:
-                speak(f"{i}問目が終わりました。ここまで{score}問正解です。")
-        
-        end_time = time.time()
-        speak(f"ゲーム終了です。{i}問中{score}問正解でした。")
-        speak("聞き取りが悪く不正解だった場合は、ごめんなさい。くじけずトレーニングしましょう。お疲れ様でした。")
         
-        # Googleスプレッドシート（Sheet2）に記録
-        save_calc_game_result(start_time, end_time, score, i, detail_results)
+        for text in self.finish():
+            self.speak(text)
+        self.save_result()
 
 if __name__ == "__main__":
     game = VoiceCalculationGame()
-    game.run_game() 
\ No newline at end of file
+    game.run_game()